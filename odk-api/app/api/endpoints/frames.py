@@ -10,6 +10,8 @@ from pydantic import ValidationError
 
 from app.log.messages import JSON_DECODE_ERROR, KEY_ERROR
 from app.broker.producer import queue_raw_frame
+from app.core import tracing
+from app.core.config import TRACE_SAMPLE_RATE
 from app.logic.users import get_current_active_user
 
 from app import schemas
@@ -61,6 +63,8 @@ async def stream(websocket: WebSocket) -> None:
         while True:
             # 1) Retrieve raw frame
             stream_data = await websocket.receive_json()
+            trace = tracing.TraceContext.start(TRACE_SAMPLE_RATE)
+            trace.stamp("api_received_at")
 
             # 2) Build RawFrame object
             raw_frame = _create_raw_frame(stream_data)
@@ -68,7 +72,7 @@ async def stream(websocket: WebSocket) -> None:
                 raw_frame.taken_at))
 
             # 3) Queue RawFrame to be analysed
-            await queue_raw_frame(raw_frame)
+            await queue_raw_frame(raw_frame, trace)
 
     except WebSocketDisconnect:
         message = "Websocket connection disconnected"
@@ -119,12 +123,14 @@ async def receive_raw_frame(
 ) -> JSONResponse:
     response_status_code: int = 500
     response_content: dict = {}
+    trace = tracing.TraceContext.start(TRACE_SAMPLE_RATE)
+    trace.stamp("api_received_at")
 
     try:
         raw_frame = _create_raw_frame(frame_dict)
         logger.debug("Received frame taken at: {}".format(raw_frame.taken_at))
 
-        await queue_raw_frame(raw_frame)
+        await queue_raw_frame(raw_frame, trace)
 
         response_status_code = 200
         response_content = {"success": "Raw frame successfully posted"}
@@ -6,11 +6,11 @@ from fastapi import APIRouter, Depends
 from fastapi.exceptions import HTTPException
 from fastapi.security import OAuth2PasswordRequestForm
 from starlette.responses import JSONResponse
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.config import ACCESS_TOKEN_EXPIRE_MINUTES
 from app.core.security import create_access_token
-from app.db.session import get_db
+from app.db.session import get_async_db
 
 from app import schemas
 from app import crud
@@ -18,11 +18,11 @@ from app import crud
 router = APIRouter()
 
 @router.post("/login", response_model=schemas.Token)
-def login(
-    db: Session = Depends(get_db),
+async def login(
+    db: AsyncSession = Depends(get_async_db),
     form_data: OAuth2PasswordRequestForm = Depends()
 ) -> Any:
-    user = crud.user.authentication(
+    user = await crud.user.authentication(
         db, email=form_data.username, password=form_data.password
     )
     if not user:
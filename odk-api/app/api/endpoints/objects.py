@@ -1,12 +1,12 @@
-from typing import Dict
+from typing import Dict, List, Optional
 from datetime import datetime, timedelta
 
 from loguru import logger
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
 from fastapi.exceptions import HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.db.session import get_db
+from app.db.session import get_async_db
 from app.logic.services import get_detected_objects
 
 from app import models
@@ -17,13 +17,22 @@ router = APIRouter()
 
 
 @router.get("/detected_objects")
-async def detected_objects(stream_id: str, day: str, db: Session = Depends(get_db)) -> Dict:
+async def detected_objects(
+    day: str,
+    stream_id: List[str] = Query(...),
+    bucket: Optional[str] = Query(None, regex="^(hour|15min)$"),
+    db: AsyncSession = Depends(get_async_db),
+) -> Dict:
+    """
+    Sums the detected objects of a day. Repeat `stream_id` to query multiple streams,
+    and set `bucket` to `hour` or `15min` to also group the counts by time.
+    """
     try:
         start_date = datetime.strptime(day, "%Y-%m-%d")
         end_date = start_date + timedelta(days=1)
 
-        detected_objects = get_detected_objects(
-            db=db, stream_id=stream_id, _from=start_date, _till=end_date
+        detected_objects = await get_detected_objects(
+            db=db, stream_ids=stream_id, _from=start_date, _till=end_date, bucket=bucket
         )
         logger.debug("Returning detected objects from '{}' till '{}' of stream_id '{}'".format(
             start_date, end_date, stream_id
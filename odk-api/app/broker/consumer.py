@@ -1,24 +1,45 @@
 import json
+import uuid
+from datetime import datetime
 from json.decoder import JSONDecodeError
+from typing import Union
 
 from loguru import logger
 from aio_pika import IncomingMessage
+from pydantic.datetime_parse import parse_datetime
 
-from app.models.frame import AnalysedFrame
-from app.logic.services import persist_analysed_frame
+from app.broker.writer import analysed_frame_writer
+from app.core import tracing
+from app.core.config import TRACE_SAMPLE_RATE
 from app.log.messages import JSON_DECODE_ERROR, KEY_ERROR
-from app.db.session import get_session
+
+
+def _parse_taken_at(taken_at: Union[str, datetime]) -> datetime:
+    """
+    Parses the ISO timestamp of a frame for the `taken_at` column, which is a timestamp
+    without time zone. asyncpg only accepts datetimes for it, and like Postgres does for
+    such a column, an offset is dropped instead of converted.
+    """
+    return parse_datetime(taken_at).replace(tzinfo=None)
 
 
 async def handle_analysed_frame(message: IncomingMessage) -> None:
+    """
+    Reads an analysed frame from a message and hands it to the buffered writer,
+    which acknowledges the message once the frame is committed to the database.
+    The trace of the frame is continued from the `trace` header.
+    """
+    trace = tracing.TraceContext.from_headers(message.headers, TRACE_SAMPLE_RATE)
+    trace.stamp("consumer_received_at")
+
     try:
-        message.ack()
         analysed_frame_dict = json.loads(message.body.decode("utf-8"))
 
         logger.debug("Receiving analysed frame")
 
-        analysed_frame = AnalysedFrame(
-            taken_at=analysed_frame_dict["taken_at"],
+        analysed_frame = dict(
+            id=uuid.uuid4(),
+            taken_at=_parse_taken_at(analysed_frame_dict["taken_at"]),
             lat_lng=analysed_frame_dict["lat_lng"],
             stream_id=analysed_frame_dict["stream_id"],
             detected_objects=analysed_frame_dict["detected_objects"],
@@ -29,14 +50,24 @@ async def handle_analysed_frame(message: IncomingMessage) -> None:
             classification=analysed_frame_dict["classification"]
         )
 
-        persist_analysed_frame(get_session(), analysed_frame)
-
+    # Messages that can never be persisted are acknowledged, so they're not redelivered
     except JSONDecodeError:
+        message.ack()
         logger.error(JSON_DECODE_ERROR)
+        return
 
     except KeyError as e:
+        message.ack()
         logger.error(KEY_ERROR.format(e))
+        return
+
+    except (TypeError, ValueError) as e:
+        message.ack()
+        logger.error(f"Invalid `taken_at` of analysed frame: {e}")
+        return
 
     except Exception as e:
         logger.error(e)
         raise e
+
+    await analysed_frame_writer.add(analysed_frame, message, trace)
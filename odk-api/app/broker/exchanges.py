@@ -6,6 +6,7 @@ from aio_pika import ExchangeType
 from app.core.config import SINGLE_ROUTING_KEY
 from app.core.config import EXCHANGE_RAW_FRAMES, QUEUE_RAW_FRAMES
 from app.core.config import EXCHANGE_ANALYSED_FRAMES, QUEUE_ANALYSED_FRAMES
+from app.core.config import ANALYSED_FRAMES_BATCH_SIZE
 
 from app.broker.connection import get_connection
 from app.broker.consumer import handle_analysed_frame
@@ -41,7 +42,9 @@ async def setup_queues() -> None:
         exchange=exchange_analysed_frames, routing_key=SINGLE_ROUTING_KEY
     )
 
-    # setup listining to queue
+    # setup listining to queue, analysed frames are acknowledged per written batch,
+    # so allow enough unacknowledged messages to fill up a batch
+    await channel.set_qos(prefetch_count=2 * ANALYSED_FRAMES_BATCH_SIZE)
     await queue_analysed_frames.consume(handle_analysed_frame)
 
     logger.info("Exchanges & queues setup!")
@@ -1,27 +1,71 @@
+import base64
+
 from aio_pika import Message
 from aio_pika.exchange import Exchange
 from loguru import logger
 
 from app.broker.exchanges import exchanges
 from app.core.config import EXCHANGE_RAW_FRAMES, SINGLE_ROUTING_KEY
+from app.core.config import RAW_FRAME_TRANSPORT, RAW_FRAME_META_HEADER, TRACE_SAMPLE_RATE
+from app.core import tracing
 
 from app import schemas
 
-async def queue_raw_frame(raw_frame: schemas.RawFrame) -> None:
+
+def _create_raw_frame_message(raw_frame: schemas.RawFrame, trace: tracing.TraceContext) -> Message:
+    """
+    Creates the message for a RawFrame object, in the format set by `RAW_FRAME_TRANSPORT`.
+
+    In binary format the image is decoded from base64 once here, and sent as message body,
+    the rest of the frame is sent as JSON in the `frame_meta` header.
+    The frame analyzer reads the format from the content type, so both formats can be mixed.
+    In both formats the trace of the frame is sent in the `trace` header.
+    """
+    if RAW_FRAME_TRANSPORT == "binary":
+        img = raw_frame.img
+        # Remove `data:image/jpeg;base64,` from string
+        if img.find(",") > -1:
+            img = img.split(",")[1]
+
+        return Message(
+            base64.b64decode(img),
+            content_type="image/jpeg",
+            headers={
+                RAW_FRAME_META_HEADER: raw_frame.json(exclude={"img"}),
+                tracing.TRACE_HEADER: trace.to_header(),
+            },
+        )
+
+    return Message(
+        raw_frame.json().encode("utf8"),
+        content_type="application/json",
+        headers={tracing.TRACE_HEADER: trace.to_header()},
+    )
+
+
+async def queue_raw_frame(raw_frame: schemas.RawFrame, trace: tracing.TraceContext = None) -> None:
     """
     Queuing a RawFrame object.
 
-    TODO: add more documentation
+    Args:
+        raw_frame (schemas.RawFrame): The frame to be analysed
+        trace (tracing.TraceContext, optional): Trace started when the frame was received,
+        a new trace is started when not given
     """
     try:
         exchange_raw_frames: Exchange = exchanges.get(EXCHANGE_RAW_FRAMES)
 
+        trace = trace or tracing.TraceContext.start(TRACE_SAMPLE_RATE)
+        trace.stamp("api_queued_at")
         await exchange_raw_frames.publish(
-            message=Message(raw_frame.json().encode("utf8")),
+            message=_create_raw_frame_message(raw_frame, trace),
             routing_key=SINGLE_ROUTING_KEY,
         )
         logger.debug("Raw frame queued")
 
+        if trace.sampled:
+            tracing.export(trace.span("ingest", "api_received_at", stream_id=raw_frame.stream_id))
+
     except Exception as e:
         logger.error(e)
         raise e
@@ -0,0 +1,148 @@
+import asyncio
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from loguru import logger
+from aio_pika import IncomingMessage
+from sqlalchemy.exc import InterfaceError, OperationalError
+
+from app.core import tracing
+from app.core.config import ANALYSED_FRAMES_BATCH_SIZE, ANALYSED_FRAMES_BATCH_TIMEOUT
+from app.logic.services import persist_analysed_frames
+from app.db.session import get_async_session
+
+# Errors after which writing is retried, instead of errors in the data of the frames
+CONNECTION_ERRORS = (OperationalError, InterfaceError, OSError)
+
+
+class AnalysedFrameWriter:
+    """
+    Buffers analysed frames received from the queue and writes them to the database
+    in batches, with one multi-row INSERT and one commit per batch.
+
+    A batch is written once `batch_size` frames are waiting, or once the first waiting frame
+    has waited `batch_timeout` milliseconds. The messages of a batch are only acknowledged
+    after the batch is committed. When the database can't be reached the whole batch is
+    requeued, when the data of a frame is rejected (e.g. `DataError`, `IntegrityError`) the
+    frames are written one by one, and the messages of rejected frames are dropped, or
+    dead-lettered when the queue has a dead letter exchange, instead of redelivered forever.
+
+    The trace of every frame is stamped with the start of the write and stored in
+    `analyser_meta['trace']`, sampled traces export their spans after the commit.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = ANALYSED_FRAMES_BATCH_SIZE,
+        batch_timeout: int = ANALYSED_FRAMES_BATCH_TIMEOUT,
+    ):
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+
+        self._buffer: List[Tuple[Dict, IncomingMessage, Optional[tracing.TraceContext]]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # Flushes started by the timer, referenced until done so they aren't garbage collected
+        self._flush_tasks: Set[asyncio.Task] = set()
+
+    async def add(
+        self, analysed_frame: Dict, message: IncomingMessage, trace: tracing.TraceContext = None
+    ) -> None:
+        """Adds an analysed frame to the buffer, writes the buffer when it's full"""
+        self._buffer.append((analysed_frame, message, trace))
+
+        if len(self._buffer) >= self.batch_size:
+            await self.flush()
+        elif self._timer is None:
+            loop = asyncio.get_running_loop()
+            self._timer = loop.call_later(self.batch_timeout / 1000, self._start_flush)
+
+    def _start_flush(self) -> None:
+        task = asyncio.ensure_future(self.flush())
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_done)
+
+    def _flush_done(self, task: asyncio.Task) -> None:
+        self._flush_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Could not flush analysed frames: {task.exception()}")
+
+    async def close(self) -> None:
+        """Waits for running flushes and writes the frames that are still buffered"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._flush_tasks:
+            await asyncio.gather(*self._flush_tasks, return_exceptions=True)
+        await self.flush()
+
+    async def flush(self) -> None:
+        """Writes all buffered analysed frames and acknowledges their messages"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._buffer = self._buffer, []
+        if not batch:
+            return
+
+        write_started_at = time.time()
+        for analysed_frame, _, trace in batch:
+            if trace is not None:
+                trace.stamp("db_write_started_at", write_started_at)
+                analysed_frame["analyser_meta"] = {**analysed_frame["analyser_meta"], "trace": trace.to_dict()}
+
+        rows = [analysed_frame for analysed_frame, _, _ in batch]
+        try:
+            await persist_analysed_frames(get_async_session(), rows)
+
+        except CONNECTION_ERRORS as e:
+            logger.error(f"Could not write batch of {len(batch)} analysed frames: {e}")
+            for _, message, _ in batch:
+                message.nack(requeue=True)
+            return
+
+        except Exception as e:
+            logger.error(f"Batch of {len(batch)} analysed frames rejected, writing them one by one: {e}")
+            batch = await self._write_one_by_one(batch)
+
+        else:
+            for _, message, _ in batch:
+                message.ack()
+            logger.debug(f"Persisted batch of {len(batch)} analysed frames")
+
+        for analysed_frame, _, trace in batch:
+            if trace is not None and trace.sampled:
+                stream_id = analysed_frame["stream_id"]
+                tracing.export(
+                    trace.span("analysed_frame_queue", "worker_published_at", "consumer_received_at", stream_id),
+                    trace.span("write_buffer", "consumer_received_at", "db_write_started_at", stream_id),
+                    trace.span("db_write", "db_write_started_at", stream_id=stream_id, batch_size=len(batch)),
+                    trace.span("frame", "api_received_at", stream_id=stream_id),
+                )
+
+
+    async def _write_one_by_one(self, batch: List[Tuple]) -> List[Tuple]:
+        """Writes the frames of a rejected batch separately, returns the written ones"""
+        written = []
+        for index, (analysed_frame, message, trace) in enumerate(batch):
+            try:
+                await persist_analysed_frames(get_async_session(), [analysed_frame])
+
+            except CONNECTION_ERRORS as e:
+                logger.error(f"Could not write analysed frames: {e}")
+                for _, remaining, _ in batch[index:]:
+                    remaining.nack(requeue=True)
+                break
+
+            except Exception as e:
+                logger.error(f"Dropping analysed frame of stream {analysed_frame.get('stream_id')}: {e}")
+                message.nack(requeue=False)
+
+            else:
+                message.ack()
+                written.append((analysed_frame, message, trace))
+
+        return written
+
+
+analysed_frame_writer = AnalysedFrameWriter()
@@ -27,8 +27,18 @@ ALLOWED_HOSTS: List[str] = config(
 )
 
 DATABASE_URL: DatabaseURL = config("DATABASE_URL", cast=DatabaseURL)
+# Same database, through the asyncio driver used by the endpoints and the consumer
+ASYNC_DATABASE_URL: DatabaseURL = DATABASE_URL.replace(driver="asyncpg")
+DB_POOL_SIZE: int = config("DB_POOL_SIZE", cast=int, default=10)
+DB_MAX_OVERFLOW: int = config("DB_MAX_OVERFLOW", cast=int, default=20)
 BROKER_URL: str = config("BROKER_URL")
 
+# Partition `analysed_frames_v1` by month of `taken_at` (requires PostgreSQL 11+).
+# Only applies when the table is created, an existing table is not converted.
+ANALYSED_FRAMES_PARTITIONED: bool = config("ANALYSED_FRAMES_PARTITIONED", cast=bool, default=False)
+# Number of months after the current month for which partitions are created, on startup and every hour after
+ANALYSED_FRAMES_PARTITIONS_AHEAD: int = config("ANALYSED_FRAMES_PARTITIONS_AHEAD", cast=int, default=3)
+
 LOGGING_LEVEL = logging.DEBUG if DEBUG else logging.INFO
 
 # RabbitMQ
@@ -38,3 +48,18 @@ EXCHANGE_RAW_FRAMES = "exchange_raw_frames"
 QUEUE_ANALYSED_FRAMES = "queue_analysed_frames"
 EXCHANGE_ANALYSED_FRAMES = "exchange_analysed_frames"
 SINGLE_ROUTING_KEY = "frame"
+
+# Analysed frames are written to the database in batches of at most
+# `ANALYSED_FRAMES_BATCH_SIZE` rows, or after `ANALYSED_FRAMES_BATCH_TIMEOUT` milliseconds
+ANALYSED_FRAMES_BATCH_SIZE: int = config("ANALYSED_FRAMES_BATCH_SIZE", cast=int, default=100)
+ANALYSED_FRAMES_BATCH_TIMEOUT: int = config("ANALYSED_FRAMES_BATCH_TIMEOUT", cast=int, default=200)
+
+# Wire format of raw frames: "json" (base64 image inside JSON) or
+# "binary" (JPEG as message body, the rest of the frame in the `frame_meta` header)
+RAW_FRAME_TRANSPORT: str = config("RAW_FRAME_TRANSPORT", default="json")
+RAW_FRAME_META_HEADER = "frame_meta"
+
+# Tracing of frames from ingest to the database, see `app.core.tracing`: the fraction of frames
+# of which spans are exported, and where to: a JSONL file or a collector on udp://host:port
+TRACE_SAMPLE_RATE: float = config("TRACE_SAMPLE_RATE", cast=float, default=0.01)
+TRACE_EXPORT: str = config("TRACE_EXPORT", default="")
@@ -2,23 +2,23 @@ from app.schemas.user import UserCreate
 from typing import Callable
 
 from loguru import logger
-from sqlalchemy.orm import session
 
 from app.db.events import ping as ping_db
 from app.db.events import init as init_db
 from app.broker.exchanges import setup_queues
+from app.broker.writer import analysed_frame_writer
 
 from app.core.config import ADMIN_EMAIL, ADMIN_PASSWORD, ADMIN_USERNAME
 from app.models import User
 from app.crud import user
-from app.db.session import get_session
+from app.db.session import get_async_session
 
 
 async def create_base_user() -> User:
-    db_session = get_session()
+    db_session = get_async_session()
 
     try:
-        if base_user := user.get_by_email(db=db_session, email=ADMIN_EMAIL):
+        if base_user := await user.get_by_email(db=db_session, email=ADMIN_EMAIL):
             return base_user
         
         new_base_user = UserCreate(
@@ -28,7 +28,7 @@ async def create_base_user() -> User:
             full_name=ADMIN_USERNAME
         )
 
-        db_user = user.create(
+        db_user = await user.create(
             db=db_session,
             obj_in=new_base_user
         )
@@ -38,7 +38,7 @@ async def create_base_user() -> User:
         logger.error(e)
         raise e
     finally:
-        db_session.close()
+        await db_session.close()
 
 def create_start_app_handler() -> Callable:
     async def start_app() -> None:
@@ -55,3 +55,11 @@ def create_start_app_handler() -> Callable:
 
     return start_app
 
+
+def create_stop_app_handler() -> Callable:
+    async def stop_app() -> None:
+        # Write the analysed frames still waiting for their batch, so they're acknowledged
+        await analysed_frame_writer.close()
+
+    return stop_app
+
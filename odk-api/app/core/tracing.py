@@ -0,0 +1,166 @@
+"""
+Tracing of frames from ingest to their row in `analysed_frames_v1`.
+
+A trace is started for every frame received on `/frames/stream` or `POST /raw_frame`,
+and travels with the frame in the `trace` header of the raw frame message, through the
+frame analyzer, back in the `trace` header of the analysed frame message. Every hop stamps
+the (epoch) time it handled the frame, ending with `db_write_started_at` here, and the trace
+is stored in `analyser_meta['trace']` of the row:
+
+    SELECT stream_id,
+           avg((analyser_meta->'trace'->'hops'->>'worker_received_at')::float
+               - (analyser_meta->'trace'->'hops'->>'api_queued_at')::float) AS raw_frame_queue,
+           avg((analyser_meta->>'ml_time_taken')::float) AS detect,
+           avg((analyser_meta->'trace'->'hops'->>'db_write_started_at')::float
+               - (analyser_meta->'trace'->'hops'->>'worker_published_at')::float) AS analysed_frame_queue
+    FROM analysed_frames_v1
+    WHERE taken_at > now() - interval '1 hour'
+    GROUP BY stream_id;
+
+Traces are sampled with `TRACE_SAMPLE_RATE` at ingest. Spans of sampled traces, including
+the database write itself, are exported to `TRACE_EXPORT`: a JSONL file,
+or a local collector listening on UDP (`udp://localhost:9411`).
+"""
+import abc
+import json
+import random
+import socket
+import threading
+import time
+import uuid
+from typing import Any, Dict, Mapping, Optional
+
+from loguru import logger
+
+from app.core.config import TRACE_EXPORT
+
+TRACE_HEADER = "trace"
+
+
+class TraceContext:
+    """
+    The trace of a single frame, carried from hop to hop.
+    """
+
+    def __init__(self, trace_id: str = None, sampled: bool = False, hops: Dict[str, float] = None):
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.sampled = sampled
+        self.hops: Dict[str, float] = dict(hops or {})
+
+    @classmethod
+    def start(cls, sample_rate: float = 0.0) -> "TraceContext":
+        """Starts a new trace, sampled with a probability of `sample_rate`"""
+        return cls(sampled=random.random() < sample_rate)
+
+    @classmethod
+    def from_headers(cls, headers: Optional[Mapping], sample_rate: float = 0.0) -> "TraceContext":
+        """Continues the trace in the `trace` header of a message,
+        or starts a new one for messages without (valid) trace"""
+        value = headers.get(TRACE_HEADER) if isinstance(headers, Mapping) else None
+        if value is None:
+            return cls.start(sample_rate)
+
+        try:
+            trace = json.loads(value)
+            return cls(trace["trace_id"], bool(trace.get("sampled")), trace.get("hops"))
+        except (TypeError, ValueError, KeyError) as e:
+            logger.error(f"Invalid `{TRACE_HEADER}` header: {e}")
+            return cls.start(sample_rate)
+
+    def stamp(self, hop: str, at: float = None) -> float:
+        """Records the time of `hop`, now by default"""
+        self.hops[hop] = time.time() if at is None else at
+        return self.hops[hop]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"trace_id": self.trace_id, "sampled": self.sampled, "hops": dict(self.hops)}
+
+    def to_header(self) -> str:
+        return json.dumps(self.to_dict())
+
+    def span(
+        self, name: str, start_hop: str, end_hop: str = None, stream_id: str = None, **attributes: Any
+    ) -> Optional[Dict[str, Any]]:
+        """The span between two hops, or from a hop until now, None when a hop wasn't stamped"""
+        if start_hop not in self.hops or (end_hop is not None and end_hop not in self.hops):
+            return None
+
+        start = self.hops[start_hop]
+        end = time.time() if end_hop is None else self.hops[end_hop]
+        return {
+            "trace_id": self.trace_id,
+            "service": "api",
+            "name": name,
+            "stream_id": stream_id,
+            "start": start,
+            "end": end,
+            "duration_ms": 1000 * (end - start),
+            "attributes": attributes,
+        }
+
+
+class SpanExporter(abc.ABC):
+    """Exports spans of sampled traces. Exporting never raises, tracing shouldn't hold up frames."""
+
+    @abc.abstractmethod
+    def export(self, span: Dict[str, Any]) -> None:
+        pass
+
+
+class FileSpanExporter(SpanExporter):
+    """Appends spans as JSON lines to a file, opened on the first span"""
+
+    def __init__(self, location: str):
+        self.location = location
+        self._file = None
+        self._lock = threading.Lock()
+
+    def export(self, span: Dict[str, Any]) -> None:
+        line = json.dumps(span, default=str) + "\n"
+        try:
+            with self._lock:
+                if self._file is None:
+                    self._file = open(self.location, "a", buffering=1)
+                self._file.write(line)
+        except OSError as e:
+            logger.debug(f"Could not export span: {e}")
+
+
+class UdpSpanExporter(SpanExporter):
+    """Sends every span as a JSON datagram to a collector, dropped when nothing is listening"""
+
+    def __init__(self, host: str, port: int):
+        self.address = (host, port)
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setblocking(False)
+
+    def export(self, span: Dict[str, Any]) -> None:
+        try:
+            self._socket.sendto(json.dumps(span, default=str).encode("utf-8"), self.address)
+        except OSError as e:
+            logger.debug(f"Could not export span: {e}")
+
+
+def create_exporter(target: str) -> Optional[SpanExporter]:
+    """Creates the exporter for `target`: `udp://host:port` or the location of a JSONL file,
+    None when `target` is empty"""
+    if not target:
+        return None
+    if target.startswith("udp://"):
+        host, _, port = target[len("udp://"):].rpartition(":")
+        if not host or not port.isdigit():
+            raise ValueError(f"Invalid collector address: {target}, expected udp://host:port")
+        return UdpSpanExporter(host, int(port))
+    return FileSpanExporter(target)
+
+
+span_exporter: Optional[SpanExporter] = create_exporter(TRACE_EXPORT)
+
+
+def export(*spans: Optional[Dict[str, Any]]) -> None:
+    """Exports spans when `TRACE_EXPORT` is set"""
+    if span_exporter is None:
+        return
+    for span in spans:
+        if span is not None:
+            span_exporter.export(span)
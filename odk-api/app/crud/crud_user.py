@@ -1,25 +1,30 @@
 from typing import List, Optional, Union, Dict, Any
 
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.security import get_password_hash, verify_password
 from app.models import User
 from app.schemas import UserCreate, UserUpdate
 
 class CRUDUser():
-    def get_by_id(self, db: Session, id: str) -> Optional[User]:
-        return db.query(User).filter(User.id == id).first()
+    async def get_by_id(self, db: AsyncSession, id: str) -> Optional[User]:
+        result = await db.execute(select(User).filter(User.id == id))
+        return result.scalars().first()
 
-    def get_by_email(self, db: Session, email: str) -> Optional[User]:
-        return db.query(User).filter(User.email == email).first()
+    async def get_by_email(self, db: AsyncSession, email: str) -> Optional[User]:
+        result = await db.execute(select(User).filter(User.email == email))
+        return result.scalars().first()
     
-    def get_all(self, db: Session) -> List[User]:
-        return db.query(User).all()
+    async def get_all(self, db: AsyncSession) -> List[User]:
+        result = await db.execute(select(User))
+        return result.scalars().all()
 
-    def get_all_non_admin(self, db: Session) -> List[User]:
-        return db.query(User).filter(User.is_superuser == False).all()
+    async def get_all_non_admin(self, db: AsyncSession) -> List[User]:
+        result = await db.execute(select(User).filter(User.is_superuser == False))
+        return result.scalars().all()
 
-    def create(self, db: Session, obj_in: UserCreate) -> User:
+    async def create(self, db: AsyncSession, obj_in: UserCreate) -> User:
         db_obj = User(
             email=obj_in.email,
             hashed_password=get_password_hash(obj_in.password),
@@ -30,11 +35,11 @@ class CRUDUser():
         )
 
         db.add(db_obj)
-        db.commit()
-        db.refresh(db_obj)
+        await db.commit()
+        await db.refresh(db_obj)
         return db_obj
 
-    def update(self, db: Session, db_obj: User, obj_in: Union[UserUpdate, Dict[str, Any]]
+    async def update(self, db: AsyncSession, db_obj: User, obj_in: Union[UserUpdate, Dict[str, Any]]
     ) -> User:
         if isinstance(obj_in, dict):
             update_data = obj_in
@@ -50,12 +55,12 @@ class CRUDUser():
                 setattr(db_obj, field, update_data[field])
 
         db.add(db_obj)
-        db.commit()
-        db.refresh(db_obj)
+        await db.commit()
+        await db.refresh(db_obj)
         return db_obj
 
-    def authentication(self, db: Session, email: str, password: str) -> Optional[User]:
-        user = self.get_by_email(db, email=email)
+    async def authentication(self, db: AsyncSession, email: str, password: str) -> Optional[User]:
+        user = await self.get_by_email(db, email=email)
         if not user:
             return None
         if not verify_password(password, user.hashed_password):
@@ -69,4 +74,4 @@ class CRUDUser():
         return user.is_superuser
 
 
-user = CRUDUser()
\ No newline at end of file
+user = CRUDUser()
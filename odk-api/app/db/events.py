@@ -8,24 +8,35 @@ from tenacity import (
     retry_if_exception_type,
 )
 
-from sqlalchemy.ext.declarative import declarative_base
-from psycopg2 import OperationalError
+import asyncio
+from datetime import date, timedelta
+from typing import Optional
 
-from app.db.session import SessionLocal, engine
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from app.core.config import ANALYSED_FRAMES_PARTITIONED, ANALYSED_FRAMES_PARTITIONS_AHEAD
+from app.db.session import async_engine
 import app.db.base
 from app.db.base_class import Base
+from app.models.frame import AnalysedFrame
 
 max_tries = 20
 wait_seconds = 1
 
+# Seconds between checks for partitions of new months, see `maintain_partitions`
+PARTITIONS_INTERVAL = 60 * 60
+# Reference to the running `maintain_partitions`, so the task isn't garbage collected
+_partitions_task: Optional[asyncio.Future] = None
+
 
 @retry(
     stop=stop_after_attempt(max_tries), wait=wait_fixed(wait_seconds),
 )
 async def ping() -> None:
     try:
-        session = SessionLocal()
-        session.execute("SELECT 1")
+        async with async_engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
         logger.info("Can query to server!")
     except Exception as e:
         logger.error(e)
@@ -34,8 +45,96 @@ async def ping() -> None:
 
 async def init() -> None:
     try:
-        Base.metadata.create_all(bind=engine)
+        async with async_engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            await conn.run_sync(create_indexes)
         logger.info("Initialized database")
     except Exception as e:
         logger.error(e)
         # raise e
+
+    if ANALYSED_FRAMES_PARTITIONED:
+        await create_partitions()
+        global _partitions_task
+        _partitions_task = asyncio.ensure_future(maintain_partitions())
+
+
+def create_indexes(conn: Connection) -> None:
+    """`create_all` skips existing tables, including their indexes,
+    so create indexes that were added later to existing tables"""
+    for index in AnalysedFrame.__table__.indexes:
+        index.create(bind=conn, checkfirst=True)
+
+
+async def create_partitions() -> None:
+    """Creates the monthly partitions of `analysed_frames_v1` for the current month and
+    `ANALYSED_FRAMES_PARTITIONS_AHEAD` months after, plus a default partition for other rows.
+
+    A partition is named after its month, e.g. `analysed_frames_v1_2021_01`,
+    and removing a month of data is a `DROP TABLE` of its partition.
+    Every partition is created in its own transaction, so one that fails doesn't hold up the others.
+    """
+    month = date.today().replace(day=1)
+    months = [None]
+    for _ in range(ANALYSED_FRAMES_PARTITIONS_AHEAD + 1):
+        months.append(month)
+        month = next_month(month)
+
+    for month in months:
+        try:
+            async with async_engine.begin() as conn:
+                if month is None:
+                    await conn.run_sync(create_default_partition)
+                else:
+                    await conn.run_sync(create_partition, month)
+        except Exception as e:
+            logger.error(f"Could not create partition for {month or 'default'}: {e}")
+
+
+async def maintain_partitions() -> None:
+    """Creates the partitions of new months while the API is running, so frames taken in
+    a new month don't end up in the default partition"""
+    while True:
+        await asyncio.sleep(PARTITIONS_INTERVAL)
+        await create_partitions()
+
+
+def next_month(month: date) -> date:
+    return (month.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def create_default_partition(conn: Connection) -> None:
+    table = AnalysedFrame.__tablename__
+    conn.execute(text(f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT"))
+
+
+def create_partition(conn: Connection, month: date) -> None:
+    """Creates the partition of `month`, if it doesn't exist yet.
+
+    Postgres refuses to create a partition while the default partition has rows in its range,
+    e.g. when the API wasn't running at the start of the month. Those rows are moved into the
+    new partition: the default partition is detached, the partition created, the rows moved and
+    the default partition attached again. The table is locked until the transaction is committed,
+    so writes wait for the move.
+    """
+    table = AnalysedFrame.__tablename__
+    partition = f"{table}_{month:%Y_%m}"
+    bounds = f"FROM ('{month.isoformat()}') TO ('{next_month(month).isoformat()}')"
+    in_range = f"taken_at >= '{month.isoformat()}' AND taken_at < '{next_month(month).isoformat()}'"
+
+    if conn.execute(text(f"SELECT to_regclass('{partition}') IS NOT NULL")).scalar():
+        return
+
+    has_default = conn.execute(text(f"SELECT to_regclass('{table}_default') IS NOT NULL")).scalar()
+    if not has_default or not conn.execute(
+        text(f"SELECT EXISTS (SELECT 1 FROM {table}_default WHERE {in_range})")
+    ).scalar():
+        conn.execute(text(f"CREATE TABLE {partition} PARTITION OF {table} FOR VALUES {bounds}"))
+        return
+
+    logger.info(f"Moving rows from {table}_default to new partition {partition}")
+    conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {table}_default"))
+    conn.execute(text(f"CREATE TABLE {partition} PARTITION OF {table} FOR VALUES {bounds}"))
+    conn.execute(text(f"INSERT INTO {partition} SELECT * FROM {table}_default WHERE {in_range}"))
+    conn.execute(text(f"DELETE FROM {table}_default WHERE {in_range}"))
+    conn.execute(text(f"ALTER TABLE {table} ATTACH PARTITION {table}_default DEFAULT"))
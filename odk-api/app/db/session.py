@@ -1,13 +1,24 @@
-from typing import Generator
+from typing import AsyncGenerator, Generator
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm.session import Session
 
-from app.core.config import DATABASE_URL
+from app.core.config import DATABASE_URL, ASYNC_DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW
 
-engine = create_engine(str(DATABASE_URL), pool_pre_ping=True)
+engine = create_engine(
+    str(DATABASE_URL), pool_pre_ping=True, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Used from `async def` handlers, so a slow query doesn't block the event loop
+async_engine = create_async_engine(
+    str(ASYNC_DATABASE_URL), pool_pre_ping=True, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW
+)
+AsyncSessionLocal = sessionmaker(
+    bind=async_engine, class_=AsyncSession, autocommit=False, autoflush=False, expire_on_commit=False
+)
+
 
 def get_db() -> Generator:
     try:
@@ -19,3 +30,12 @@ def get_db() -> Generator:
 
 def get_session() -> Session:
     return SessionLocal()
+
+
+async def get_async_db() -> AsyncGenerator:
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def get_async_session() -> AsyncSession:
+    return AsyncSessionLocal()
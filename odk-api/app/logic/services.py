@@ -1,68 +1,120 @@
-from typing import Dict
+from typing import Callable, Dict, List, Optional
 from datetime import datetime
 
 from loguru import logger
-from sqlalchemy.exc import DataError, OperationalError
-from sqlalchemy.orm import Session
+from sqlalchemy import Integer, cast, func, literal_column, select, text, true
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.models.frame import AnalysedFrame
 
 
-def persist_analysed_frame(db: Session, analysed_frame: AnalysedFrame) -> AnalysedFrame:
-    try:
-        db.add(analysed_frame)
-        db.commit()
-        db.refresh(analysed_frame)
+# Time buckets for `get_detected_objects`, mapping a name to the start of the bucket of a timestamp.
+# Constants are literals instead of bound parameters: the bucket is repeated in the GROUP BY,
+# where Postgres would see other parameters ($4 instead of $1) and reject the query.
+BUCKETS: Dict[str, Callable] = {
+    "hour": lambda taken_at: func.date_trunc(literal_column("'hour'"), taken_at),
+    "15min": lambda taken_at: (
+        func.date_trunc(literal_column("'hour'"), taken_at)
+        + func.floor(func.date_part(literal_column("'minute'"), taken_at) / literal_column("15"))
+        * text("interval '15 minutes'")
+    ),
+}
 
-        return analysed_frame
 
-    except DataError as e:
-        logger.error(e)
+async def persist_analysed_frames(db: AsyncSession, analysed_frames: List[Dict]) -> int:
+    """Inserts multiple analysed frames with a single multi-row INSERT and a single commit.
+    Errors are raised, so the caller can retry the batch.
 
-    except OperationalError as e:
-        logger.error(e)
+    Args:
+        db (AsyncSession): Database session, closed afterwards
+        analysed_frames (List[Dict]): Column values of the `analysed_frames_v1` rows
+
+    Returns:
+        int: Number of inserted rows
+    """
+    if not analysed_frames:
+        return 0
+
+    try:
+        await db.execute(AnalysedFrame.__table__.insert().values(analysed_frames))
+        await db.commit()
+        return len(analysed_frames)
 
     except Exception as e:
+        await db.rollback()
         logger.error(e)
         raise e
 
     finally:
-        db.close()
-        return AnalysedFrame()
+        await db.close()
+
+
+async def get_detected_objects(
+    db: AsyncSession,
+    stream_ids: List[str],
+    _from: datetime,
+    _till: datetime,
+    bucket: Optional[str] = None,
+) -> Dict:
+    """Sums the object counts of analysed frames in the database, grouped by object type.
+
+    Every `object_count` is expanded with `jsonb_each_text` and summed per key, so only
+    the aggregated counts are sent over the wire instead of every analysed frame.
+
+    Args:
+        db (AsyncSession): Database session
+        stream_ids (List[str]): Streams to aggregate
+        _from (datetime): Start of the time frame, inclusive
+        _till (datetime): End of the time frame, exclusive
+        bucket (str, optional): Also group by time bucket, one of `BUCKETS`
+
+    Returns:
+        Dict: `{object_type: count}` for a single stream without bucket (as before),
+        else `{stream_id: {object_type: count}}` or, with a bucket,
+        `{stream_id: {bucket_start: {object_type: count}}}`
+    """
+    if bucket is not None and bucket not in BUCKETS:
+        raise ValueError(f"Unknown bucket '{bucket}', expected one of {list(BUCKETS)}")
+
+    # 1) expand every object count into (key, value) rows
+    kv = func.jsonb_each_text(AnalysedFrame.object_count).table_valued("key", "value").alias("kv")
+    count = func.sum(cast(kv.c.value, Integer)).label("count")
+
+    columns = [AnalysedFrame.stream_id, kv.c.key, count]
+    group_by = [AnalysedFrame.stream_id, kv.c.key]
+    if bucket:
+        bucket_start = BUCKETS[bucket](AnalysedFrame.taken_at).label("bucket")
+        columns.insert(1, bucket_start)
+        group_by.insert(1, bucket_start)
+
+    # 2) sum the values per key for the selected streams and time frame
+    query = (
+        select(*columns)
+        .select_from(AnalysedFrame)
+        .join(kv, true())
+        .filter(AnalysedFrame.stream_id.in_(stream_ids))
+        .filter(AnalysedFrame.taken_at >= _from)
+        .filter(AnalysedFrame.taken_at < _till)
+        .group_by(*group_by)
+    )
 
-
-def get_detected_objects(
-    db: Session, stream_id: str, _from: datetime, _till: datetime
-) -> Dict[str, str]:
     try:
-        # 1) get only the object counts per stream_id in the selected time frame
-        data = (
-            db.query(AnalysedFrame.object_count)
-            .filter(AnalysedFrame.stream_id == stream_id)
-            .filter(AnalysedFrame.taken_at >= _from)
-            .filter(AnalysedFrame.taken_at < _till)
-            .all()
-        )
+        result = await db.execute(query)
+        data = result.all()
 
     except Exception as e:
         logger.error(e)
         raise e
 
-    # 2) declare dict for combining counts
-    counts: Dict[str, str] = {}
-
-    # 3) loop through every object counts
-    for d in data:
-        # 4) the counts dict is in the first and only element
-        obj_dict = d[0]
-
-        # 5) loop through the dict
-        for key, value in obj_dict.items():
-            # 6.1) if the key is known, add the value
-            if counts.get(key):
-                counts[key] += value
-            # 6.2) if not known, create the key and set value
-            else:
-                counts[key] = value
+    # 3) combine the rows into the response dict
+    counts: Dict = {}
+    for row in data:
+        stream_counts = counts.setdefault(row.stream_id, {})
+        if bucket:
+            stream_counts = stream_counts.setdefault(row.bucket.isoformat(), {})
+        stream_counts[row.key] = row.count
+
+    if len(stream_ids) == 1 and not bucket:
+        return counts.get(stream_ids[0], {})
 
     return counts
@@ -6,7 +6,7 @@ from starlette.middleware.cors import CORSMiddleware
 
 from app.core.config import PROJECT_NAME, DEBUG, VERSION, ALLOWED_HOSTS
 from app.api import api_router
-from app.core.events import create_start_app_handler
+from app.core.events import create_start_app_handler, create_stop_app_handler
 
 # First things first, set timezone!
 # Timezone is set to timezone specified in TZ environment variable
@@ -24,6 +24,7 @@ app.add_middleware(
 )
 
 app.add_event_handler("startup", create_start_app_handler())
+app.add_event_handler("shutdown", create_stop_app_handler())
 
 app.include_router(api_router)
 
@@ -1,23 +1,31 @@
 import uuid
 
-from sqlalchemy import Column, String, DateTime
+from sqlalchemy import Column, String, DateTime, Index
 from sqlalchemy.dialects.postgresql import JSONB, UUID
 
+from app.core.config import ANALYSED_FRAMES_PARTITIONED
 from app.db.base_class import Base
 
 
 class AnalysedFrame(Base):
     __tablename__ = "analysed_frames_v1"
+    __table_args__ = (
+        # Every query on analysed frames filters on a stream within a time frame
+        Index("ix_analysed_frames_v1_stream_id_taken_at", "stream_id", "taken_at"),
+        {"postgresql_partition_by": "RANGE (taken_at)"} if ANALYSED_FRAMES_PARTITIONED else {},
+    )
 
+    # A primary key of a partitioned table has to include the partition key,
+    # which also rules out a unique constraint on `id` alone
     id = Column(
         UUID(as_uuid=True),
         primary_key=True,
         default=uuid.uuid4,
-        unique=True,
+        unique=not ANALYSED_FRAMES_PARTITIONED,
         nullable=False,
     )
 
-    taken_at = Column(DateTime())
+    taken_at = Column(DateTime(), primary_key=ANALYSED_FRAMES_PARTITIONED)
     lat_lng = Column(JSONB())
     stream_id = Column(String())
 
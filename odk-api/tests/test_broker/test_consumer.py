@@ -0,0 +1,30 @@
+import asyncio
+from datetime import datetime
+from unittest import mock
+
+from app.broker import consumer
+from tests.conftest import analysed_frame_message
+
+
+def test_parses_taken_at_into_datetime(analysed_frame_row):
+    row = analysed_frame_row(taken_at="2020-10-01T12:30:00.123000")
+
+    assert row["taken_at"] == datetime(2020, 10, 1, 12, 30, 0, 123000)
+
+
+def test_drops_offset_of_taken_at(analysed_frame_row):
+    row = analysed_frame_row(taken_at="2020-10-01T12:30:00+02:00")
+
+    assert row["taken_at"] == datetime(2020, 10, 1, 12, 30)
+    assert row["taken_at"].tzinfo is None
+
+
+def test_acknowledges_invalid_taken_at():
+    message = analysed_frame_message(taken_at="yesterday")
+
+    with mock.patch.object(consumer, "analysed_frame_writer") as writer:
+        writer.add = mock.AsyncMock()
+        asyncio.run(consumer.handle_analysed_frame(message))
+
+    writer.add.assert_not_called()
+    message.ack.assert_called_once()
@@ -0,0 +1,184 @@
+import asyncio
+from unittest import mock
+
+import pytest
+from sqlalchemy.exc import DataError, OperationalError
+
+from app.broker import writer as writer_module
+from app.broker.writer import AnalysedFrameWriter
+from app.core import tracing
+
+
+def analysed_frame(stream_id: str = "stream-1"):
+    return {"stream_id": stream_id, "analyser_meta": {}}
+
+
+@pytest.fixture
+def persist():
+    with mock.patch.object(writer_module, "get_async_session"), \
+            mock.patch.object(writer_module, "persist_analysed_frames", new_callable=mock.AsyncMock) as persist:
+        yield persist
+
+
+def test_writes_batch_when_full(persist):
+    writer = AnalysedFrameWriter(batch_size=3, batch_timeout=60000)
+    messages = [mock.MagicMock() for _ in range(3)]
+
+    async def add():
+        for message in messages[:2]:
+            await writer.add(analysed_frame(), message)
+        persist.assert_not_called()
+        await writer.add(analysed_frame(), messages[2])
+
+    asyncio.run(add())
+
+    persist.assert_awaited_once()
+    assert len(persist.call_args[0][1]) == 3
+    for message in messages:
+        message.ack.assert_called_once()
+
+
+def test_writes_batch_after_timeout(persist):
+    writer = AnalysedFrameWriter(batch_size=100, batch_timeout=10)
+    message = mock.MagicMock()
+
+    async def add_and_wait():
+        await writer.add(analysed_frame(), message)
+        persist.assert_not_called()
+        await asyncio.sleep(0.1)
+
+    asyncio.run(add_and_wait())
+
+    persist.assert_awaited_once()
+    message.ack.assert_called_once()
+
+
+def test_keeps_reference_to_timed_flush(persist):
+    writer = AnalysedFrameWriter(batch_size=100, batch_timeout=10)
+
+    async def add_and_wait():
+        release = asyncio.Event()
+
+        async def persisted(db, rows):
+            await release.wait()
+            return len(rows)
+
+        persist.side_effect = persisted
+        await writer.add(analysed_frame(), mock.MagicMock())
+        await asyncio.sleep(0.05)
+        assert len(writer._flush_tasks) == 1
+        release.set()
+        await asyncio.gather(*writer._flush_tasks)
+        await asyncio.sleep(0)
+
+    asyncio.run(add_and_wait())
+
+    assert not writer._flush_tasks
+
+
+def test_logs_failed_timed_flush(persist):
+    writer = AnalysedFrameWriter(batch_size=100, batch_timeout=10)
+
+    async def add_and_wait():
+        await writer.add(analysed_frame(), mock.MagicMock())
+        await asyncio.sleep(0.05)
+
+    with mock.patch.object(writer, "flush", new_callable=mock.AsyncMock, side_effect=RuntimeError("lost")), \
+            mock.patch.object(writer_module, "logger") as logger:
+        asyncio.run(add_and_wait())
+
+    logger.error.assert_called_once_with("Could not flush analysed frames: lost")
+
+
+def test_close_waits_for_flush_and_writes_buffer(persist):
+    writer = AnalysedFrameWriter(batch_size=100, batch_timeout=10)
+    messages = [mock.MagicMock(), mock.MagicMock()]
+
+    async def add_and_close():
+        await writer.add(analysed_frame(), messages[0])
+        await asyncio.sleep(0.05)
+        await writer.add(analysed_frame(), messages[1])
+        await writer.close()
+
+    asyncio.run(add_and_close())
+
+    assert persist.await_count == 2
+    for message in messages:
+        message.ack.assert_called_once()
+
+
+def test_acknowledges_after_commit(persist):
+    writer = AnalysedFrameWriter(batch_size=1)
+    message = mock.MagicMock()
+
+    async def persisted(db, rows):
+        message.ack.assert_not_called()
+        return len(rows)
+
+    persist.side_effect = persisted
+    trace = tracing.TraceContext(hops={"api_received_at": 1.0})
+    frame = analysed_frame()
+    asyncio.run(writer.add(frame, message, trace))
+
+    message.ack.assert_called_once()
+    assert "db_write_started_at" in frame["analyser_meta"]["trace"]["hops"]
+
+
+def test_requeues_batch_when_database_unreachable(persist):
+    writer = AnalysedFrameWriter(batch_size=2)
+    messages = [mock.MagicMock(), mock.MagicMock()]
+    persist.side_effect = OperationalError("INSERT", {}, Exception("connection refused"))
+
+    async def add():
+        for message in messages:
+            await writer.add(analysed_frame(), message)
+
+    asyncio.run(add())
+
+    persist.assert_awaited_once()
+    for message in messages:
+        message.nack.assert_called_once_with(requeue=True)
+        message.ack.assert_not_called()
+
+
+def test_writes_rejected_batch_one_by_one(persist):
+    writer = AnalysedFrameWriter(batch_size=3)
+    messages = [mock.MagicMock() for _ in range(3)]
+
+    async def persisted(db, rows):
+        if len(rows) > 1 or rows[0]["stream_id"] == "invalid":
+            raise DataError("INSERT", {}, Exception("invalid input syntax"))
+        return len(rows)
+
+    persist.side_effect = persisted
+
+    async def add():
+        await writer.add(analysed_frame(), messages[0])
+        await writer.add(analysed_frame("invalid"), messages[1])
+        await writer.add(analysed_frame(), messages[2])
+
+    asyncio.run(add())
+
+    assert persist.await_count == 4
+    messages[0].ack.assert_called_once()
+    messages[1].nack.assert_called_once_with(requeue=False)
+    messages[1].ack.assert_not_called()
+    messages[2].ack.assert_called_once()
+
+
+def test_requeues_rest_of_rejected_batch_when_database_unreachable(persist):
+    writer = AnalysedFrameWriter(batch_size=2)
+    messages = [mock.MagicMock(), mock.MagicMock()]
+    persist.side_effect = [
+        DataError("INSERT", {}, Exception("invalid input syntax")),
+        OperationalError("INSERT", {}, Exception("connection refused")),
+    ]
+
+    async def add():
+        for message in messages:
+            await writer.add(analysed_frame(), message)
+
+    asyncio.run(add())
+
+    for message in messages:
+        message.nack.assert_called_once_with(requeue=True)
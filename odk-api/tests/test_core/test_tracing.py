@@ -0,0 +1,31 @@
+import json
+
+import pytest
+
+from app.core import tracing
+
+
+def test_span_exporter_is_abstract():
+    with pytest.raises(TypeError):
+        tracing.SpanExporter()
+
+
+def test_file_exporter_appends_json_lines(tmp_path):
+    location = str(tmp_path / "spans.jsonl")
+    exporter = tracing.create_exporter(location)
+    trace = tracing.TraceContext("abc", sampled=True, hops={"api_received_at": 1.0, "api_queued_at": 1.5})
+
+    exporter.export(trace.span("ingest", "api_received_at", "api_queued_at", "stream-1"))
+    exporter.export(trace.span("ingest", "api_received_at", "api_queued_at", "stream-2"))
+
+    with open(location) as f:
+        spans = [json.loads(line) for line in f]
+    assert [span["stream_id"] for span in spans] == ["stream-1", "stream-2"]
+    assert spans[0]["duration_ms"] == 500.0
+
+
+def test_create_exporter():
+    assert tracing.create_exporter("") is None
+    assert isinstance(tracing.create_exporter("udp://localhost:9411"), tracing.UdpSpanExporter)
+    with pytest.raises(ValueError):
+        tracing.create_exporter("udp://localhost")
@@ -0,0 +1,51 @@
+from datetime import date
+from typing import List
+from unittest import mock
+
+from app.db.events import create_partition
+
+
+def executed(conn: mock.MagicMock) -> List[str]:
+    return [str(call[0][0]) for call in conn.execute.call_args_list]
+
+
+def partition_conn(partition_exists: bool, default_has_rows: bool) -> mock.MagicMock:
+    conn = mock.MagicMock()
+    conn.execute.return_value.scalar.side_effect = [partition_exists, True, default_has_rows]
+    return conn
+
+
+def test_skips_existing_partition():
+    conn = partition_conn(partition_exists=True, default_has_rows=False)
+
+    create_partition(conn, date(2021, 1, 1))
+
+    assert len(executed(conn)) == 1
+
+
+def test_creates_partition():
+    conn = partition_conn(partition_exists=False, default_has_rows=False)
+
+    create_partition(conn, date(2021, 12, 1))
+
+    assert executed(conn)[-1] == (
+        "CREATE TABLE analysed_frames_v1_2021_12 PARTITION OF analysed_frames_v1 "
+        "FOR VALUES FROM ('2021-12-01') TO ('2022-01-01')"
+    )
+
+
+def test_moves_rows_out_of_default_partition():
+    conn = partition_conn(partition_exists=False, default_has_rows=True)
+
+    create_partition(conn, date(2021, 1, 1))
+
+    statements = executed(conn)[3:]
+    assert [statement.split(" analysed_frames_v1")[0] for statement in statements] == [
+        "ALTER TABLE",
+        "CREATE TABLE",
+        "INSERT INTO",
+        "DELETE FROM",
+        "ALTER TABLE",
+    ]
+    assert "DETACH PARTITION analysed_frames_v1_default" in statements[0]
+    assert statements[-1].endswith("ATTACH PARTITION analysed_frames_v1_default DEFAULT")
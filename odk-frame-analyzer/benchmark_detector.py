@@ -0,0 +1,75 @@
+import argparse
+import json
+import os
+import sys
+
+# The eager model is unpickled from the weights file, which requires the YOLOv5 code base
+sys.path.append("yolov5")
+
+from frame_analyzer.detection import benchmark
+from frame_analyzer.detection.yolov5_detector import YOLOv5Detector
+from frame_analyzer.utils import image_util
+
+
+def image_sizes(value: str):
+    return [tuple(int(side) for side in size.split("x")) for size in value.split(",")]
+
+
+def batch_sizes(value: str):
+    return [int(size) for size in value.split(",")]
+
+
+parser = argparse.ArgumentParser(description="Benchmark the detector stage by stage and compare against a baseline")
+parser.add_argument("-w", "--weights", dest="weights_location", type=str, default="weights/garb_weights.pt", help="Path to weights file")
+parser.add_argument("--backend", dest="backend", type=str, choices=["torch", "torchscript", "onnx"], default="torch", help="Backend to benchmark")
+parser.add_argument("--precision", dest="precision", type=str, choices=["fp32", "int8", "bf16"], default="fp32", help="Precision to benchmark")
+parser.add_argument("--imgsize", dest="img_size", type=int, default=640, help="Input size of the model")
+parser.add_argument("--sizes", dest="image_sizes", type=image_sizes, default=benchmark.DEFAULT_IMAGE_SIZES, help="Image sizes to benchmark, e.g. 640x480,1920x1080")
+parser.add_argument("--batchsizes", dest="batch_sizes", type=batch_sizes, default=benchmark.DEFAULT_BATCH_SIZES, help="Batch sizes to benchmark, e.g. 1,4,8")
+parser.add_argument("-n", "--repeats", dest="repeats", type=int, default=20, help="Number of timed calls per benchmark")
+parser.add_argument("-i", "--image", dest="image", type=str, default=None, help="Street image to benchmark with, instead of a synthetic image")
+parser.add_argument("-o", "--output", dest="output", type=str, default="benchmarks/results.json", help="Where to write the results")
+parser.add_argument("--baseline", dest="baseline", type=str, default=None, help="Results to compare against, exits with 1 on a regression")
+parser.add_argument("--threshold", dest="threshold", type=float, default=0.1, help="Relative slowdown of the median that counts as a regression")
+parser.add_argument("--savebaseline", dest="save_baseline", action="store_true", help="Also write the results to the baseline")
+
+args = parser.parse_args()
+
+
+def write_report(report, location):
+    if os.path.dirname(location):
+        os.makedirs(os.path.dirname(location), exist_ok=True)
+    with open(location, "w") as f:
+        json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    detector = YOLOv5Detector(
+        args.weights_location, warmup_batch_sizes=args.batch_sizes,
+        backend=args.backend, precision=args.precision, img_size=args.img_size,
+    )
+    image = None
+    if args.image:
+        with open(args.image, "rb") as f:
+            image = image_util.decode_image(f.read())
+
+    report = benchmark.run(detector, args.image_sizes, args.batch_sizes, args.repeats, image)
+
+    regressions = []
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            report['comparison'] = benchmark.compare(report, json.load(f), args.threshold)
+        regressions = [row for row in report['comparison'] if row['regressed']]
+
+    write_report(report, args.output)
+    if args.save_baseline and args.baseline:
+        write_report({key: report[key] for key in ("meta", "results")}, args.baseline)
+
+    for result in report['results']:
+        print(f"{result['name']:<22}{result['image_size']:>10}{result['batch_size']:>4}{result['median_ms']:>10.2f} ms")
+    for row in regressions:
+        print(
+            f"REGRESSION {row['name']} {row['image_size']} batch {row['batch_size']}: "
+            f"{row['baseline_median_ms']:.2f} -> {row['median_ms']:.2f} ms ({row['ratio']:.2f}x)"
+        )
+    sys.exit(1 if regressions else 0)
@@ -1,9 +1,12 @@
 import os
 import argparse
 import base64
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from io import BytesIO
 import csv
-from typing import Tuple
+import json
+from typing import Callable, Deque, Iterable, Iterator, List, Tuple
 
 from PIL import Image
 from loguru import logger
@@ -11,13 +14,16 @@ from loguru import logger
 from imageio import imread
 import io
 
-from frame_analyzer.utils.image_util import blur_privacy_objects, draw_bounding_boxes
-from frame_analyzer.utils.persist_util import save_to_disk
-from frame_analyzer.schemas.frame import AnalyzedFrame
+from frame_analyzer.utils import image_util
+from frame_analyzer.utils.image_util import IMAGE_EXTENSIONS, blur_privacy_objects, draw_bounding_boxes
+from frame_analyzer.utils.persist_util import save_to_disk, write_to_disk
+from frame_analyzer.schemas.frame import AnalyzedFrame, ImgFrame
+from frame_analyzer.schemas.frame_context import FrameContext
 from frame_analyzer.detection.yolov5_detector import YOLOv5Detector
 
 
 DEFAULT_WEIGHTS_FILE = "./weights/garb_weights.pt"
+DEFAULT_RESULTS_FILE = "output/results.csv"
 
 
 def _handle_image(yolo: YOLOv5Detector, image_path: str, blur_on: bool, bbox_on: bool, save_on: bool, show_on: bool = False) -> Tuple[str, AnalyzedFrame]:
@@ -90,17 +96,19 @@ def _handle_input(image_path: str, weights_path: str, blur_on: bool, bbox_on: bo
         return
 
     yolo = YOLOv5Detector(weights_path)    
-    all_results = []
+    all_results: List[Tuple[str, AnalyzedFrame]] = []
 
     if os.path.isfile(image_path):
         filename, result = _handle_image(yolo, image_path, blur_on, bbox_on, save_on, show_on=True)
-        _write_to_dict(all_results, filename, result)
+        if filename and result:
+            all_results.append((filename, result))
     elif os.path.isdir(image_path):
         for root, directories, files in os.walk(image_path):
             for name in files:
                 single_image_path = os.path.join(root, name)
                 filename, result = _handle_image(yolo, single_image_path, blur_on, bbox_on, save_on, show_on=False)
-                _write_to_dict(all_results, filename, result)
+                if filename and result:
+                    all_results.append((filename, result))
     else:
         logger.error("Image path not found")
         return
@@ -108,17 +116,173 @@ def _handle_input(image_path: str, weights_path: str, blur_on: bool, bbox_on: bo
     return all_results
 
 
-def _create_results_output(results_dict):
+def _create_results_output(results: List[Tuple[str, AnalyzedFrame]], results_file: str = DEFAULT_RESULTS_FILE):
+    """Writes the results to a CSV or, for a `.jsonl` file, JSON lines file, like batch mode"""
+    with _ResultsWriter(results_file) as writer:
+        for filename, result in results:
+            writer.write(filename, result)
+
+    logger.info(f"Saved results to '{results_file}'")
+
+
+###################
+# Batch mode:
+# Images are read and decoded ahead by a pool of reader threads, detected in batches
+# and every result is written to the results file as soon as its batch is done.
+
+class _ResultsWriter:
+    """Writes results one by one to a CSV or, for a `.jsonl` file, JSON lines file"""
+
     labels = ['filename', 'detected_objects', 'object_count']
-    results_file = 'output/results.csv'
 
-    with open(results_file, 'w') as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=labels)
-        writer.writeheader()
-        for element in results_dict:
-            writer.writerow(element)
+    def __init__(self, results_file: str):
+        self.results_file = results_file
+        self.jsonl = results_file.endswith(".jsonl")
+        self._file = None
+        self._writer = None
+
+    def __enter__(self) -> "_ResultsWriter":
+        self._file = open(self.results_file, 'w', newline='')
+        if not self.jsonl:
+            self._writer = csv.DictWriter(self._file, fieldnames=self.labels)
+            self._writer.writeheader()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._file.close()
+
+    def write(self, filename: str, result: AnalyzedFrame) -> None:
+        if self.jsonl:
+            self._file.write(json.dumps({
+                'filename': filename,
+                'detected_objects': result.detected_objects,
+                'object_count': result.object_count,
+            }) + "\n")
+        else:
+            _dict = []
+            _write_to_dict(_dict, filename, result)
+            self._writer.writerows(_dict)
+
+    def flush(self) -> None:
+        self._file.flush()
+
+
+def _find_images(image_path: str) -> Iterator[str]:
+    if os.path.isfile(image_path):
+        yield image_path
+        return
+    for root, directories, files in os.walk(image_path):
+        directories.sort()
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.join(root, name)
+
+
+def _read_image(image_path: str) -> FrameContext:
+    """Reads and decodes an image, OpenCV releases the GIL while decoding"""
+    with open(image_path, "rb") as f:
+        raw_bytes = f.read()
+    return FrameContext(raw_bytes=raw_bytes, image=image_util.decode_image(raw_bytes))
+
+
+def _prefetch(
+        executor: ThreadPoolExecutor, func: Callable, items: Iterable[str], ahead: int
+) -> Iterator[Tuple[str, Future]]:
+    """Yields every item with the future of `func(item)`, while keeping `ahead` items submitted"""
+    pending: Deque[Tuple[str, Future]] = deque()
+    for item in items:
+        pending.append((item, executor.submit(func, item)))
+        if len(pending) >= ahead:
+            yield pending.popleft()
+    while pending:
+        yield pending.popleft()
 
-    logger.info(f"Saved results to '{results_file}'")
+
+def _save_image(
+        image_path: str, result: AnalyzedFrame, frame_context: FrameContext, blur_on: bool, bbox_on: bool
+) -> None:
+    """Same as the worker: the blurred image when blurring, and a separate image with bounding boxes"""
+    img = frame_context.image
+    org_img = frame_context.raw_bytes
+    edit_img = None
+
+    if blur_on:
+        img = image_util.blur_privacy_objects_on_array(img, result.detected_objects)
+        org_img = image_util.encode_image(img)
+    if bbox_on:
+        edit_img = image_util.encode_image(
+            image_util.draw_bounding_boxes_on_array(img, result.detected_objects)
+        )
+
+    write_to_disk(
+        org_img=org_img,
+        edit_img=edit_img,
+        file_name=os.path.splitext(os.path.basename(image_path))[0],
+        bbox=bbox_on,
+        blur=blur_on,
+    )
+
+
+def _handle_batch_input(
+        image_path: str, weights_path: str, blur_on: bool, bbox_on: bool, save_on: bool,
+        results_file: str = DEFAULT_RESULTS_FILE, batch_size: int = 8, workers: int = None,
+) -> int:
+    """Analyzes all images in `image_path` in batches and streams the results to `results_file`
+
+    Returns:
+        int: Number of analyzed images
+    """
+    if not os.path.isfile(weights_path):
+        logger.error("Weights file not found")
+        return 0
+    if not os.path.exists(image_path):
+        logger.error("Image path not found")
+        return 0
+
+    yolo = YOLOv5Detector(weights_path, warmup_batch_sizes=[batch_size])
+    workers = workers or os.cpu_count()
+    # Enough images read ahead to keep every reader busy while a batch is detected
+    ahead = max(2 * batch_size, workers)
+    count = 0
+
+    with ThreadPoolExecutor(max_workers=workers) as executor, _ResultsWriter(results_file) as writer:
+        saves: Deque[Future] = deque()
+        batch: List[Tuple[str, FrameContext]] = []
+
+        def detect_batch():
+            nonlocal count
+            paths, contexts = zip(*batch)
+            results = yolo.detect_batch([ImgFrame() for _ in contexts], list(contexts))
+            for path, context, result in zip(paths, contexts, results):
+                writer.write(os.path.basename(path), result)
+                if save_on:
+                    saves.append(executor.submit(_save_image, path, result, context, blur_on, bbox_on))
+            writer.flush()
+
+            count += len(results)
+            batch.clear()
+            logger.info(f"Processed {count} images")
+
+            # Don't let the images waiting to be saved pile up
+            while len(saves) > ahead:
+                saves.popleft().result()
+
+        for path, future in _prefetch(executor, _read_image, _find_images(image_path), ahead):
+            try:
+                batch.append((path, future.result()))
+            except (OSError, ValueError) as e:
+                logger.error(f"Could not process '{os.path.basename(path)}': {e}")
+                continue
+            if len(batch) >= batch_size:
+                detect_batch()
+        if batch:
+            detect_batch()
+
+        for save in saves:
+            save.result()
+
+    logger.info(f"Saved results of {count} images to '{results_file}'")
+    return count
 
 
 def _cli():
@@ -132,6 +296,14 @@ def _cli():
     parser.add_argument("--blur", action="store_true", help="Blur output image")
     parser.add_argument("--bbox", action="store_true", help="Draw bounding boxes")
     parser.add_argument("--save", action="store_true", help="Save to disk")
+    parser.add_argument("-o", "--output", dest="results_file",
+                        help="Results file, CSV or JSON lines when ending with .jsonl", default=DEFAULT_RESULTS_FILE)
+    parser.add_argument("--batch", action="store_true",
+                        help="Analyze a folder in batches, with images read ahead and results written as they complete")
+    parser.add_argument("--batchsize", dest="batch_size", type=int, default=8,
+                        help="Number of images detected at once in batch mode")
+    parser.add_argument("--workers", dest="workers", type=int, default=None,
+                        help="Number of threads reading and saving images in batch mode, defaults to the number of CPUs")
 
     args = parser.parse_args()
     image_path = args.image_path
@@ -140,8 +312,16 @@ def _cli():
     bbox_on = args.bbox
     save_on = args.save
 
+    if args.batch:
+        _handle_batch_input(
+            image_path, weights_path, blur_on, bbox_on, save_on,
+            results_file=args.results_file, batch_size=args.batch_size, workers=args.workers,
+        )
+        return
+
     results = _handle_input(image_path, weights_path, blur_on, bbox_on, save_on)
-    _create_results_output(results)
+    if results is not None:
+        _create_results_output(results, args.results_file)
 
 
 if __name__ == "__main__":
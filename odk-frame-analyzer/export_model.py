@@ -0,0 +1,27 @@
+import argparse
+import sys
+
+# The eager model is unpickled from the weights file, which requires the YOLOv5 code base
+sys.path.append("yolov5")
+
+from frame_analyzer.detection.backends import EXPORT_EXTENSIONS, TorchBackend, export, export_location
+from frame_analyzer.detection.yolov5_utils import select_device
+
+
+parser = argparse.ArgumentParser(description="Export YOLOv5 weights for the torchscript or onnx backend")
+parser.add_argument("-w", "--weights", dest="weights_location", type=str, default="weights/garb_weights.pt", help="Path to weights file")
+parser.add_argument("-f", "--format", dest="format", type=str, choices=list(EXPORT_EXTENSIONS), default="onnx", help="Format to export to")
+parser.add_argument("-o", "--output", dest="output", type=str, default=None, help="Path of the exported model, defaults to next to the weights file")
+parser.add_argument("--imgsize", dest="img_size", type=int, default=640, help="Input size the model is exported with")
+
+args = parser.parse_args()
+
+
+if __name__ == "__main__":
+    backend = TorchBackend.from_weights(args.weights_location, select_device())
+    export(
+        backend,
+        args.format,
+        args.output or export_location(args.weights_location, args.format, args.img_size),
+        img_size=args.img_size,
+    )
@@ -0,0 +1,256 @@
+"""
+Inference backends for `YOLOv5Detector`.
+
+A backend only runs the model: it takes a batch of letterboxed images (Bx3xHxW, 0.0 - 1.0)
+and returns the raw predictions (B x boxes x (5 + classes)), before non-max suppression.
+
+- `torch`: the pickled eager model from a `.pt` weights file, as trained
+- `torchscript`: the model traced to TorchScript, runs without Python model code
+- `onnx`: the model exported to ONNX, run by ONNX Runtime with all graph optimizations
+
+The TorchScript and ONNX models are exported once from the weights file, stored next to it,
+and contain the class names, so the weights file isn't needed anymore after exporting:
+
+```
+backend = load_backend("weights/garb_weights.pt", "onnx")  # exports weights/garb_weights.onnx
+pred = backend(img)
+```
+
+Reduced precision is opt-in: `int8` runs the quantized ONNX model (see `quantization`),
+`bf16` runs the eager model under bfloat16 autocast.
+"""
+import abc
+import inspect
+import json
+import os
+from typing import List
+
+import torch
+from loguru import logger
+
+from frame_analyzer.detection import quantization
+
+BACKENDS = ("torch", "torchscript", "onnx")
+PRECISIONS = ("fp32", "int8", "bf16")
+
+EXPORT_EXTENSIONS = {
+    "torchscript": ".torchscript",
+    "onnx": ".onnx",
+}
+
+# Preferred ONNX Runtime execution providers, the first one that is available is used
+ONNX_PROVIDERS = ["OpenVINOExecutionProvider", "CPUExecutionProvider"]
+
+
+class InferenceBackend(abc.ABC):
+    """Runs a YOLOv5 model, see the module docstring"""
+
+    names: List[str] = []
+
+    @abc.abstractmethod
+    def __call__(self, img: torch.Tensor) -> torch.Tensor:
+        """Returns the raw predictions for a batch of images"""
+        pass
+
+
+class TorchBackend(InferenceBackend):
+    def __init__(self, model: torch.nn.Module, augment: bool = False):
+        self.model = model.float().eval()
+        self.augment = augment
+        self.names = list(model.module.names if hasattr(model, 'module') else model.names)
+
+    @classmethod
+    def from_weights(cls, weights_location: str, device: torch.device) -> "TorchBackend":
+        # Unpickling the model requires the YOLOv5 code base on the path
+        model_loaded = torch.load(weights_location, map_location=device)
+        return cls(model_loaded['model'])
+
+    def __call__(self, img: torch.Tensor) -> torch.Tensor:
+        return self.model(img, augment=self.augment)[0]
+
+
+class TorchScriptBackend(InferenceBackend):
+    def __init__(self, location: str, device: torch.device):
+        extra_files = {"names": ""}
+        model = torch.jit.load(location, map_location=device, _extra_files=extra_files)
+        self.names = json.loads(extra_files["names"])
+
+        # Folds batch norms and freezes the weights, where the torch version supports it
+        if hasattr(torch.jit, "optimize_for_inference"):
+            model = torch.jit.optimize_for_inference(model)
+        self.model = model
+
+    def __call__(self, img: torch.Tensor) -> torch.Tensor:
+        return self.model(img)
+
+
+class OnnxRuntimeBackend(InferenceBackend):
+    def __init__(self, location: str, num_threads: int = None):
+        try:
+            import onnxruntime
+        except ImportError:
+            raise ImportError("The onnx backend requires onnxruntime, install with `pip install onnxruntime`")
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = num_threads or torch.get_num_threads()
+
+        available = onnxruntime.get_available_providers()
+        providers = [provider for provider in ONNX_PROVIDERS if provider in available]
+
+        self.session = onnxruntime.InferenceSession(location, options, providers=providers)
+        self.input_name = self.session.get_inputs()[0].name
+        self.names = json.loads(self.session.get_modelmeta().custom_metadata_map["names"])
+        logger.info(f"Running ONNX model with {self.session.get_providers()}")
+
+    def __call__(self, img: torch.Tensor) -> torch.Tensor:
+        pred = self.session.run(None, {self.input_name: img.cpu().numpy()})[0]
+        return torch.from_numpy(pred).to(img.device)
+
+
+class Bfloat16Backend(InferenceBackend):
+    """Runs a backend under bfloat16 autocast, predictions are returned as fp32"""
+
+    def __init__(self, backend: InferenceBackend):
+        if not hasattr(torch, "autocast"):
+            raise ValueError(f"The bf16 precision requires torch >= 1.10, found {torch.__version__}")
+
+        is_bf16_supported = getattr(torch.ops.mkldnn, "_is_mkldnn_bf16_supported", lambda: False)
+        if not is_bf16_supported():
+            logger.warning("CPU has no native bfloat16 support, bf16 inference will likely be slower than fp32")
+
+        self.backend = backend
+        self.names = backend.names
+
+    def __call__(self, img: torch.Tensor) -> torch.Tensor:
+        with torch.autocast(img.device.type, dtype=torch.bfloat16):
+            return self.backend(img).float()
+
+
+class _ExportWrapper(torch.nn.Module):
+    """Only keeps the predictions of the YOLOv5 output, which also contains the feature maps"""
+
+    def __init__(self, model: torch.nn.Module):
+        super().__init__()
+        self.model = model
+
+    def forward(self, img: torch.Tensor) -> torch.Tensor:
+        return self.model(img)[0]
+
+
+def export(backend: TorchBackend, fmt: str, location: str, img_size: int = 640) -> str:
+    """Exports an eager model to TorchScript or ONNX, including its class names.
+
+    Args:
+        backend (TorchBackend): The loaded eager model
+        fmt (str): `torchscript` or `onnx`
+        location (str): File to write the exported model to
+        img_size (int, optional): Input size the model is traced with. Defaults to 640.
+
+    Returns:
+        str: The location of the exported model
+    """
+    if fmt not in EXPORT_EXTENSIONS:
+        raise ValueError(f"Unknown export format: {fmt}")
+
+    model = _ExportWrapper(backend.model).eval()
+    img = torch.zeros((1, 3, img_size, img_size), device=next(backend.model.parameters()).device)
+    names = json.dumps(backend.names)
+
+    logger.info(f"Exporting model to {fmt} at {location}...")
+    with torch.no_grad():
+        if fmt == "torchscript":
+            traced = torch.jit.trace(model, img)
+            torch.jit.save(traced, location, _extra_files={"names": names})
+        else:
+            _export_onnx(model, img, location, names)
+    logger.info(f"Exported model to {fmt} at {location}!")
+
+    return location
+
+
+def _export_onnx(model: torch.nn.Module, img: torch.Tensor, location: str, names: str) -> None:
+    import onnx
+
+    # Newer torch versions default to the dynamo exporter, the model is exported by tracing
+    kwargs = {"dynamo": False} if "dynamo" in inspect.signature(torch.onnx.export).parameters else {}
+    torch.onnx.export(
+        model, img, location,
+        opset_version=11,
+        input_names=["images"],
+        output_names=["output"],
+        dynamic_axes={"images": {0: "batch"}, "output": {0: "batch"}},
+        **kwargs
+    )
+
+    onnx_model = onnx.load(location)
+    meta = onnx_model.metadata_props.add()
+    meta.key, meta.value = "names", names
+    onnx.save(onnx_model, location)
+
+
+def export_location(weights_location: str, fmt: str, img_size: int = 640) -> str:
+    """Location of the exported model next to the weights file, e.g. `garb_weights.onnx`,
+    or `garb_weights_512.onnx` for an input size other than 640"""
+    size = "" if img_size == 640 else f"_{img_size}"
+    return os.path.splitext(weights_location)[0] + size + EXPORT_EXTENSIONS[fmt]
+
+
+def prepare_model(
+        weights_location: str, backend: str = "torch", device: torch.device = None, img_size: int = 640,
+        precision: str = "fp32",
+) -> str:
+    """Exports (and quantizes) the model of the weights file for a backend, when that hasn't been done yet.
+
+    Returns the location to load the backend from: the exported model, or the weights file for the
+    torch backend. Processes that load the same model prepare it once up front, and then load from
+    the returned location, instead of all exporting to the same file at the same time.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend: {backend}, expected one of {BACKENDS}")
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision: {precision}, expected one of {PRECISIONS}")
+    if precision == "int8" and backend != "onnx":
+        raise ValueError("The int8 precision is only supported by the onnx backend")
+    if precision == "bf16" and backend != "torch":
+        raise ValueError("The bf16 precision is only supported by the torch backend")
+
+    if backend == "torch":
+        return weights_location
+
+    location = weights_location
+    if not weights_location.endswith(EXPORT_EXTENSIONS[backend]):
+        location = export_location(weights_location, backend, img_size)
+        if not os.path.exists(location):
+            torch_backend = TorchBackend.from_weights(weights_location, device or torch.device("cpu"))
+            export(torch_backend, backend, location, img_size)
+
+    if precision == "int8" and not os.path.exists(quantization.quantized_location(location)):
+        logger.info("No quantized model found, see `quantize_model.py calibrate` for static quantization")
+        quantization.quantize_dynamic(location, quantization.quantized_location(location))
+    return location
+
+
+def load_backend(
+        weights_location: str, backend: str = "torch", device: torch.device = None, img_size: int = 640,
+        precision: str = "fp32",
+) -> InferenceBackend:
+    """Loads the model of the weights file in an inference backend.
+
+    `weights_location` can also point to an already exported model. Else the model is
+    exported next to the weights file, when it hasn't been exported yet, see `prepare_model`.
+    With precision `int8`, the ONNX model is also quantized when there's no quantized model yet.
+    """
+    location = prepare_model(weights_location, backend, device, img_size, precision)
+    device = device or torch.device("cpu")
+
+    if backend == "torch":
+        torch_backend = TorchBackend.from_weights(location, device)
+        return Bfloat16Backend(torch_backend) if precision == "bf16" else torch_backend
+
+    if backend == "torchscript":
+        return TorchScriptBackend(location, device)
+
+    if precision == "int8":
+        location = quantization.quantized_location(location)
+    return OnnxRuntimeBackend(location)
@@ -0,0 +1,259 @@
+"""
+Micro-benchmarks of `YOLOv5Detector.detect`, stage by stage, and of the image utils,
+across image sizes and batch sizes. Results are written as JSON and compared against
+a stored baseline, to tell whether a model or code change made the worker slower:
+
+```
+$ python benchmark_detector.py -w weights/garb_weights.pt -o benchmarks/results.json --baseline benchmarks/baseline.json
+```
+
+Every benchmark is identified by its name, image size and batch size, and reports
+the mean, median, 95th percentile and minimum time in milliseconds per call.
+"""
+import base64
+import os
+import platform
+import statistics
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+import torch
+from loguru import logger
+
+from frame_analyzer.detection.yolov5_detector import YOLOv5Detector
+from frame_analyzer.detection.yolov5_utils import batched_non_max_suppression
+from frame_analyzer.schemas.frame import ImgFrame
+from frame_analyzer.utils import image_util
+
+# Stages of `YOLOv5Detector.detect`, in order, followed by the end-to-end call
+DETECT_STAGES = ("base64_decode", "imread", "letterbox", "to_tensor", "forward", "nms", "postprocess", "detect")
+IMAGE_UTIL_BENCHMARKS = ("blur_privacy_objects", "draw_bounding_boxes")
+
+DEFAULT_IMAGE_SIZES = [(640, 480), (1280, 720), (1920, 1080)]
+DEFAULT_BATCH_SIZES = [1, 4, 8]
+
+
+def time_calls(func: Callable, repeats: int = 20, warmup: int = 2) -> Dict[str, float]:
+    """Times `func` `repeats` times, after `warmup` calls that aren't counted"""
+    for _ in range(warmup):
+        func()
+
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        times.append(1000 * (time.perf_counter() - start))
+
+    times.sort()
+    return {
+        'mean_ms': statistics.mean(times),
+        'median_ms': statistics.median(times),
+        'p95_ms': times[min(len(times) - 1, int(0.95 * len(times)))],
+        'min_ms': times[0],
+        'repeats': repeats,
+    }
+
+
+def synthetic_image(width: int, height: int, seed: int = 0) -> np.ndarray:
+    """Noisy BGR image, so JPEG encoding and decoding take a realistic amount of work"""
+    rng = np.random.default_rng(seed)
+    img = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+    return cv2.GaussianBlur(img, (5, 5), 0)
+
+
+def synthetic_detections(width: int, height: int, num: int = 10) -> List[Dict]:
+    """Detections spread over the image, every other one a privacy object"""
+    detections = []
+    for i in range(num):
+        x1, y1 = (i * width) // (num + 1), (i * height) // (num + 1)
+        detections.append({
+            'detected_object_type': "face_privacy_filter" if i % 2 else "garbage",
+            'confidence': 50,
+            'bbox': {
+                'coordinate1': [x1, y1],
+                'coordinate2': [x1 + width // (num + 1), y1 + height // (num + 1)],
+            },
+        })
+    return detections
+
+
+def _size_name(width: int, height: int) -> str:
+    return f"{width}x{height}"
+
+
+def benchmark_detect_stages(
+        detector: YOLOv5Detector, img: np.ndarray, repeats: int = 20
+) -> List[Dict]:
+    """Times every stage of `detector.detect` on a single image, each on the output of the previous stage"""
+    height, width = img.shape[:2]
+    jpeg = image_util.encode_image(img)
+    base64_img = base64.b64encode(jpeg).decode("utf-8")
+
+    decoded = image_util.decode_image(jpeg)
+    prepared = detector._prepare_image(decoded)
+    tensor = detector._to_tensor(prepared)
+    with detector._inference_mode():
+        raw_pred = detector.backend(tensor)
+    pred = batched_non_max_suppression(
+        raw_pred, detector.conf_thres, detector.iou_thres, classes=None, agnostic=detector.agnostic_nms
+    )[0]
+    now = datetime.now()
+
+    def forward():
+        with detector._inference_mode():
+            detector.backend(tensor)
+
+    stages = {
+        'base64_decode': lambda: base64.b64decode(base64_img),
+        'imread': lambda: image_util.decode_image(jpeg),
+        'letterbox': lambda: detector._prepare_image(decoded),
+        'to_tensor': lambda: detector._to_tensor(prepared),
+        'forward': forward,
+        'nms': lambda: batched_non_max_suppression(
+            raw_pred, detector.conf_thres, detector.iou_thres, classes=None, agnostic=detector.agnostic_nms
+        ),
+        # `_create_result` scales the detections in place
+        'postprocess': lambda: detector._create_result(
+            ImgFrame(), pred.clone(), tensor.shape[2:], decoded.shape, now, now
+        ),
+        'detect': lambda: detector.detect(base64_img=base64_img),
+    }
+
+    results = []
+    for name in DETECT_STAGES:
+        results.append({
+            'name': name,
+            'image_size': _size_name(width, height),
+            'batch_size': 1,
+            **time_calls(stages[name], repeats),
+        })
+    return results
+
+
+def benchmark_image_util(img: np.ndarray, repeats: int = 20, num_detections: int = 10) -> List[Dict]:
+    """Times blurring privacy objects and drawing bounding boxes on a base64 image"""
+    height, width = img.shape[:2]
+    base64_img = base64.b64encode(image_util.encode_image(img)).decode("utf-8")
+    detections = synthetic_detections(width, height, num_detections)
+
+    benchmarks = {
+        'blur_privacy_objects': lambda: image_util.blur_privacy_objects(base64_img, detections),
+        'draw_bounding_boxes': lambda: image_util.draw_bounding_boxes(base64_img, detections),
+    }
+    return [
+        {
+            'name': name,
+            'image_size': _size_name(width, height),
+            'batch_size': 1,
+            **time_calls(benchmarks[name], repeats),
+        }
+        for name in IMAGE_UTIL_BENCHMARKS
+    ]
+
+
+def benchmark_detect_batch(
+        detector: YOLOv5Detector, img: np.ndarray, batch_size: int, repeats: int = 20
+) -> Dict:
+    """Times `detector.detect_batch` on `batch_size` copies of an image, also reported per image"""
+    height, width = img.shape[:2]
+    base64_img = base64.b64encode(image_util.encode_image(img)).decode("utf-8")
+
+    timings = time_calls(
+        lambda: detector.detect_batch([ImgFrame(img=base64_img) for _ in range(batch_size)]), repeats
+    )
+    return {
+        'name': "detect_batch",
+        'image_size': _size_name(width, height),
+        'batch_size': batch_size,
+        **timings,
+        'median_ms_per_image': timings['median_ms'] / batch_size,
+    }
+
+
+def run(
+        detector: YOLOv5Detector,
+        image_sizes: List[Tuple[int, int]] = None,
+        batch_sizes: List[int] = None,
+        repeats: int = 20,
+        image: Optional[np.ndarray] = None,
+) -> Dict:
+    """Runs every benchmark for every image size, and `detect_batch` for every batch size
+
+    Args:
+        detector (YOLOv5Detector): The detector to benchmark
+        image_sizes (List[Tuple[int, int]], optional): (width, height) of the images. Defaults to `DEFAULT_IMAGE_SIZES`.
+        batch_sizes (List[int], optional): Batch sizes of `detect_batch`. Defaults to `DEFAULT_BATCH_SIZES`.
+        repeats (int, optional): Number of timed calls per benchmark. Defaults to 20.
+        image (np.ndarray, optional): A real (street) image, resized to every image size.
+        Defaults to a synthetic image.
+
+    Returns:
+        Dict: The environment (`meta`) and the timings of every benchmark (`results`)
+    """
+    image_sizes = image_sizes or DEFAULT_IMAGE_SIZES
+    batch_sizes = batch_sizes or DEFAULT_BATCH_SIZES
+
+    results = []
+    for width, height in image_sizes:
+        img = synthetic_image(width, height) if image is None else cv2.resize(image, (width, height))
+
+        logger.info(f"Benchmarking {_size_name(width, height)} images...")
+        results += benchmark_detect_stages(detector, img, repeats)
+        results += benchmark_image_util(img, repeats)
+        for batch_size in batch_sizes:
+            results.append(benchmark_detect_batch(detector, img, batch_size, repeats))
+
+    return {
+        'meta': {
+            'created_at': datetime.now().isoformat(),
+            'backend': detector.backend_name,
+            'precision': detector.precision,
+            'img_size': detector.img_size,
+            'rect': detector.rect,
+            'device': str(detector.device),
+            'torch': torch.__version__,
+            'threads': torch.get_num_threads(),
+            'cpu_count': os.cpu_count(),
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+        },
+        'results': results,
+    }
+
+
+def _key(result: Dict) -> Tuple[str, str, int]:
+    return result['name'], result['image_size'], result['batch_size']
+
+
+def compare(current: Dict, baseline: Dict, threshold: float = 0.1) -> List[Dict]:
+    """Compares the median times of the benchmarks that are in both reports
+
+    Args:
+        current (Dict): Report of `run`
+        baseline (Dict): Earlier report of `run`, e.g. of the production version
+        threshold (float, optional): Relative slowdown of the median that counts as a regression. Defaults to 0.1.
+
+    Returns:
+        List[Dict]: Per benchmark the baseline and current median, their ratio and whether it regressed
+    """
+    baseline_results = {_key(result): result for result in baseline['results']}
+
+    comparison = []
+    for result in current['results']:
+        base = baseline_results.get(_key(result))
+        if base is None:
+            continue
+        ratio = result['median_ms'] / base['median_ms'] if base['median_ms'] else float("inf")
+        comparison.append({
+            'name': result['name'],
+            'image_size': result['image_size'],
+            'batch_size': result['batch_size'],
+            'baseline_median_ms': base['median_ms'],
+            'median_ms': result['median_ms'],
+            'ratio': ratio,
+            'regressed': ratio > 1 + threshold,
+        })
+    return comparison
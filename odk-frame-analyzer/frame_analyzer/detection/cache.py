@@ -0,0 +1,102 @@
+"""
+Cache of detection results by image content, so a frame that is sent again
+(e.g. by a phone after reconnecting, or by a retry of the API) isn't detected again.
+"""
+import copy
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+# Fields of an `AnalyzedFrame` that only depend on the image, and not on the frame it's part of
+CACHED_FIELDS = ("detected_objects", "object_count", "analyser_meta")
+
+
+def model_fingerprint(weights_location: str, **params: Any) -> str:
+    """Identifies the model and every parameter that influences its detections,
+    so a new weights file or different thresholds never hit results of the old ones"""
+    try:
+        stat = os.stat(weights_location)
+        version = f"{stat.st_size}:{stat.st_mtime_ns}"
+    except OSError:
+        version = "unknown"
+    params = ",".join(f"{key}={value}" for key, value in sorted(params.items()))
+    return f"{os.path.basename(weights_location)}:{version}:{params}"
+
+
+class DetectionCache:
+    """
+    Thread-safe LRU cache with a time-to-live, of detection results by image hash.
+
+    Usage:
+
+    ```
+    cache = DetectionCache(model_fingerprint(weights_location, conf_thres=0.3), max_size=1024, ttl=300)
+
+    key = cache.key(jpeg_bytes)
+    fields = cache.get(key)
+    if fields is None:
+        analyzed_frame = detector.detect(raw_frame=raw_frame)
+        cache.put(key, analyzed_frame)
+    ```
+    """
+
+    def __init__(self, fingerprint: str, max_size: int = 1024, ttl: float = 300.0):
+        self.fingerprint = fingerprint.encode("utf-8")
+        self.max_size = max_size
+        self.ttl = ttl
+
+        # Key -> (time stored, cached fields), least recently used first
+        self._entries: "OrderedDict[str, Tuple[float, Dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, img_bytes: bytes) -> str:
+        """Hashes the encoded image together with the model fingerprint"""
+        h = hashlib.blake2b(self.fingerprint, digest_size=16)
+        h.update(img_bytes)
+        return h.hexdigest()
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Returns a copy of the cached fields, or None when not cached or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                self.evictions += 1
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            fields = entry[1]
+
+        # Copied, so changes to a result never end up in the cache
+        return copy.deepcopy(fields)
+
+    def put(self, key: str, analyzed_frame: Any) -> None:
+        fields = copy.deepcopy({field: getattr(analyzed_frame, field) for field in CACHED_FIELDS})
+
+        with self._lock:
+            self._entries[key] = (time.monotonic(), fields)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
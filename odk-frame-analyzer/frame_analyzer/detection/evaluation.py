@@ -0,0 +1,114 @@
+"""
+Accuracy of a detector on a labelled sample set, to compare precisions and backends against fp32.
+
+Labels are in the YOLO format used for training: for every image `name.jpg` a file `name.txt`
+with a line `class x_center y_center width height` per object, relative to the image size.
+A detection is a true positive when it has the class of a not yet matched label and overlaps
+it with an IoU of at least `iou_thres`.
+"""
+import os
+import time
+from typing import Dict, List, Tuple
+
+from loguru import logger
+
+from frame_analyzer.detection.quantization import list_images
+from frame_analyzer.detection.yolov5_detector import YOLOv5Detector
+from frame_analyzer.schemas.frame import ImgFrame
+from frame_analyzer.schemas.frame_context import FrameContext
+
+Box = Tuple[float, float, float, float]
+
+
+def iou(box1: Box, box2: Box) -> float:
+    inter_w = min(box1[2], box2[2]) - max(box1[0], box2[0])
+    inter_h = min(box1[3], box2[3]) - max(box1[1], box2[1])
+    if inter_w <= 0 or inter_h <= 0:
+        return 0.0
+    inter = inter_w * inter_h
+    area1 = (box1[2] - box1[0]) * (box1[3] - box1[1])
+    area2 = (box2[2] - box2[0]) * (box2[3] - box2[1])
+    return inter / (area1 + area2 - inter)
+
+
+def load_labels(label_path: str, width: int, height: int, names: List[str]) -> List[Tuple[str, Box]]:
+    """Reads YOLO labels as (class name, (x1, y1, x2, y2)) in pixels"""
+    if not os.path.exists(label_path):
+        return []
+
+    labels = []
+    with open(label_path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            cls, xc, yc, w, h = line.split()
+            xc, w = float(xc) * width, float(w) * width
+            yc, h = float(yc) * height, float(h) * height
+            labels.append((names[int(cls)], (xc - w / 2, yc - h / 2, xc + w / 2, yc + h / 2)))
+    return labels
+
+
+def match(
+        detections: List[Dict], labels: List[Tuple[str, Box]], iou_thres: float = 0.5
+) -> Tuple[int, int, int]:
+    """Greedily matches detections to labels, most confident detection first.
+
+    Returns:
+        Tuple[int, int, int]: True positives, false positives and false negatives
+    """
+    matched = [False] * len(labels)
+    tp = 0
+    for det in sorted(detections, key=lambda d: d['confidence'], reverse=True):
+        box = (*det['bbox']['coordinate1'], *det['bbox']['coordinate2'])
+        best, best_iou = None, iou_thres
+        for i, (cls, label_box) in enumerate(labels):
+            if matched[i] or cls != det['detected_object_type']:
+                continue
+            overlap = iou(box, label_box)
+            if overlap >= best_iou:
+                best, best_iou = i, overlap
+        if best is not None:
+            matched[best] = True
+            tp += 1
+    return tp, len(detections) - tp, len(labels) - tp
+
+
+def evaluate(detector: YOLOv5Detector, images_dir: str, labels_dir: str, iou_thres: float = 0.5) -> Dict[str, float]:
+    """Runs the detector on every image in `images_dir` and scores it against `labels_dir`
+
+    Returns:
+        Dict[str, float]: Precision, recall, F1, counts and mean inference time in milliseconds
+    """
+    tp = fp = fn = 0
+    ml_time = 0.0
+    images = list_images(images_dir)
+
+    for path in images:
+        with open(path, "rb") as f:
+            frame_context = FrameContext(raw_bytes=f.read())
+
+        start = time.perf_counter()
+        result = detector.detect(raw_frame=ImgFrame(), frame_context=frame_context)
+        ml_time += time.perf_counter() - start
+
+        label_path = os.path.join(labels_dir, os.path.splitext(os.path.basename(path))[0] + ".txt")
+        labels = load_labels(label_path, frame_context.width, frame_context.height, detector.names)
+
+        image_tp, image_fp, image_fn = match(result.detected_objects, labels, iou_thres)
+        tp, fp, fn = tp + image_tp, fp + image_fp, fn + image_fn
+
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    report = {
+        'images': len(images),
+        'tp': tp,
+        'fp': fp,
+        'fn': fn,
+        'precision': precision,
+        'recall': recall,
+        'f1': f1,
+        'ms_per_image': 1000 * ml_time / len(images) if images else 0.0,
+    }
+    logger.info(f"Evaluated {detector.backend_name} backend at {detector.precision}: {report}")
+    return report
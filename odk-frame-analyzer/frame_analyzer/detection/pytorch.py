@@ -13,7 +13,7 @@ import torchvision.models as models
 from PIL import Image
 from loguru import logger
 from torchvision.transforms import transforms
-from utils.torch_utils import select_device
+from frame_analyzer.detection.yolov5_utils import select_device
 
 
 class PyTorchDetector:
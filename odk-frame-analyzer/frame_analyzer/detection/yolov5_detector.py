@@ -1,27 +1,35 @@
 from datetime import datetime
-import io
+import math
 import sys
+import time
 import base64
-from typing import Any, List, Dict
+from typing import Any, List, Dict, Tuple
 
 import torch
 from loguru import logger
-import imageio
-import cv2
 import numpy as np
 
-# for running from `main,py` 
+# for running from `main,py`, the eager torch backend unpickles the YOLOv5 model classes
 sys.path.append("yolov5")
 # for running from current file
 #sys.path.append("../../yolov5")
 
-from utils.torch_utils import select_device
-from utils.datasets import letterbox
-from utils.general import non_max_suppression, scale_coords
-
 #sys.path.append("../..")
 
+from frame_analyzer.detection.backends import load_backend
+from frame_analyzer.detection.yolov5_utils import select_device, letterbox, batched_non_max_suppression, scale_coords
 from frame_analyzer.schemas.frame import BaseFrame, AnalyzedFrame, ImgFrame
+from frame_analyzer.schemas.frame_context import FrameContext
+
+
+# Largest stride of the model, input sides must be a multiple of it (see `letterbox`)
+STRIDE = 32
+# Aspect ratio (width / height) of the frames of most cameras, warmed up with rectangular inference
+COMMON_ASPECT_RATIO = 16 / 9
+
+# Default thresholds of the detector
+CONF_THRES = 0.3
+IOU_THRES = 0.5
 
 
 class YOLOv5Detector:
@@ -49,36 +57,104 @@ class YOLOv5Detector:
     ```
     """
 
-    def __init__(self, weights_location: str):
+    def __init__(
+            self, weights_location: str, warmup_batch_sizes: List[int] = None,
+            backend: str = "torch", precision: str = "fp32", img_size: int = 640, rect: bool = False,
+    ):
+        """
+        Args:
+            weights_location (str): Path to the weights file, or to a model exported by `backends.export`
+            warmup_batch_sizes (List[int], optional): Batch sizes to run the model with once
+            before the first frame arrives, see `warmup`. Defaults to [1], pass [] to skip.
+            backend (str, optional): Inference backend, one of `backends.BACKENDS`. Defaults to "torch".
+            precision (str, optional): One of `backends.PRECISIONS`, `int8` requires the onnx backend
+            and `bf16` the torch backend. Defaults to "fp32".
+            img_size (int, optional): Size of the longest side of the model input, a multiple of 32. Defaults to 640.
+            rect (bool, optional): Pad images only to the nearest multiple of 32 (rectangular inference),
+            instead of to an `img_size` square. Only the torch backend takes rectangular input,
+            exported models always run on squares. Defaults to False.
+        """
+        if img_size % STRIDE:
+            raise ValueError(f"Image size {img_size} is not a multiple of {STRIDE}")
+
         self.device = select_device()
         logger.info(f"Using device: {self.device}")
 
-        model_loaded = torch.load(weights_location, map_location=self.device)
-        self.model = model_loaded['model'].float().eval()
-
         # Setting default values
-        self.conf_thres = 0.3
-        self.iou_thres = 0.5
+        self.conf_thres = CONF_THRES
+        self.iou_thres = IOU_THRES
         self.agnostic_nms = True
-        self.augment = False
-        self.img_size = 640
+        self.img_size = img_size
+
+        self.backend = load_backend(weights_location, backend, self.device, self.img_size, precision)
+        self.backend_name = backend
+        self.precision = precision
+        # Class names by class index, looked up for every detection
+        self.names: List[str] = list(self.backend.names)
+        logger.info(f"Using {backend} backend at {precision}")
+
+        # Exported models are traced at a fixed input shape
+        self.rect = rect and backend == "torch"
+        if rect and not self.rect:
+            logger.warning(f"The {backend} backend doesn't support rectangular inference, padding to squares")
+
+        # Autograd is never needed, `inference_mode` (torch >= 1.9) also skips view and version tracking
+        self._inference_mode = getattr(torch, "inference_mode", torch.no_grad)
+
+        self.warmup_seconds = self.warmup([1] if warmup_batch_sizes is None else warmup_batch_sizes)
 
         logger.info("YOLOv5Detector initialized")
 
-    def _create_output_json(self, bbox: List, classes: List) -> Dict[str, Any]:
-        c1, c2 = (int(bbox[0]), int(bbox[1])), (int(bbox[2]), int(bbox[3]))
+    def warmup(self, batch_sizes: List[int]) -> float:
+        """Runs the model on dummy input for every batch size, so kernel selection and memory
+        allocation happen on startup instead of on the first frames. With rectangular inference
+        also on the padded shape of 16:9 frames, besides the `img_size` square.
 
-        label = classes[int(bbox[5])]
-        confidence = int(float(bbox[4]) * 100)
+        Args:
+            batch_sizes (List[int]): Batch sizes to warm up, e.g. [1, 8] for a worker that batches
 
-        return {
-            'detected_object_type': label,
-            'confidence': confidence,
-            'bbox': {
-                'coordinate1': c1,
-                'coordinate2': c2
+        Returns:
+            float: Seconds spent warming up
+        """
+        start = time.perf_counter()
+        for batch_size in batch_sizes:
+            for height, width in self.warmup_shapes():
+                img = torch.zeros((batch_size, 3, height, width), device=self.device)
+                with self._inference_mode():
+                    self._infer(img)
+
+        warmup_seconds = time.perf_counter() - start
+        if batch_sizes:
+            logger.info(f"Warmed up model for batch sizes {batch_sizes} in {warmup_seconds:.2f}s")
+        return warmup_seconds
+
+    def warmup_shapes(self) -> List[Tuple[int, int]]:
+        """(height, width) of the model inputs to warm up: the square, and with rectangular
+        inference the letterboxed shape of a landscape frame of `COMMON_ASPECT_RATIO`"""
+        shapes = [(self.img_size, self.img_size)]
+        if self.rect:
+            height = math.ceil(round(self.img_size / COMMON_ASPECT_RATIO) / STRIDE) * STRIDE
+            shapes.append((height, self.img_size))
+        return shapes
+
+    def _create_detected_objects(self, pred: torch.Tensor) -> List[Dict[str, Any]]:
+        """Converts the (already scaled) detections of an image to dicts, with one
+        `.tolist()` per column instead of a tensor lookup per value"""
+        boxes = pred[:, :4].int().tolist()
+        confidences = pred[:, 4].tolist()
+        class_ids = pred[:, 5].int().tolist()
+
+        return [
+            {
+                'detected_object_type': self.names[class_id],
+                'confidence': int(confidence * 100),
+                'bbox': {
+                    'coordinate1': (box[0], box[1]),
+                    'coordinate2': (box[2], box[3])
+                }
             }
-        }
+            for box, confidence, class_id in zip(boxes, confidences, class_ids)
+        ]
 
         # TODO: consider transform dict to pydantic class
         # bbox = BoundingBox(
@@ -92,76 +168,142 @@ class YOLOv5Detector:
         #     bbox=bbox
         # )
 
-    def detect(self, base64_img: str = None, raw_frame: BaseFrame = None) -> AnalyzedFrame:
+    def detect(
+            self, base64_img: str = None, raw_frame: BaseFrame = None, frame_context: FrameContext = None
+    ) -> AnalyzedFrame:
         if not raw_frame:
             raw_frame = ImgFrame(
                 img=base64_img
             )
-        return self._detect(raw_frame)
+        with self._inference_mode():
+            return self._detect(raw_frame, frame_context)
 
-    def _detect(self, raw_frame: BaseFrame) -> AnalyzedFrame:
-        """Core to this entire application, this function detects objects on a base64 image.
-        It borrows some code from yolov5 to achieve this.
+    def detect_batch(
+            self, raw_frames: List[BaseFrame], frame_contexts: List[FrameContext] = None
+    ) -> List[AnalyzedFrame]:
+        """Detects objects on multiple frames with a single forward pass of the model per padded shape.
+
+        With rectangular inference, frames of the same aspect ratio (e.g. all frames of
+        a phone stream) get the same padded shape and are stacked into one tensor.
+        Else every image is letterboxed to the full `self.img_size` square.
 
         Args:
-            raw_frame (RawFrame): An object that contains the base64 image
+            raw_frames (List[BaseFrame]): Frames that each contain a base64 image
+            frame_contexts (List[FrameContext], optional): Already decoded images of the frames
 
         Returns:
-            AnalyzedFrame: A combination of the original frame plus its meta data,
-            together with the detected objects in the form of a count and bounding boxes.
-            Finally it adds meta data about time taken and information about the model used.
+            List[AnalyzedFrame]: One result per frame, in the same order as `raw_frames`
         """
+        if not raw_frames:
+            return []
+
+        with self._inference_mode():
+            return self._detect_batch(raw_frames, frame_contexts)
+
+    def _detect_batch(
+            self, raw_frames: List[BaseFrame], frame_contexts: List[FrameContext] = None
+    ) -> List[AnalyzedFrame]:
         # Start timer
         start_time = datetime.now()
+        prepare_start = time.perf_counter()
+
+        frame_contexts = frame_contexts or [None] * len(raw_frames)
+        original_imgs = [
+            self._decode_image(raw_frame, frame_context)
+            for raw_frame, frame_context in zip(raw_frames, frame_contexts)
+        ]
+        imgs = [self._prepare_image(img) for img in original_imgs]
+        prepare_seconds = (time.perf_counter() - prepare_start) / len(raw_frames)
+
+        # Group the frames by padded shape, only images of the same shape can be stacked
+        groups: Dict[Tuple[int, ...], List[int]] = {}
+        for i, img in enumerate(imgs):
+            groups.setdefault(img.shape, []).append(i)
+
+        results: List[AnalyzedFrame] = [None] * len(raw_frames)
+        for indices in groups.values():
+            tensor_start = time.perf_counter()
+            batch = self._to_tensor(np.stack([imgs[i] for i in indices]))
+            stage_seconds = {'preprocess': prepare_seconds * len(indices) + time.perf_counter() - tensor_start}
+            preds = self._infer(batch, stage_seconds)
+
+            # End timer
+            end_time = datetime.now()
+
+            for i, pred in zip(indices, preds):
+                results[i] = self._create_result(
+                    raw_frames[i], pred, batch.shape[2:], original_imgs[i].shape, start_time, end_time,
+                    batch_size=len(indices), stage_seconds=stage_seconds,
+                )
+
+        return results
+
+    def _decode_image(self, raw_frame: BaseFrame, frame_context: FrameContext = None) -> np.ndarray:
+        """Returns the BGR image array of a frame, only decodes the base64 image
+        when no (already decoded) frame context is given"""
+        if frame_context is not None:
+            return frame_context.image
 
         # Remove `data:image/jpeg;base64,` from string
         if raw_frame.img.find(',') > -1:
             raw_frame.img = raw_frame.img.split(',')[1]
 
-        # Convert image
-        original_img = imageio.imread(io.BytesIO(base64.b64decode(raw_frame.img)))
-        img = cv2.cvtColor(original_img, cv2.COLOR_BGR2RGB)
+        return FrameContext.from_base64(raw_frame.img).image
 
-        # Padded resize
-        img = letterbox(img, new_shape=self.img_size)[0]
+    def _prepare_image(self, img: np.ndarray) -> np.ndarray:
+        """Letterboxes a BGR image and converts it to a contiguous 3xHxW RGB array"""
+        # Padded resize, to a multiple of the stride with rectangular inference
+        img = letterbox(img, new_shape=self.img_size, auto=self.rect)[0]
 
         # Convert
         img = img[:, :, ::-1].transpose(2, 0, 1)  # BGR to RGB, to 3x416x416
-        img = np.ascontiguousarray(img)
+        return np.ascontiguousarray(img)
 
+    def _to_tensor(self, img: np.ndarray) -> torch.Tensor:
         img = torch.from_numpy(img).to(self.device)
         img = img.float()  # uint8 to fp16/32
         img /= 255.0  # 0 - 255 to 0.0 - 1.0
         if img.ndimension() == 3:
             img = img.unsqueeze(0)
+        return img
 
+    def _infer(self, img: torch.Tensor, stage_seconds: Dict[str, float] = None) -> List[torch.Tensor]:
+        """Runs the model and NMS on a batch of images, returns detections per image.
+        Adds the seconds spent on `inference` and `nms` to `stage_seconds`, when given"""
         # Inference
-        pred = self.model(img, augment=self.augment)[0]
+        start = time.perf_counter()
+        pred = self.backend(img)
+        inferred = time.perf_counter()
 
         # Apply NMS
-        pred = non_max_suppression(pred, self.conf_thres, self.iou_thres, classes=False, agnostic=self.agnostic_nms)[0]
-
+        preds = batched_non_max_suppression(
+            pred, self.conf_thres, self.iou_thres, classes=None, agnostic=self.agnostic_nms
+        )
+
+        if stage_seconds is not None:
+            stage_seconds['inference'] = inferred - start
+            stage_seconds['nms'] = time.perf_counter() - inferred
+        return preds
+
+    def _create_result(
+            self, raw_frame: BaseFrame, pred: torch.Tensor, img_shape: Tuple, original_shape: Tuple,
+            start_time: datetime, end_time: datetime, batch_size: int = 1, stage_seconds: Dict[str, float] = None
+    ) -> AnalyzedFrame:
         # Create bounding boxes
         detected_objects = []
+        class_counts = [0] * len(self.names)
 
-        classes = self.model.module.names if hasattr(
-            self.model, 'module') else self.model.names
-
-        if pred is not None:
+        if pred is not None and len(pred):
             # Scale coordinates
-            pred[:, :4] = scale_coords(img.shape[2:], pred[:, :4], original_img.shape).round()
-            for i, det in enumerate(pred):
-                detected_objects.append(self._create_output_json(det, classes))
+            pred[:, :4] = scale_coords(img_shape, pred[:, :4], original_shape).round()
+            detected_objects = self._create_detected_objects(pred)
 
-        # Count objects
-        counts = {x: 0 for x in classes}
-        counts["total"] = 0
-        for box in detected_objects:
-            counts[box['detected_object_type']] += 1
-            counts["total"] +=1
+            # Count objects per class index
+            class_counts = torch.bincount(pred[:, 5].long(), minlength=len(self.names)).tolist()
+
+        counts = dict(zip(self.names, class_counts))
+        counts["total"] = len(detected_objects)
 
-        # End timer
-        end_time = datetime.now()
         time_taken = (end_time - start_time).total_seconds()
 
         # Build return object
@@ -172,12 +314,46 @@ class YOLOv5Detector:
             'ml_start_at': start_time,
             'ml_done_at': end_time,
             'ml_time_taken': time_taken,
+            'ml_batch_size': batch_size,
+            # Seconds spent per stage on the batch of this frame
+            'ml_stage_seconds': dict(stage_seconds or {}),
+            'ml_backend': self.backend_name,
+            'ml_precision': self.precision,
             'model_name': "todo",
             'model_version': "todo",
         }
 
         return result
 
+    def _detect(self, raw_frame: BaseFrame, frame_context: FrameContext = None) -> AnalyzedFrame:
+        """Core to this entire application, this function detects objects on a base64 image.
+        It borrows some code from yolov5 to achieve this.
+
+        Args:
+            raw_frame (RawFrame): An object that contains the base64 image
+            frame_context (FrameContext, optional): The already decoded image of the frame
+
+        Returns:
+            AnalyzedFrame: A combination of the original frame plus its meta data,
+            together with the detected objects in the form of a count and bounding boxes.
+            Finally it adds meta data about time taken and information about the model used.
+        """
+        # Start timer
+        start_time = datetime.now()
+        prepare_start = time.perf_counter()
+
+        original_img = self._decode_image(raw_frame, frame_context)
+        img = self._to_tensor(self._prepare_image(original_img))
+        stage_seconds = {'preprocess': time.perf_counter() - prepare_start}
+        pred = self._infer(img, stage_seconds)[0]
+
+        # End timer
+        end_time = datetime.now()
+
+        return self._create_result(
+            raw_frame, pred, img.shape[2:], original_img.shape, start_time, end_time, stage_seconds=stage_seconds
+        )
+
 
 if __name__ == "__main__":
     weights_location = "../../weights/garb_weights.pt"
@@ -172,6 +172,78 @@ def non_max_suppression(prediction, conf_thres=0.25, iou_thres=0.45, classes=Non
     return output
 
 
+def batched_non_max_suppression(prediction, conf_thres=0.25, iou_thres=0.45, classes=None, agnostic=False):
+    """
+    Same results as `non_max_suppression`, but with a single NMS call for all images of a batch
+    instead of a loop over the images: boxes are grouped by image index in `batched_nms`,
+    on top of the class offset. Apriori labels, merge-NMS and the time limit aren't supported.
+
+    Returns:
+         list of detections, on (n,6) tensor per image [xyxy, conf, cls]
+    """
+    bs = prediction.shape[0]  # batch size
+    nc = prediction.shape[2] - 5  # number of classes
+
+    # Settings, see `non_max_suppression`
+    max_wh = 4096  # (pixels) maximum box width and height
+    max_det = 300  # maximum number of detections per image
+    max_nms = 30000  # maximum number of boxes per image into torchvision.ops.nms()
+    multi_label = nc > 1  # multiple labels per box
+
+    output = [torch.zeros((0, 6), device=prediction.device)] * bs
+
+    # Candidates of all images, together with the index of their image
+    img_idx, box_idx = (prediction[..., 4] > conf_thres).nonzero(as_tuple=True)
+    x = prediction[img_idx, box_idx]  # confidence
+    if not x.shape[0]:
+        return output
+
+    # Compute conf
+    x[:, 5:] *= x[:, 4:5]  # conf = obj_conf * cls_conf
+
+    # Box (center x, center y, width, height) to (x1, y1, x2, y2)
+    box = xywh2xyxy(x[:, :4])
+
+    # Detections matrix nx6 (xyxy, conf, cls)
+    if multi_label:
+        i, j = (x[:, 5:] > conf_thres).nonzero(as_tuple=False).T
+        x = torch.cat((box[i], x[i, j + 5, None], j[:, None].float()), 1)
+        img_idx = img_idx[i]
+    else:  # best class only
+        conf, j = x[:, 5:].max(1, keepdim=True)
+        keep = conf.view(-1) > conf_thres
+        x = torch.cat((box, conf, j.float()), 1)[keep]
+        img_idx = img_idx[keep]
+
+    # Filter by class
+    if classes is not None:
+        keep = (x[:, 5:6] == torch.tensor(classes, device=x.device)).any(1)
+        x, img_idx = x[keep], img_idx[keep]
+
+    # Check shape
+    if not x.shape[0]:  # no boxes
+        return output
+    if (torch.bincount(img_idx, minlength=bs) > max_nms).any():  # excess boxes, in any image
+        keep = []
+        for xi in range(bs):
+            k = (img_idx == xi).nonzero(as_tuple=False).view(-1)
+            keep.append(k[x[k, 4].argsort(descending=True)[:max_nms]])  # sort by confidence
+        keep = torch.cat(keep)
+        x, img_idx = x[keep], img_idx[keep]
+
+    # Batched NMS
+    c = x[:, 5:6] * (0 if agnostic else max_wh)  # classes
+    boxes, scores = x[:, :4] + c, x[:, 4]  # boxes (offset by class), scores
+    i = torchvision.ops.batched_nms(boxes, scores, img_idx, iou_thres)  # NMS per image, sorted by score
+
+    # Split the kept boxes per image
+    img_idx = img_idx[i]
+    for xi in range(bs):
+        output[xi] = x[i[img_idx == xi][:max_det]]  # limit detections
+
+    return output
+
+
 def scale_coords(img1_shape, coords, img0_shape, ratio_pad=None):
     """
     Source: yolov5 > utils > general > scale_coords
@@ -1,9 +1,13 @@
 import os
 import abc
 import asyncio
+import functools
 import json
 from json.decoder import JSONDecodeError
+import time
 import typing
+from datetime import datetime
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
 
 import base64           # Added by Haider Al-Lawati for debugging
 from io import BytesIO  # Added by Haider Al-Lawati for debugging
@@ -11,12 +15,26 @@ from PIL import Image   # Added by Haider Al-Lawati for debugging
 
 import aio_pika
 import httpx
+import numpy as np
+import torch
 from loguru import logger
+from pydantic import ValidationError
 
+from frame_analyzer.detection import backends
 from frame_analyzer.detection.pytorch import PyTorchDetector
-from frame_analyzer.detection.yolov5_detector import YOLOv5Detector
-from frame_analyzer.schemas.frame import RawFrame, AnalyzedFrame
-from frame_analyzer.utils import image_util, persist_util, privacy_util
+from frame_analyzer.detection.cache import DetectionCache, model_fingerprint
+from frame_analyzer.detection.yolov5_detector import YOLOv5Detector, CONF_THRES, IOU_THRES
+from frame_analyzer.schemas.frame import BaseFrame, RawFrame, RawFrameMeta, AnalyzedFrame
+from frame_analyzer.schemas.frame_context import FrameContext
+from frame_analyzer.utils import (
+    dedup_util, image_util, metrics_util, persist_util, privacy_util, storage_util, trace_util
+)
+
+
+# Raw frames can be received as JSON with a base64 image,
+# or as binary: the image as message body and the rest of the frame in a header
+BINARY_CONTENT_TYPES = ("image/jpeg", "application/octet-stream")
+FRAME_META_HEADER = "frame_meta"
 
 
 class AbstractRabbitMQWorker(abc.ABC):
@@ -60,6 +78,8 @@ class AbstractRabbitMQWorker(abc.ABC):
             in_routing_key: str = None,
             out_exchange_name: str = None,
             out_routing_key: str = None,
+            prefetch_count: int = None,
+            max_in_flight: int = None,
     ):
         self.loop: typing.Optional[asyncio.base_events.BaseEventLoop] = None
 
@@ -83,6 +103,12 @@ class AbstractRabbitMQWorker(abc.ABC):
         self.out_exchange: aio_pika.Exchange = None
         self.out_routing_key = out_routing_key
 
+        # Flow control: the broker sends at most `prefetch_count` unacknowledged messages,
+        # of which at most `max_in_flight` are processed at the same time
+        self.prefetch_count = prefetch_count
+        self.max_in_flight = max_in_flight
+        self._in_flight = asyncio.Semaphore(max_in_flight) if max_in_flight else None
+
     async def _get_channel(self) -> aio_pika.RobustChannel:
         """Gets or opens a channel on the RabbitMQ host"""
         logger.info(f"Opening channel on {self.host}:{self.port}...")
@@ -152,6 +178,9 @@ class AbstractRabbitMQWorker(abc.ABC):
         async def inner() -> None:
             self.connection = await self._get_connection(host, username, password, port)
             self.channel = await self._get_channel()
+            if self.prefetch_count:
+                await self.channel.set_qos(prefetch_count=self.prefetch_count)
+                logger.info(f"Set prefetch count to {self.prefetch_count}")
 
             if self.in_exchange_name:
                 self.in_exchange = await self._get_exchange(self.in_exchange_name)
@@ -190,15 +219,110 @@ class AbstractRabbitMQWorker(abc.ABC):
         """
         pass
 
+    async def _process_message(self, message: aio_pika.IncomingMessage, **kwargs) -> None:
+        """Acknowledges a message after `on_message` has finished,
+        or rejects it when `on_message` raised an exception"""
+        async with message.process(ignore_processed=True):
+            await self.on_message(message, **kwargs)
+
+    async def _consume_message(self, message: aio_pika.IncomingMessage, no_ack: bool) -> None:
+        # `on_message` gets the (`time.perf_counter`) time the message was delivered,
+        # to know how long it waited for room in `max_in_flight`
+        handle = self.on_message if no_ack else self._process_message
+        if self._in_flight is None:
+            await handle(message, delivered_at=time.perf_counter())
+            return
+        delivered_at = time.perf_counter()
+        async with self._in_flight:
+            await handle(message, delivered_at=delivered_at)
+
     async def start_consuming(self, no_ack=True) -> None:
-        """Start consuming and processing messages"""
+        """Start consuming and processing messages
+
+        Args:
+            no_ack (bool, optional): When False, a message is only acknowledged after it has
+            been processed successfully, so it is redelivered when a worker dies. Defaults to True.
+        """
         if not self.in_queue:
             await self._connect()
         logger.info(
             f"Ready to start processing messages from queue {self.in_queue_name} "
             f"on host {self.host}:{self.port}..."
         )
-        await self.in_queue.consume(self.on_message, no_ack=no_ack)
+        await self.in_queue.consume(
+            functools.partial(self._consume_message, no_ack=no_ack), no_ack=no_ack
+        )
+
+
+# Detector of a process in the process pool of a `RabbitMQWorker`, see `_init_process_detector`
+_process_detector: typing.Optional[YOLOv5Detector] = None
+
+
+def _init_process_detector(weights_location: str, num_threads: int, detector_options: typing.Dict) -> None:
+    """Initializer for every process in a process pool, loads the model once per process"""
+    global _process_detector
+    torch.set_num_threads(num_threads)
+    _process_detector = YOLOv5Detector(weights_location, **detector_options)
+
+
+def _render(
+        image: np.ndarray, detected_objects: typing.List, object_count: typing.Dict,
+        draw_bbox: bool, include_privacy: bool, bbox_on_blurred: bool,
+) -> typing.Tuple[typing.Optional[bytes], typing.Optional[bytes]]:
+    """Blurs the privacy objects and draws the bounding boxes (when saved) on an image
+
+    Returns:
+        Tuple[Optional[bytes], Optional[bytes]]: The encoded blurred image and image with bounding boxes
+    """
+    if not detected_objects:
+        return None, None
+
+    blurred = image_util.blur_privacy_objects_on_array(image, detected_objects)
+    bbox_bytes = None
+    # Same rules as `RabbitMQWorker.save_frame`, copy of the counts since the total is removed
+    if draw_bbox and (include_privacy or privacy_util.not_only_privacy_objects(dict(object_count))):
+        bbox_img = image_util.draw_bounding_boxes_on_array(
+            blurred if bbox_on_blurred else image, detected_objects, include_privacy_objects=True
+        )
+        bbox_bytes = image_util.encode_image(bbox_img)
+    return image_util.encode_image(blurred), bbox_bytes
+
+
+def _process_prepare(raw_bytes: bytes) -> typing.Tuple[typing.Tuple[int, ...], int]:
+    """Decodes an image in a pool process, only its shape and dHash are sent back"""
+    image = image_util.decode_image(raw_bytes)
+    return image.shape, dedup_util.dhash(image)
+
+
+def _process_analyse(
+        raw_frame: RawFrame, frame_context: FrameContext, render_options: typing.Dict,
+        detected: typing.Optional[AnalyzedFrame] = None,
+) -> typing.Tuple[AnalyzedFrame, typing.Tuple[int, ...], typing.Optional[bytes], typing.Optional[bytes]]:
+    """Runs every stage of a frame in a single pool process: decode, detect (unless `detected`
+    is given, e.g. from the cache or a batch), blur, encode and draw bounding boxes.
+    Only the encoded images are sent back, pickling the pixel buffers costs more than encoding them"""
+    image = frame_context.image
+    analyzed_frame = detected
+    if analyzed_frame is None:
+        analyzed_frame = _process_detector.detect(raw_frame=raw_frame, frame_context=frame_context)
+    blurred_bytes, bbox_bytes = _render(
+        image, analyzed_frame.detected_objects, analyzed_frame.object_count, **render_options
+    )
+    return analyzed_frame, image.shape, blurred_bytes, bbox_bytes
+
+
+def _process_detect_batch(
+        raw_frames: typing.List[RawFrame], frame_contexts: typing.List[FrameContext], render_options: typing.Dict,
+) -> typing.List[typing.Tuple[AnalyzedFrame, typing.Tuple[int, ...], typing.Optional[bytes], typing.Optional[bytes]]]:
+    """Detects a batch in a single pool process and renders every frame of it, like `_process_analyse`,
+    so every image is decoded once and only crosses the process boundary encoded"""
+    analyzed_frames = _process_detector.detect_batch(raw_frames, frame_contexts)
+    return [
+        (analyzed_frame, frame_context.image.shape) + _render(
+            frame_context.image, analyzed_frame.detected_objects, analyzed_frame.object_count, **render_options
+        )
+        for analyzed_frame, frame_context in zip(analyzed_frames, frame_contexts)
+    ]
 
 
 class EchoWorker(AbstractRabbitMQWorker):
@@ -215,9 +339,48 @@ class RabbitMQWorker(AbstractRabbitMQWorker):
             savewith, includepriv, savewithout, blur, bbox,
             in_exchange_name, in_queue_name, in_routing_key,
             out_exchange_name=None, out_routing_key=None,
-            output_location="output"
+            output_location="output",
+            batch_size: int = 1, batch_timeout: int = 50,
+            executor_type: str = "thread", executor_workers: int = None, max_pending_jobs: int = None,
+            prefetch_count: int = None, max_in_flight: int = None,
+            slim_results: bool = False,
+            warmup: bool = True, backend: str = "torch", precision: str = "fp32",
+            img_size: int = 640, rect: bool = False,
+            cache_size: int = 0, cache_ttl: float = 300.0,
+            dedup: str = "off", dedup_hamming: int = 5, dedup_distance: float = 5.0, dedup_interval: float = 60.0,
+            write_queue_size: int = 0, write_workers: int = 2, sync_every: int = 0,
+            storage: str = "local", s3_bucket: str = None, s3_endpoint: str = None, s3_prefix: str = "",
+            s3_pool_size: int = 32,
+            trace_sample_rate: float = 0.0, trace_export: str = None,
     ):
-        self.yolov5_detector = YOLOv5Detector(weights_location)
+        # Warm up the model for single frames and full batches before consuming
+        self.detector_options = {
+            "warmup_batch_sizes": sorted({1, batch_size}) if warmup else [],
+            "backend": backend,
+            "precision": precision,
+            "img_size": img_size,
+            "rect": rect,
+        }
+
+        # Execution stage: detection and image processing run in a thread or process pool,
+        # so the event loop stays free for heartbeats, publishes and acks
+        if executor_type not in ("thread", "process"):
+            raise ValueError(f"Unknown executor type: {executor_type}")
+        self.executor_type = executor_type
+        self.executor_workers = executor_workers or os.cpu_count()
+        self.max_pending_jobs = max_pending_jobs or 2 * self.executor_workers
+        # With a process pool every process loads its own model, from the model exported here once,
+        # so the processes don't all export it to the same file at the same time
+        model_location = weights_location
+        if executor_type == "process":
+            model_location = backends.prepare_model(weights_location, backend, img_size=img_size, precision=precision)
+        self.executor: Executor = self._create_executor(model_location)
+        self._pending_jobs = asyncio.Semaphore(self.max_pending_jobs)
+
+        # With a process pool every process loads its own model
+        self.yolov5_detector = (
+            YOLOv5Detector(weights_location, **self.detector_options) if executor_type == "thread" else None
+        )
         #self.pytorch_detector = PyTorchDetector(weights_location)
             #"weights/garb_weights.pt"
         #    "weights/resnet_18_multilabel_weighted_SGD.pt"
@@ -229,39 +392,242 @@ class RabbitMQWorker(AbstractRabbitMQWorker):
         self.savewithout = savewithout
         self.blur = blur
         self.bbox = bbox
+        self.slim_results = slim_results
+
+        # Detection cache: frames with an image that was detected before (within `cache_ttl` seconds)
+        # reuse that result, shared by all threads or processes of the pool
+        self.detection_cache: typing.Optional[DetectionCache] = None
+        if cache_size:
+            fingerprint = model_fingerprint(
+                weights_location, conf_thres=CONF_THRES, iou_thres=IOU_THRES,
+                **{k: v for k, v in self.detector_options.items() if k != "warmup_batch_sizes"}
+            )
+            self.detection_cache = DetectionCache(fingerprint, max_size=cache_size, ttl=cache_ttl)
+
+        # Near-duplicate suppression: frames (nearly) identical to the last analysed frame of their
+        # stream are dropped, or published with the detections of that frame ("link")
+        if dedup not in ("off", "drop", "link"):
+            raise ValueError(f"Unknown dedup mode: {dedup}")
+        self.dedup = dedup
+        self.duplicate_filter: typing.Optional[dedup_util.NearDuplicateFilter] = None
+        if dedup != "off":
+            self.duplicate_filter = dedup_util.NearDuplicateFilter(
+                max_hamming=dedup_hamming, max_distance=dedup_distance, max_interval=dedup_interval
+            )
+
+        # Images are stored in `output_location`, or in an S3 bucket so workers don't need a shared volume
+        self.storage = storage_util.create_sink(
+            storage, output_location,
+            s3_bucket=s3_bucket, s3_endpoint=s3_endpoint, s3_prefix=s3_prefix, s3_pool_size=s3_pool_size,
+        )
+
+        # Background writes: when `write_queue_size` > 0, images are stored by a dedicated
+        # thread pool, so saving frames doesn't take up the executor or hold up consumption
+        self.background_writer: typing.Optional[persist_util.BackgroundWriter] = None
+        if write_queue_size:
+            self.background_writer = persist_util.BackgroundWriter(
+                self.storage, max_queue_size=write_queue_size, workers=write_workers, sync_every=sync_every,
+                on_failure=self._on_write_failed,
+            )
+
+        # Tracing: frames are traced from API ingest onwards, spans of sampled traces are exported
+        # to `trace_export`. Frames without a trace (from older producers) are sampled here
+        self.trace_sample_rate = trace_sample_rate
+        self.span_exporter: typing.Optional[trace_util.SpanExporter] = trace_util.create_exporter(trace_export)
+
+        # Micro-batching: when `batch_size` > 1, frames are detected in a single forward pass
+        # once `batch_size` frames are waiting, or after `batch_timeout` milliseconds
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        self._batch: typing.List[typing.Tuple[RawFrame, FrameContext, asyncio.Future]] = []
+        self._batch_timer: typing.Optional[asyncio.TimerHandle] = None
+        # References to running batches, tasks without a reference can be garbage collected
+        self._batch_tasks: typing.Set[asyncio.Task] = set()
+
+        # Metrics, served on `/metrics` when the worker is started with a metrics port
+        self._processing = 0
+        self._running_jobs = 0
+        self.metrics = metrics_util.Registry()
+        self._create_metrics()
 
         super().__init__(
             in_exchange_name=in_exchange_name,
             in_queue_name=in_queue_name,
             in_routing_key=in_routing_key,
             out_exchange_name=out_exchange_name,
-            out_routing_key=out_routing_key
+            out_routing_key=out_routing_key,
+            prefetch_count=prefetch_count,
+            max_in_flight=max_in_flight,
         )
 
+    def _create_metrics(self) -> None:
+        """Registers the metrics of the worker. Stage times are wall times on the event loop,
+        so e.g. `decode` includes the time the job waited in the executor"""
+        self.stage_seconds = self.metrics.histogram(
+            "frame_analyzer_stage_seconds", "Seconds spent per stage of processing a frame", ("stage",)
+        )
+        self.frames_total = self.metrics.counter(
+            "frame_analyzer_frames_total", "Received frames by outcome: analysed, duplicate, invalid or failed",
+            ("outcome",)
+        )
+        self.detected_objects_total = self.metrics.counter(
+            "frame_analyzer_detected_objects_total", "Objects detected on analysed frames"
+        )
+        self.write_failures_total = self.metrics.counter(
+            "frame_analyzer_write_failures_total",
+            "Images that couldn't be stored in the background, after their result was published",
+        )
+        self.frame_age_seconds = self.metrics.histogram(
+            "frame_analyzer_frame_age_seconds", "Seconds between taking a frame and publishing its result",
+            buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0),
+        )
+
+        self.metrics.gauge(
+            "frame_analyzer_messages_in_progress", "Messages being processed"
+        ).set_function(lambda: self._processing)
+        self.metrics.gauge(
+            "frame_analyzer_executor_jobs_running", "Jobs submitted to the executor and not finished yet"
+        ).set_function(lambda: self._running_jobs)
+        self.metrics.gauge(
+            "frame_analyzer_batch_waiting", "Frames waiting for the current batch to be detected"
+        ).set_function(lambda: len(self._batch))
+
+        if self.background_writer is not None:
+            self.metrics.gauge(
+                "frame_analyzer_write_queue_size", "Images waiting to be stored in the background"
+            ).set_function(lambda: self.background_writer.queue_size)
+        if self.detection_cache is not None:
+            cache_gauge = self.metrics.gauge("frame_analyzer_detection_cache", "Detection cache statistics", ("stat",))
+            for stat in self.detection_cache.stats():
+                cache_gauge.set_function(lambda stat=stat: self.detection_cache.stats()[stat], stat=stat)
+        if self.duplicate_filter is not None:
+            dedup_gauge = self.metrics.gauge("frame_analyzer_dedup", "Near-duplicate filter statistics", ("stat",))
+            for stat in self.duplicate_filter.stats():
+                dedup_gauge.set_function(lambda stat=stat: self.duplicate_filter.stats()[stat], stat=stat)
+
+    def _create_executor(self, weights_location: str) -> Executor:
+        logger.info(f"Starting {self.executor_type} pool with {self.executor_workers} workers")
+        if self.executor_type == "process":
+            # Divide the cores over the processes, instead of every process using all of them
+            num_threads = max(1, (os.cpu_count() or 1) // self.executor_workers)
+            return ProcessPoolExecutor(
+                max_workers=self.executor_workers,
+                initializer=_init_process_detector,
+                initargs=(weights_location, num_threads, self.detector_options),
+            )
+        return ThreadPoolExecutor(max_workers=self.executor_workers)
+
+    async def run_blocking(self, func: typing.Callable, *args, **kwargs) -> typing.Any:
+        """Runs a blocking function in the executor, waits while `max_pending_jobs` are in flight"""
+        with self.stage_seconds.time(stage="executor_wait"):
+            await self._pending_jobs.acquire()
+        self._running_jobs += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, functools.partial(func, *args, **kwargs)
+            )
+        finally:
+            self._running_jobs -= 1
+            self._pending_jobs.release()
+
     async def on_message(
-            self, message: aio_pika.IncomingMessage, *args, **kwargs
+            self, message: aio_pika.IncomingMessage, *args, delivered_at: float = None, **kwargs
     ) -> None:
-        logger.info("Received message. Processing...")
+        """Processes a frame and records how long it took and how it ended
+
+        Args:
+            message (aio_pika.IncomingMessage): Message with a raw frame
+            delivered_at (float, optional): `time.perf_counter` time the message was delivered,
+            the time until now is recorded as the `consume_wait` stage
+        """
+        start = time.perf_counter()
+        received_at = time.time()
+        if delivered_at is not None:
+            self.stage_seconds.observe(start - delivered_at, stage="consume_wait")
+            received_at -= start - delivered_at
+
+        self._processing += 1
         try:
-            frame_data = json.loads(message.body.decode("utf-8"))
-        except JSONDecodeError as e:
-            logger.error(f"Message not JSON decodable: {message.body}")
-            return
+            outcome = await self._on_message(message, received_at)
+        except Exception:
+            self.frames_total.inc(outcome="failed")
+            raise
+        finally:
+            self._processing -= 1
+
+        self.frames_total.inc(outcome=outcome)
+        self.stage_seconds.observe(time.perf_counter() - start, stage="total")
+
+    async def _on_message(self, message: aio_pika.IncomingMessage, received_at: float = None) -> str:
+        """Parses, decodes, detects, blurs, saves and publishes a frame
+
+        Args:
+            message (aio_pika.IncomingMessage): Message with a raw frame
+            received_at (float, optional): Epoch time the message was delivered, stamped on its trace
+
+        Returns:
+            str: The outcome: `invalid`, `duplicate` or `analysed`
+        """
+        logger.info("Received message. Processing...")
+        with self.stage_seconds.time(stage="parse"):
+            parsed = self._parse_message(message)
+        if parsed is None:
+            return "invalid"
+        raw_frame, frame_context = parsed
+        frame_context.trace = trace_util.TraceContext.from_headers(message.headers, self.trace_sample_rate)
+        frame_context.trace.stamp("worker_received_at", received_at)
+
+        # Decode the image once, every stage below works on the same pixel buffer.
+        # With a process pool the image is decoded and processed in the pool processes instead
+        if self.executor_type == "thread":
+            with self.stage_seconds.time(stage="decode"):
+                frame_context.image = await self.run_blocking(image_util.decode_image, frame_context.raw_bytes)
+
+        img_hash = None
+        if self.duplicate_filter is not None:
+            with self.stage_seconds.time(stage="dedup"):
+                if self.executor_type == "process":
+                    frame_context.shape, img_hash = await self.run_blocking(_process_prepare, frame_context.raw_bytes)
+                else:
+                    img_hash = await self.run_blocking(dedup_util.dhash, frame_context.image)
+                previous = self.duplicate_filter.match(raw_frame, img_hash)
+            if previous is not None:
+                await self.on_duplicate(raw_frame, previous, frame_context.trace)
+                return "duplicate"
+
+        with self.stage_seconds.time(stage="detect"):
+            analyzed_frame: AnalyzedFrame = await self.detect_cached(raw_frame, frame_context)
+        self._observe_detector_stages(analyzed_frame.analyser_meta)
+
+        # Batched detections are rendered in the process that detected them, cached ones in a separate submission
+        rendered = frame_context.blurred_bytes is not None or not analyzed_frame.detected_objects
+        if self.executor_type == "process" and not (rendered and frame_context.has_shape):
+            with self.stage_seconds.time(stage="blur"):
+                await self._analyse_in_process(raw_frame, frame_context, analyzed_frame)
 
-        raw_frame = RawFrame(**frame_data)
-        analyzed_frame: AnalyzedFrame = self.yolov5_detector.detect(raw_frame=raw_frame)
-        image_size = image_util.get_image_size(analyzed_frame.img)
         analyzed_frame.img_meta = {
-            'width': image_size[0],
-            'height': image_size[1],
+            'width': frame_context.width,
+            'height': frame_context.height,
             'file_hostname': os.uname()[1]
         }
 
         if analyzed_frame.detected_objects:
-            analyzed_frame.blurred_image = image_util.blur_privacy_objects(
-                analyzed_frame.img,
-                analyzed_frame.detected_objects,
-            )
+            self.detected_objects_total.inc(len(analyzed_frame.detected_objects))
+            if frame_context.blurred_bytes is None:
+                with self.stage_seconds.time(stage="blur"):
+                    frame_context.blurred = await self.run_blocking(
+                        image_util.blur_privacy_objects_on_array,
+                        frame_context.image,
+                        analyzed_frame.detected_objects,
+                    )
+                # Encoded once, also reused when the blurred image is written to disk
+                with self.stage_seconds.time(stage="encode"):
+                    frame_context.blurred_bytes = await self.run_blocking(
+                        image_util.encode_image, frame_context.blurred
+                    )
+            blurred_bytes = frame_context.blurred_bytes
+            if not self.slim_results:
+                analyzed_frame.blurred_image = base64.b64encode(blurred_bytes).decode("utf-8")
 
             logger.info(f"Detected objects: {analyzed_frame.object_count}")
             #logger.info(f"Performing classification")
@@ -290,13 +656,90 @@ class RabbitMQWorker(AbstractRabbitMQWorker):
             except Exception as e:
                 logger.error(e)
             '''
-        await self.push_result(analyzed_frame)
 
+        # Slim results refer to the stored image instead of carrying it, so only then the image is saved
+        # (or queued, with `write_queue_size`) before publishing. Full results are published first
+        if self.slim_results:
+            object_key = await self.save_frame(analyzed_frame, frame_context)
+            if object_key:
+                analyzed_frame.img_meta['object_key'] = object_key
+                analyzed_frame.img_meta['file_location'] = self.storage.location(object_key)
+
+        if self.duplicate_filter is not None:
+            self.duplicate_filter.update(analyzed_frame, img_hash)
+
+        await self.push_result(analyzed_frame, frame_context.trace)
+
+        if not self.slim_results:
+            await self.save_frame(analyzed_frame, frame_context)
+
+        if isinstance(analyzed_frame.taken_at, datetime):
+            age = datetime.now(analyzed_frame.taken_at.tzinfo) - analyzed_frame.taken_at
+            self.frame_age_seconds.observe(age.total_seconds())
+        return "analysed"
+
+    def _observe_detector_stages(self, analyser_meta: typing.Dict) -> None:
+        """Records the `preprocess`, `inference` and `nms` stages of a detection, per frame of its batch.
+        Cached detections took no time"""
+        if not isinstance(analyser_meta, dict) or analyser_meta.get('ml_cache_hit'):
+            return
+        batch_size = analyser_meta.get('ml_batch_size') or 1
+        for stage, seconds in (analyser_meta.get('ml_stage_seconds') or {}).items():
+            self.stage_seconds.observe(seconds / batch_size, stage=stage)
+
+    async def on_duplicate(
+            self, raw_frame: BaseFrame, previous: typing.Dict, trace: trace_util.TraceContext = None
+    ) -> None:
+        """Drops a near-duplicate frame, or publishes it linked to the previous frame of its stream,
+        without detecting or saving it"""
+        if self.dedup == "drop":
+            logger.info(f"Dropping near-duplicate frame of stream {raw_frame.stream_id}, {self.duplicate_filter.stats()}")
+            return
+
+        logger.info(f"Linking near-duplicate frame of stream {raw_frame.stream_id}, {self.duplicate_filter.stats()}")
+        await self.push_result(self.duplicate_filter.link(raw_frame, previous), trace)
+
+    async def detect_cached(self, raw_frame: BaseFrame, frame_context: FrameContext) -> AnalyzedFrame:
+        """Detects objects on a frame, unless the same image is in the detection cache"""
+        if self.detection_cache is None:
+            return await self.detect(raw_frame, frame_context)
+
+        key = self.detection_cache.key(frame_context.raw_bytes)
+        cached = self.detection_cache.get(key)
+        if cached is not None:
+            logger.info(f"Reusing detection of identical image, cache: {self.detection_cache.stats()}")
+            analyzed_frame = AnalyzedFrame(**{**raw_frame.dict(), **cached})
+            analyzed_frame.analyser_meta['ml_cache_hit'] = True
+            return analyzed_frame
+
+        analyzed_frame = await self.detect(raw_frame, frame_context)
+        self.detection_cache.put(key, analyzed_frame)
+        analyzed_frame.analyser_meta['ml_cache_hit'] = False
+        return analyzed_frame
+
+    def _on_write_failed(self, key: str, error: Exception) -> None:
+        """The result of the frame may already be published, slim results with `key`,
+        which now points to an image that doesn't exist"""
+        self.write_failures_total.inc()
+        logger.error(f"Image of published frame couldn't be stored, {self.storage.location(key)}: {error}")
+
+    async def store(self, **kwargs) -> str:
+        """Stores images with `persist_util.write_to_sink`, in the background when there's a `background_writer`"""
+        with self.stage_seconds.time(stage="write"):
+            if self.background_writer is not None:
+                return await self.background_writer.write(**kwargs)
+            return await self.run_blocking(persist_util.write_to_sink, self.storage, **kwargs)
+
+    async def save_frame(
+            self, analyzed_frame: AnalyzedFrame, frame_context: FrameContext
+    ) -> typing.Optional[str]:
+        """Saves the image of a frame according to the `savewith`, `savewithout`, `includepriv`,
+        `blur` and `bbox` rules. Returns the key of the stored image, if stored"""
         ###################
         # Save image logic:
         # When no objects detected and `savewithout` is off
         if bool(analyzed_frame.detected_objects) is False and self.savewithout is False:
-            return
+            return None
         
         # When no objects detected but `savewithout` is on 
         if bool(analyzed_frame.detected_objects) is False and self.savewithout is True:
@@ -311,43 +754,45 @@ class RabbitMQWorker(AbstractRabbitMQWorker):
             #img2 = Image.open(BytesIO(base64.b64decode(output_image2)))
             #img2.show()
 
-            persist_util.save_to_disk(
-                org_img=analyzed_frame.img,
+            return await self.store(
+                org_img=frame_context.raw_bytes,
                 file_name=filename,
-                o_location=f"{self.output_location}/no_objects",
+                sub_location="no_objects",
             )
-            return
 
         # When objects are detected but `savewith` is off
         if bool(analyzed_frame.detected_objects) is True and self.savewith is False:
             logger.info("Not saving frame since `savewith` is switched off")
-            return
+            return None
 
         # When objects are detected but `savewith` is on
         if bool(analyzed_frame.detected_objects) is True and self.savewith is True:
             
             # When there are only privacy objects and `includepriv` is off
-            if privacy_util.not_only_privacy_objects(analyzed_frame.object_count) is False and self.includepriv is False:
+            # (copy of the counts, since `not_only_privacy_objects` removes the total)
+            if privacy_util.not_only_privacy_objects(dict(analyzed_frame.object_count)) is False and self.includepriv is False:
                 logger.info("Not storing frame, since only privacy objects are detected")
-                return
+                return None
             
-            org_img = analyzed_frame.img
-            edit_img = analyzed_frame.img
+            org_img: bytes = frame_context.raw_bytes
+            edit_img: bytes = None
 
             # When blurring, override original image
             if self.blur:
-                org_img: str = image_util.blur_privacy_objects(
-                    org_img,
-                    analyzed_frame.detected_objects,
-                )
-
-            # When bboxing, draw on separate image
-            if self.bbox:
-                edit_img: str = image_util.draw_bounding_boxes(
-                    org_img,
-                    analyzed_frame.detected_objects,
-                    include_privacy_objects=True,
-                )
+                org_img = frame_context.blurred_bytes
+
+            # When bboxing, draw on separate image, unless it was drawn in a pool process
+            if self.bbox and frame_context.bbox_bytes is not None:
+                edit_img = frame_context.bbox_bytes
+            elif self.bbox:
+                with self.stage_seconds.time(stage="bbox"):
+                    bbox_img = await self.run_blocking(
+                        image_util.draw_bounding_boxes_on_array,
+                        frame_context.blurred if self.blur else frame_context.image,
+                        analyzed_frame.detected_objects,
+                        include_privacy_objects=True,
+                    )
+                    edit_img = await self.run_blocking(image_util.encode_image, bbox_img)
 
             filename: str = persist_util.create_file_name(
                 analyzed_frame.lat_lng,
@@ -356,21 +801,166 @@ class RabbitMQWorker(AbstractRabbitMQWorker):
 
             frame_date = analyzed_frame.taken_at.strftime("%Y-%m-%d")
             sub_location = f"{frame_date}/{analyzed_frame.stream_id}"
-            persist_util.save_to_disk(
+            return await self.store(
                 org_img=org_img,
                 edit_img=edit_img,
                 file_name=filename,
                 bbox=self.bbox,
                 blur=self.blur,
-                o_location=self.output_location,
                 sub_location=sub_location,
             )
 
-    async def push_result(self, frame: AnalyzedFrame) -> None:
-        #frame.img = None
-        result_body = frame.json().encode("utf8")
-        result_message = aio_pika.Message(result_body)
-        await self.send_message(result_message)
+    def _parse_message(
+            self, message: aio_pika.IncomingMessage
+    ) -> typing.Optional[typing.Tuple[BaseFrame, FrameContext]]:
+        """Reads the frame and its (still encoded) image from a message,
+        based on its content type either from JSON or from a binary body plus header"""
+        if message.content_type in BINARY_CONTENT_TYPES:
+            try:
+                raw_frame = RawFrameMeta.parse_raw(message.headers[FRAME_META_HEADER])
+            except KeyError:
+                logger.error(f"Binary message without `{FRAME_META_HEADER}` header")
+                return None
+            except ValidationError as e:
+                logger.error(f"Invalid `{FRAME_META_HEADER}` header: {e}")
+                return None
+            return raw_frame, FrameContext(raw_bytes=message.body)
+
+        try:
+            frame_data = json.loads(message.body.decode("utf-8"))
+        except JSONDecodeError as e:
+            logger.error(f"Message not JSON decodable: {message.body}")
+            return None
+
+        raw_frame = RawFrame(**frame_data)
+        return raw_frame, FrameContext.from_base64(raw_frame.img)
+
+    async def detect(self, raw_frame: RawFrame, frame_context: FrameContext = None) -> AnalyzedFrame:
+        """Detects objects on a single frame, or adds it to the current batch
+        and waits for the batch to be processed when batching is switched on"""
+        if self.batch_size <= 1:
+            if self.executor_type == "process":
+                return await self._analyse_in_process(raw_frame, frame_context)
+            return await self.run_blocking(
+                self.yolov5_detector.detect, raw_frame=raw_frame, frame_context=frame_context
+            )
+
+        future = asyncio.get_running_loop().create_future()
+        self._batch.append((raw_frame, frame_context, future))
+
+        if len(self._batch) >= self.batch_size:
+            self._flush_batch()
+        elif self._batch_timer is None:
+            self._batch_timer = asyncio.get_running_loop().call_later(
+                self.batch_timeout / 1000, self._flush_batch
+            )
+
+        return await future
+
+    @property
+    def render_options(self) -> typing.Dict:
+        """Options of `_render`, to blur and draw bounding boxes like `save_frame` in a pool process"""
+        return {
+            'draw_bbox': self.savewith and self.bbox,
+            'include_privacy': self.includepriv,
+            'bbox_on_blurred': self.blur,
+        }
+
+    async def _analyse_in_process(
+            self, raw_frame: RawFrame, frame_context: FrameContext, detected: AnalyzedFrame = None
+    ) -> AnalyzedFrame:
+        """Detects (unless `detected` is given), blurs and draws a frame in one submission to the process pool,
+        so its pixel buffer doesn't cross the process boundary for every stage"""
+        analyzed_frame, frame_context.shape, blurred_bytes, frame_context.bbox_bytes = await self.run_blocking(
+            _process_analyse, raw_frame, frame_context, self.render_options, detected
+        )
+        frame_context.blurred_bytes = blurred_bytes
+        return analyzed_frame
+
+    def _flush_batch(self) -> None:
+        """Takes all waiting frames and schedules detection on them as one batch"""
+        if self._batch_timer is not None:
+            self._batch_timer.cancel()
+            self._batch_timer = None
+
+        batch, self._batch = self._batch, []
+        if batch:
+            task = asyncio.ensure_future(self._detect_batch(batch))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+
+    async def _detect_batch(
+            self, batch: typing.List[typing.Tuple[RawFrame, FrameContext, asyncio.Future]]
+    ) -> None:
+        """Runs detection on a batch of frames and hands every result back to its own message"""
+        logger.info(f"Detecting objects on batch of {len(batch)} frames")
+        raw_frames = [raw_frame for raw_frame, _, _ in batch]
+        frame_contexts = [frame_context for _, frame_context, _ in batch]
+        try:
+            if self.executor_type == "process":
+                results = []
+                rendered = await self.run_blocking(
+                    _process_detect_batch, raw_frames, frame_contexts, self.render_options
+                )
+                for frame_context, (result, shape, blurred_bytes, bbox_bytes) in zip(frame_contexts, rendered):
+                    frame_context.shape = shape
+                    frame_context.blurred_bytes = blurred_bytes
+                    frame_context.bbox_bytes = bbox_bytes
+                    results.append(result)
+            else:
+                results = await self.run_blocking(self.yolov5_detector.detect_batch, raw_frames, frame_contexts)
+        except Exception as e:
+            logger.error(e)
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+
+        for (_, _, future), result in zip(batch, results):
+            future.set_result(result)
+
+    async def push_result(self, frame: AnalyzedFrame, trace: trace_util.TraceContext = None) -> None:
+        """Publishes the result of a frame, with its trace in `analyser_meta` and the `trace` header"""
+        headers = None
+        if trace is not None:
+            trace.stamp("worker_published_at")
+            # Copied, the meta of linked duplicates is shared with the previous frame
+            frame.analyser_meta = {**frame.analyser_meta, 'trace': trace.to_dict()}
+            headers = {trace_util.TRACE_HEADER: trace.to_header()}
+
+        if self.slim_results:
+            # Only detections, counts and meta, the images are not stored by the consumer
+            result_body = frame.json(exclude={"img", "blurred_image"}).encode("utf8")
+        else:
+            result_body = frame.json().encode("utf8")
+        result_message = aio_pika.Message(result_body, headers=headers)
+        with self.stage_seconds.time(stage="publish"):
+            await self.send_message(result_message)
+
+        if trace is not None and trace.sampled and self.span_exporter is not None:
+            self.export_spans(frame, trace)
+
+    def export_spans(self, frame: AnalyzedFrame, trace: trace_util.TraceContext) -> None:
+        """Exports the spans of a frame: waiting in the queue, analysing it and its detection"""
+        meta = frame.analyser_meta
+        spans = [
+            trace.span("raw_frame_queue", "api_queued_at", "worker_received_at", frame.stream_id),
+            trace.span(
+                "analyse", "worker_received_at", "worker_published_at", frame.stream_id,
+                object_count=frame.object_count.get('total', 0), duplicate='duplicate_of' in meta,
+            ),
+        ]
+        detected = not meta.get('ml_cache_hit') and 'duplicate_of' not in meta
+        if detected and isinstance(meta.get('ml_start_at'), datetime):
+            spans.append(trace_util.create_span(
+                trace.trace_id, "detect", meta['ml_start_at'].timestamp(), meta['ml_done_at'].timestamp(),
+                frame.stream_id,
+                batch_size=meta.get('ml_batch_size'), stage_seconds=meta.get('ml_stage_seconds'),
+                backend=meta.get('ml_backend'),
+            ))
+
+        for span in spans:
+            if span is not None:
+                self.span_exporter.export(span)
 
 
 if __name__ == "__main__":
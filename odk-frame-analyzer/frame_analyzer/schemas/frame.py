@@ -25,6 +25,16 @@ class RawFrame(BaseFrame):
     stream_id: str
 
 
+class RawFrameMeta(BaseFrame):
+    """
+    Meta data of a raw frame that is received in binary form,
+    where the image itself is the (JPEG) message body instead of a base64 `img` field.
+    """
+    taken_at: datetime
+    lat_lng: Dict
+    stream_id: str
+
+
 class AnalyzedFrame(BaseFrame):
     taken_at: datetime
     lat_lng: Dict
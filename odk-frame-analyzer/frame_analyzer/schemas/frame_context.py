@@ -0,0 +1,115 @@
+import base64
+from typing import Optional, Tuple
+
+import numpy as np
+
+from frame_analyzer.utils import image_util, trace_util
+
+
+class FrameContext:
+    """
+    Carries the image of a single frame through the analyzer pipeline.
+
+    The JPEG bytes are decoded into a BGR pixel buffer at most once, and every stage
+    (detection, blurring, drawing bounding boxes) works on that same buffer.
+    Images are only encoded again at the point where they are written or published.
+
+    Usage:
+
+    ```
+    context = FrameContext.from_base64(raw_frame.img)
+    analyzed_frame = detector.detect(raw_frame=raw_frame, frame_context=context)
+    context.blurred = image_util.blur_privacy_objects_on_array(
+        context.image, analyzed_frame.detected_objects
+    )
+    persist_util.write_to_disk(context.blurred_bytes, file_name)
+    ```
+    """
+
+    def __init__(self, raw_bytes: bytes = None, image: np.ndarray = None):
+        if raw_bytes is None and image is None:
+            raise ValueError("FrameContext needs either raw bytes or an image")
+
+        self._raw_bytes = raw_bytes
+        self._image = image
+
+        # Image with blacked out privacy objects, see `image_util.blur_privacy_objects_on_array`
+        self._blurred: Optional[np.ndarray] = None
+        self._blurred_bytes: Optional[bytes] = None
+
+        # Set when the image is processed in another process, which only sends back
+        # its shape and the encoded results instead of the pixel buffers
+        self._shape: Optional[Tuple[int, ...]] = None
+        self.bbox_bytes: Optional[bytes] = None
+
+        # Trace of the frame from API ingest onwards, see `trace_util`
+        self.trace: Optional[trace_util.TraceContext] = None
+
+    @classmethod
+    def from_base64(cls, base64_img: str) -> "FrameContext":
+        # Remove `data:image/jpeg;base64,` from string
+        if base64_img.find(',') > -1:
+            base64_img = base64_img.split(',')[1]
+        return cls(raw_bytes=base64.b64decode(base64_img))
+
+    @property
+    def raw_bytes(self) -> bytes:
+        """The encoded (JPEG) image, encoded from the pixel buffer if not received as bytes"""
+        if self._raw_bytes is None:
+            self._raw_bytes = image_util.encode_image(self._image)
+        return self._raw_bytes
+
+    @property
+    def image(self) -> np.ndarray:
+        """The decoded BGR pixel buffer, decoded on first access"""
+        if self._image is None:
+            self._image = image_util.decode_image(self._raw_bytes)
+        return self._image
+
+    @image.setter
+    def image(self, image: np.ndarray) -> None:
+        self._image = image
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        if self._image is None and self._shape is not None:
+            return self._shape
+        return self.image.shape
+
+    @shape.setter
+    def shape(self, shape: Tuple[int, ...]) -> None:
+        self._shape = tuple(shape)
+
+    @property
+    def has_shape(self) -> bool:
+        """Whether the shape is known without decoding the image"""
+        return self._image is not None or self._shape is not None
+
+    @property
+    def width(self) -> int:
+        return self.shape[1]
+
+    @property
+    def height(self) -> int:
+        return self.shape[0]
+
+    @property
+    def blurred(self) -> Optional[np.ndarray]:
+        return self._blurred
+
+    @blurred.setter
+    def blurred(self, image: np.ndarray) -> None:
+        self._blurred = image
+        self._blurred_bytes = None
+
+    @property
+    def blurred_bytes(self) -> Optional[bytes]:
+        """The blurred image encoded as JPEG, encoded once on first access"""
+        if self._blurred_bytes is None and self._blurred is not None:
+            self._blurred_bytes = image_util.encode_image(self._blurred)
+        return self._blurred_bytes
+
+    @blurred_bytes.setter
+    def blurred_bytes(self, img_bytes: bytes) -> None:
+        """Sets the blurred image when it's already been encoded elsewhere, e.g. in an executor"""
+        self._blurred_bytes = img_bytes
@@ -0,0 +1,143 @@
+import copy
+import math
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Optional
+
+import cv2
+import numpy as np
+
+from frame_analyzer.schemas.frame import AnalyzedFrame, BaseFrame
+
+EARTH_RADIUS_M = 6371000
+
+
+def dhash(img: np.ndarray, hash_size: int = 8) -> int:
+    """Difference hash of a BGR image: whether each pixel of the downscaled grayscale image
+    is brighter than its right neighbour. Similar images have hashes with few differing bits.
+
+    Args:
+        img (np.ndarray): BGR image
+        hash_size (int, optional): The hash has hash_size * hash_size bits. Defaults to 8.
+
+    Returns:
+        int: The hash
+    """
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming_distance(hash1: int, hash2: int) -> int:
+    return bin(hash1 ^ hash2).count("1")
+
+
+def distance_m(lat_lng1: Dict, lat_lng2: Dict) -> Optional[float]:
+    """Haversine distance in meters between two `{'lat': ..., 'lng': ...}` locations,
+    or None when either location is missing or invalid"""
+    try:
+        lat1, lng1 = math.radians(float(lat_lng1['lat'])), math.radians(float(lat_lng1['lng']))
+        lat2, lng2 = math.radians(float(lat_lng2['lat'])), math.radians(float(lat_lng2['lng']))
+    except (KeyError, TypeError, ValueError):
+        return None
+
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+class NearDuplicateFilter:
+    """
+    Recognizes frames that are nearly identical to the last analysed frame of the same stream,
+    e.g. of a vehicle waiting at a traffic light. A frame is a near-duplicate when:
+    - its dHash differs at most `max_hamming` bits from the last analysed frame,
+    - it was taken at most `max_distance` meters from it,
+    - and at most `max_interval` seconds after it.
+
+    Frames are compared to the last analysed frame, not to the last near-duplicate,
+    so a slowly changing scene is analysed again once it has changed enough.
+
+    Usage:
+
+    ```
+    dedup = NearDuplicateFilter(max_hamming=5, max_distance=5.0, max_interval=60.0)
+
+    img_hash = dedup_util.dhash(img)
+    previous = dedup.match(raw_frame, img_hash)
+    if previous is None:
+        analyzed_frame = detector.detect(raw_frame=raw_frame)
+        dedup.update(analyzed_frame, img_hash)
+    else:
+        analyzed_frame = dedup.link(raw_frame, previous)
+    ```
+    """
+
+    def __init__(
+            self, max_hamming: int = 5, max_distance: float = 5.0, max_interval: float = 60.0,
+            max_streams: int = 10000,
+    ):
+        self.max_hamming = max_hamming
+        self.max_distance = max_distance
+        self.max_interval = max_interval
+        self.max_streams = max_streams
+
+        # Stream id -> last analysed frame of the stream (without images) and its hash
+        self._last: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.checked = 0
+        self.skipped = 0
+
+    def match(self, raw_frame: BaseFrame, img_hash: int) -> Optional[Dict]:
+        """Returns the last analysed frame of the stream when `raw_frame` is a near-duplicate of it"""
+        with self._lock:
+            self.checked += 1
+            last = self._last.get(raw_frame.stream_id)
+
+        if last is None:
+            return None
+        if hamming_distance(img_hash, last['hash']) > self.max_hamming:
+            return None
+
+        distance = distance_m(raw_frame.lat_lng, last['frame'].lat_lng)
+        if distance is None or distance > self.max_distance:
+            return None
+
+        interval = (raw_frame.taken_at - last['frame'].taken_at).total_seconds()
+        if not 0 <= interval <= self.max_interval:
+            return None
+
+        with self._lock:
+            self.skipped += 1
+        return last
+
+    def update(self, analyzed_frame: AnalyzedFrame, img_hash: int) -> None:
+        """Remembers an analysed frame as the last one of its stream"""
+        frame = analyzed_frame.copy(exclude={'img', 'blurred_image'}, deep=True)
+        with self._lock:
+            self._last[analyzed_frame.stream_id] = {'frame': frame, 'hash': img_hash}
+            self._last.move_to_end(analyzed_frame.stream_id)
+            while len(self._last) > self.max_streams:
+                self._last.popitem(last=False)
+
+    def link(self, raw_frame: BaseFrame, previous: Dict) -> AnalyzedFrame:
+        """Creates the result of a near-duplicate from the detections of the previous frame,
+        referring to the previous frame and its image instead of storing a new one"""
+        previous_frame: AnalyzedFrame = previous['frame']
+        analyzed_frame = AnalyzedFrame(
+            **raw_frame.dict(exclude={'img'}),
+            detected_objects=copy.deepcopy(previous_frame.detected_objects),
+            object_count=dict(previous_frame.object_count),
+            analyser_meta=dict(previous_frame.analyser_meta),
+            img_meta=dict(previous_frame.img_meta),
+        )
+        analyzed_frame.analyser_meta['duplicate_of'] = {
+            'taken_at': datetime.isoformat(previous_frame.taken_at),
+            'file_location': previous_frame.img_meta.get('file_location'),
+        }
+        return analyzed_frame
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'streams': len(self._last), 'checked': self.checked, 'skipped': self.skipped}
@@ -4,9 +4,46 @@ from typing import Tuple, List, Dict
 
 from imageio import imread
 import cv2
+import numpy as np
 
 from frame_analyzer.detection.yolov5_utils import plot_one_box
 
+# Extensions of the images read from folders, e.g. by the CLI and the load generator
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+def decode_image(img_bytes: bytes) -> np.ndarray:
+    """Decodes encoded (e.g. JPEG) image bytes into a BGR image array
+
+    Args:
+        img_bytes (bytes): Encoded image, e.g. the decoded content of a base64 image
+
+    Returns:
+        np.ndarray: BGR image array of shape (height, width, 3)
+    """
+    buffer = np.frombuffer(img_bytes, dtype=np.uint8)
+    img = cv2.imdecode(buffer, cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+    if img is None:
+        raise ValueError("Could not decode image")
+    return img
+
+
+def encode_image(img: np.ndarray, ext: str = ".jpg") -> bytes:
+    """Encodes a BGR image array, by default as JPEG
+
+    Args:
+        img (np.ndarray): BGR image array
+        ext (str, optional): File extension that determines the format. Defaults to ".jpg".
+
+    Returns:
+        bytes: The encoded image
+    """
+    retval, buffer = cv2.imencode(ext, img)
+    if not retval:
+        raise ValueError("Could not encode image")
+    return buffer.tobytes()
+
+
 def get_image_size(base64_img: str) -> Tuple[str, str]:
     """Gets width and height of base64 image
 
@@ -34,21 +71,36 @@ def blur_privacy_objects(base64_img: str, detected_objects: List[Dict]) -> str:
     Returns:
         str: An base64 image with, if present, blacked out privacy objects
     """
-    img = imread(io.BytesIO(base64.b64decode(base64_img)))
-    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    img = decode_image(base64.b64decode(base64_img))
+    img = blur_privacy_objects_on_array(img, detected_objects)
+
+    b64_result = base64.b64encode(encode_image(img))
+
+    return b64_result
+
+
+def blur_privacy_objects_on_array(img: np.ndarray, detected_objects: List[Dict]) -> np.ndarray:
+    """Same as `blur_privacy_objects`, but works on a decoded BGR image array.
+    The given array is left untouched, the result is a blurred copy.
+
+    Args:
+        img (np.ndarray): BGR image array corresponding to the coordinates of the detected objects
+        detected_objects (List[Dict]): Detected objects corresponding to the image
+
+    Returns:
+        np.ndarray: A copy of the image with, if present, blacked out privacy objects
+    """
+    img = img.copy()
 
     blur_color = (0, 0, 0)
     for i, obj in enumerate(detected_objects):
         if "privacy" in obj["detected_object_type"]:
             cv2.rectangle(
-                img, obj["bbox"]["coordinate1"], obj["bbox"]["coordinate2"],
+                img, tuple(obj["bbox"]["coordinate1"]), tuple(obj["bbox"]["coordinate2"]),
                 blur_color, -1
             )
 
-    retval, buffer = cv2.imencode(".jpg", img)
-    b64_result = base64.b64encode(buffer)
-
-    return b64_result
+    return img
 
 
 def draw_bounding_boxes(base64_img: str, detected_objects: List[Dict], include_privacy_objects = True) -> str:
@@ -64,8 +116,28 @@ def draw_bounding_boxes(base64_img: str, detected_objects: List[Dict], include_p
     Returns:
         str: An base64 image with the outline bounding boxes for every detected object 
     """
-    img = imread(io.BytesIO(base64.b64decode(base64_img)))
-    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    img = decode_image(base64.b64decode(base64_img))
+    img = draw_bounding_boxes_on_array(img, detected_objects, include_privacy_objects)
+
+    b64_result = base64.b64encode(encode_image(img))
+
+    return b64_result
+
+
+def draw_bounding_boxes_on_array(img: np.ndarray, detected_objects: List[Dict], include_privacy_objects = True) -> np.ndarray:
+    """Same as `draw_bounding_boxes`, but works on a decoded BGR image array.
+    The given array is left untouched, the boxes are drawn on a copy.
+
+    Args:
+        img (np.ndarray): BGR image array corresponding to the coordinates of the detected objects
+        detected_objects (List[Dict]): Detected objects corresponding to the image
+        include_privacy_objects (bool, optional): If True will also draw boxes for privacy objects.
+        Defaults to True.
+
+    Returns:
+        np.ndarray: A copy of the image with the outline bounding boxes for every detected object
+    """
+    img = img.copy()
 
     if include_privacy_objects == False:
         detected_objects = [obj for obj in detected_objects if "privacy" not in obj["detected_object_type"]]
@@ -80,7 +152,4 @@ def draw_bounding_boxes(base64_img: str, detected_objects: List[Dict], include_p
         label = f"{obj['detected_object_type']} {conf/100}"
         plot_one_box(xyxy, img, label=label, line_thickness=1)
 
-    retval, buffer = cv2.imencode(".jpg", img)
-    b64_result = base64.b64encode(buffer)
-
-    return b64_result
+    return img
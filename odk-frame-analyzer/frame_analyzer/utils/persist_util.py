@@ -1,8 +1,16 @@
-from typing import Dict
+from typing import Callable, Dict, List, Optional
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import base64
+import functools
 import os
 
+from loguru import logger
+
+from frame_analyzer.utils import storage_util
+
+
 def create_file_name(lat_lng: Dict, taken_at: datetime):
     """Creates time and location based file name for storing incoming frames
     E.g. a frame taken at 01-02-2021 at 13:37:77.1234 at location 52.3679876, 4.8973929,
@@ -39,26 +47,179 @@ def save_to_disk(
         blur (bool, optional): For adding '_blur' to filename. Defaults to False.
         bbox (bool, optional): For adding '_bbox' to filename. Defaults to False.
         o_location (str, optional): Folder where image will be written to. Defaults to "output".
+
+    Returns:
+        str: Location of the written (blurred) image
     """
-    def write_image(img, folder, name, type):
-        name_location = f"{folder}/{name}.{type}"
-        img = base64.b64decode(img)
-        with open(name_location, "wb") as file:
-            file.write(img)
-
-    # Build and create output location
-    output_folder = o_location
-    if sub_location:
-        output_folder = f"{output_folder}/{sub_location}"
-        #print(output_folder)
-    if not os.path.exists(output_folder):
-        os.makedirs(output_folder)
+    return write_to_disk(
+        org_img=base64.b64decode(org_img),
+        file_name=file_name,
+        edit_img=base64.b64decode(edit_img) if bbox else None,
+        blur=blur, bbox=bbox,
+        o_location=o_location,
+        sub_location=sub_location,
+        file_type=file_type,
+    )
+
+
+def write_to_disk(
+        org_img: bytes, file_name: str,
+        edit_img: bytes = None,
+        blur=False, bbox=False,
+        o_location: str = "output",
+        sub_location: str = None,
+        file_type = "jpg"
+    ):
+    """Same as `save_to_disk`, but takes already encoded (e.g. JPEG) image bytes
+    instead of base64 images, so no extra decoding is needed.
+
+    Args:
+        org_img (bytes): The (blurred) image
+        edit_img (bytes, optional): The image with bounding boxes, written when `bbox` is True
+        blur (bool, optional): For adding '_blur' to filename. Defaults to False.
+        bbox (bool, optional): For adding '_bbox' to filename. Defaults to False.
+        o_location (str, optional): Folder where image will be written to. Defaults to "output".
+
+    Returns:
+        str: Location of the written (blurred) image
+    """
+    sink = storage_util.LocalSink(o_location)
+    key = write_to_sink(
+        sink, org_img=org_img, file_name=file_name, edit_img=edit_img,
+        blur=blur, bbox=bbox, sub_location=sub_location, file_type=file_type,
+    )
+    return sink.location(key)
+
 
-    # Write image(s)
+def frame_key(
+        file_name: str,
+        blur=False, bbox=False,
+        sub_location: str = None,
+        file_type = "jpg"
+    ) -> str:
+    """Key of the (blurred, when `bbox` the bounding boxes) image of a frame"""
     if blur:
         file_name = f"{file_name}_blur"
-    write_image(org_img, output_folder, file_name, file_type)
-
     if bbox:
         file_name = f"{file_name}_bbox"
-        write_image(edit_img, output_folder, file_name, file_type)
+    if sub_location:
+        return f"{sub_location}/{file_name}.{file_type}"
+    return f"{file_name}.{file_type}"
+
+
+def write_to_sink(
+        sink: storage_util.StorageSink,
+        org_img: bytes, file_name: str,
+        edit_img: bytes = None,
+        blur=False, bbox=False,
+        sub_location: str = None,
+        file_type = "jpg"
+    ) -> str:
+    """Same as `write_to_disk`, but stores the image(s) in a storage sink, e.g. an S3 bucket.
+
+    Returns:
+        str: Key of the stored (blurred) image
+    """
+    org_key = sink.put(frame_key(file_name, blur=blur, sub_location=sub_location, file_type=file_type), org_img)
+    if bbox:
+        sink.put(frame_key(file_name, blur=blur, bbox=True, sub_location=sub_location, file_type=file_type), edit_img)
+    return org_key
+
+
+class BackgroundWriter:
+    """
+    Stores images in the background, so writes and uploads never hold up processing frames.
+
+    Writes are queued in a bounded queue and done by a dedicated thread pool.
+    When the queue is full, `write` waits for room, so a slow disk or bucket slows down consumption
+    instead of the queue growing without bounds. Optionally written files are flushed
+    to disk (`os.sync`) once every `sync_every` writes, instead of relying on the OS alone.
+
+    `write` returns the key before the image is stored, so a result can already refer to it.
+    When the write fails afterwards, `on_failure` is called with that key and the error.
+
+    Usage:
+
+    ```
+    writer = BackgroundWriter(storage_util.LocalSink("output"), max_queue_size=256, workers=2)
+    key = await writer.write(org_img=jpeg_bytes, file_name="frame")
+    ...
+    await writer.join()  # wait until everything is written
+    ```
+    """
+
+    def __init__(
+            self, sink: storage_util.StorageSink, max_queue_size: int = 256, workers: int = 2, sync_every: int = 0,
+            on_failure: Callable[[str, Exception], None] = None,
+    ):
+        self.sink = sink
+        self.on_failure = on_failure
+        self.max_queue_size = max_queue_size
+        self.workers = workers
+        self.sync_every = sync_every
+
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="background-writer")
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._unsynced = 0
+
+        self.written = 0
+        self.failed = 0
+
+    def _start(self) -> None:
+        # Created on first use, inside the running event loop
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._tasks = [asyncio.ensure_future(self._run()) for _ in range(self.workers)]
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            kwargs = await self._queue.get()
+            try:
+                await loop.run_in_executor(self.executor, functools.partial(write_to_sink, self.sink, **kwargs))
+                self.written += 1
+                self._unsynced += 1
+                if self.sync_every and self._unsynced >= self.sync_every:
+                    self._unsynced = 0
+                    await loop.run_in_executor(self.executor, os.sync)
+            except Exception as e:
+                self.failed += 1
+                if self.on_failure is not None:
+                    self.on_failure(self._key(kwargs), e)
+                else:
+                    logger.error(f"Could not store {self._key(kwargs)}: {e}")
+            finally:
+                self._queue.task_done()
+
+    @property
+    def queue_size(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def write(self, **kwargs) -> str:
+        """Queues a `write_to_sink` with the same arguments, waits only when the queue is full.
+
+        Returns:
+            str: Key the (blurred) image will be stored under
+        """
+        if self._queue is None:
+            self._start()
+        await self._queue.put(kwargs)
+        return self._key(kwargs)
+
+    @staticmethod
+    def _key(kwargs: Dict) -> str:
+        return frame_key(
+            kwargs['file_name'],
+            blur=kwargs.get('blur', False),
+            sub_location=kwargs.get('sub_location'),
+            file_type=kwargs.get('file_type', "jpg"),
+        )
+
+    async def join(self) -> None:
+        """Waits until all queued images are stored, and flushes them to disk when syncing"""
+        if self._queue is None:
+            return
+        await self._queue.join()
+        if self.sync_every and self._unsynced:
+            self._unsynced = 0
+            await asyncio.get_running_loop().run_in_executor(self.executor, os.sync)
@@ -0,0 +1,165 @@
+"""
+Storage sinks for the images of analysed frames. Images are stored by key, a relative path
+like `2021-01-31/1/2021-01-31_12:34:56.000000_52.367527_4.901257_blur.jpg`:
+
+- `LocalSink`: files under a local folder, e.g. `output/`
+- `S3Sink`: objects in an S3-compatible bucket (AWS S3, MinIO), so workers on different
+  nodes don't need a shared volume. Requires `boto3` (`poetry install -E s3`).
+
+To try the S3 sink locally, start the MinIO service of docker-compose, create a bucket `frames`
+in its console (http://localhost:9001) and run:
+
+```
+$ AWS_ACCESS_KEY_ID=odk AWS_SECRET_ACCESS_KEY=development \\
+    python start_worker.py --storage s3 --s3bucket frames --s3endpoint http://localhost:9000
+```
+"""
+import abc
+import io
+import os
+import threading
+from typing import Any, Dict, Optional, Set
+
+STORAGES = ("local", "s3")
+
+# Folders that have been created by a `LocalSink`, so it doesn't check for them on every write.
+# A folder that is removed while running (e.g. by a cleanup job) is forgotten on the first failed write
+_created_folders: Set[str] = set()
+
+
+class StorageSink(abc.ABC):
+    """Stores images by key"""
+
+    @abc.abstractmethod
+    def put(self, key: str, data: bytes, content_type: str = "image/jpeg") -> str:
+        """Stores `data` under `key`
+
+        Returns:
+            str: The key
+        """
+
+    @abc.abstractmethod
+    def location(self, key: str) -> str:
+        """Where the image with `key` is stored, e.g. a path or `s3://` URL"""
+
+
+class LocalSink(StorageSink):
+    def __init__(self, root: str = "output"):
+        self.root = root
+
+    def location(self, key: str) -> str:
+        return f"{self.root}/{key}"
+
+    def put(self, key: str, data: bytes, content_type: str = "image/jpeg") -> str:
+        path = self.location(key)
+        folder = os.path.dirname(path)
+        if folder not in _created_folders:
+            os.makedirs(folder, exist_ok=True)
+            _created_folders.add(folder)
+
+        try:
+            file = open(path, "wb")
+        except FileNotFoundError:
+            _created_folders.discard(folder)
+            os.makedirs(folder, exist_ok=True)
+            _created_folders.add(folder)
+            file = open(path, "wb")
+
+        with file:
+            file.write(data)
+        return key
+
+
+class S3Sink(StorageSink):
+    """
+    Stores images in an S3-compatible bucket.
+
+    A single client is shared by all threads, with a pool of `max_pool_connections` connections.
+    Images larger than `multipart_threshold` are uploaded in parts of `multipart_chunksize`,
+    with up to `max_concurrency` parts at the same time.
+    Credentials are taken from the environment (`AWS_ACCESS_KEY_ID`, `AWS_SECRET_ACCESS_KEY`).
+    """
+
+    def __init__(
+            self, bucket: str, endpoint_url: str = None, region: str = None, prefix: str = "",
+            max_pool_connections: int = 32,
+            multipart_threshold: int = 8 * 1024 * 1024, multipart_chunksize: int = 8 * 1024 * 1024,
+            max_concurrency: int = 4,
+    ):
+        self.bucket = bucket
+        self.endpoint_url = endpoint_url
+        self.region = region
+        self.prefix = prefix
+        self.max_pool_connections = max_pool_connections
+        self.multipart_threshold = multipart_threshold
+        self.multipart_chunksize = multipart_chunksize
+        self.max_concurrency = max_concurrency
+
+        self._client: Any = None
+        self._transfer_config: Any = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> Dict:
+        # Clients can't be pickled, every process of a process pool creates its own
+        state = self.__dict__.copy()
+        state.update(_client=None, _transfer_config=None, _lock=None)
+        return state
+
+    def __setstate__(self, state: Dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _create_client(self) -> Any:
+        import boto3
+        from botocore.config import Config
+
+        return boto3.session.Session().client(
+            "s3",
+            endpoint_url=self.endpoint_url,
+            region_name=self.region,
+            config=Config(max_pool_connections=self.max_pool_connections, retries={"mode": "standard"}),
+        )
+
+    def _create_transfer_config(self) -> Any:
+        from boto3.s3.transfer import TransferConfig
+
+        return TransferConfig(
+            multipart_threshold=self.multipart_threshold,
+            multipart_chunksize=self.multipart_chunksize,
+            max_concurrency=self.max_concurrency,
+        )
+
+    @property
+    def client(self) -> Any:
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._transfer_config = self._create_transfer_config()
+                    self._client = self._create_client()
+        return self._client
+
+    def location(self, key: str) -> str:
+        return f"s3://{self.bucket}/{self.prefix}{key}"
+
+    def put(self, key: str, data: bytes, content_type: str = "image/jpeg") -> str:
+        self.client.upload_fileobj(
+            io.BytesIO(data), self.bucket, f"{self.prefix}{key}",
+            ExtraArgs={"ContentType": content_type},
+            Config=self._transfer_config,
+        )
+        return key
+
+
+def create_sink(
+        storage: str = "local", output_location: str = "output",
+        s3_bucket: Optional[str] = None, s3_endpoint: Optional[str] = None, s3_prefix: str = "",
+        s3_pool_size: int = 32,
+) -> StorageSink:
+    """Creates the `local` sink writing to `output_location`, or the `s3` sink writing to `s3_bucket`"""
+    if storage == "local":
+        return LocalSink(output_location)
+    if storage == "s3":
+        if not s3_bucket:
+            raise ValueError("The s3 storage requires a bucket")
+        return S3Sink(s3_bucket, endpoint_url=s3_endpoint, prefix=s3_prefix, max_pool_connections=s3_pool_size)
+    raise ValueError(f"Unknown storage: {storage}, choose from {STORAGES}")
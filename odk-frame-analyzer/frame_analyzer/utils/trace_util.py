@@ -0,0 +1,157 @@
+"""
+Tracing of frames from API ingest to their row in the database.
+
+The API starts a trace for every received frame and sends it along in the `trace` header
+of the raw frame message. Every hop stamps the (epoch) time it handled the frame:
+
+- `api_received_at`, `api_queued_at`: by the API, when the frame was received and queued
+- `worker_received_at`, `worker_published_at`: by the worker, when the message was delivered
+  and when the result was published (in the `trace` header of the result message)
+- `consumer_received_at`, `db_write_started_at`: by the API, when the result was received
+  and when the batch with its row was written
+
+The trace ends up in `analyser_meta['trace']` of the stored frame, so latency breakdowns can be
+queried per stream. Traces are sampled at ingest: hops of sampled traces are also exported
+as spans, to a JSONL file or a local collector listening on UDP (`udp://localhost:9411`).
+Hops are stamped on different hosts, so spans between hosts include their clock difference.
+"""
+import abc
+import json
+import random
+import socket
+import threading
+import time
+import uuid
+from typing import Any, Dict, Mapping, Optional
+
+from loguru import logger
+
+TRACE_HEADER = "trace"
+
+
+class TraceContext:
+    """The trace of a single frame, carried from hop to hop"""
+
+    def __init__(self, trace_id: str = None, sampled: bool = False, hops: Dict[str, float] = None):
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.sampled = sampled
+        self.hops: Dict[str, float] = dict(hops or {})
+
+    @classmethod
+    def start(cls, sample_rate: float = 0.0) -> "TraceContext":
+        """Starts a new trace, sampled with a probability of `sample_rate`"""
+        return cls(sampled=random.random() < sample_rate)
+
+    @classmethod
+    def from_headers(cls, headers: Optional[Mapping], sample_rate: float = 0.0) -> "TraceContext":
+        """Continues the trace in the `trace` header of a message,
+        or starts a new one for messages without (valid) trace, e.g. from older producers"""
+        value = headers.get(TRACE_HEADER) if isinstance(headers, Mapping) else None
+        if value is None:
+            return cls.start(sample_rate)
+
+        try:
+            trace = json.loads(value)
+            return cls(trace["trace_id"], bool(trace.get("sampled")), trace.get("hops"))
+        except (TypeError, ValueError, KeyError) as e:
+            logger.error(f"Invalid `{TRACE_HEADER}` header: {e}")
+            return cls.start(sample_rate)
+
+    def stamp(self, hop: str, at: float = None) -> float:
+        """Records the time of `hop`, now by default"""
+        self.hops[hop] = time.time() if at is None else at
+        return self.hops[hop]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'trace_id': self.trace_id, 'sampled': self.sampled, 'hops': dict(self.hops)}
+
+    def to_header(self) -> str:
+        return json.dumps(self.to_dict())
+
+    def span(
+            self, name: str, start_hop: str, end_hop: str, stream_id: str = None, **attributes: Any
+    ) -> Optional[Dict[str, Any]]:
+        """The span between two hops, or None when one of them wasn't stamped"""
+        if start_hop not in self.hops or end_hop not in self.hops:
+            return None
+        return create_span(self.trace_id, name, self.hops[start_hop], self.hops[end_hop], stream_id, **attributes)
+
+
+def create_span(
+        trace_id: str, name: str, start: float, end: float, stream_id: str = None, **attributes: Any
+) -> Dict[str, Any]:
+    return {
+        'trace_id': trace_id,
+        'service': "frame-analyzer",
+        'name': name,
+        'stream_id': stream_id,
+        'start': start,
+        'end': end,
+        'duration_ms': 1000 * (end - start),
+        'attributes': attributes,
+    }
+
+
+class SpanExporter(abc.ABC):
+    """Exports spans of sampled traces"""
+
+    @abc.abstractmethod
+    def export(self, span: Dict[str, Any]) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class FileSpanExporter(SpanExporter):
+    """Appends spans as JSON lines to a file, opened on the first span"""
+
+    def __init__(self, location: str):
+        self.location = location
+        self._file = None
+        self._lock = threading.Lock()
+
+    def export(self, span: Dict[str, Any]) -> None:
+        line = json.dumps(span, default=str) + "\n"
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.location, "a", buffering=1)
+            self._file.write(line)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class UdpSpanExporter(SpanExporter):
+    """Sends every span as a JSON datagram to a collector, e.g. the UDP source of Vector or Fluent Bit.
+    Spans are dropped when nothing is listening, tracing never holds up processing"""
+
+    def __init__(self, host: str, port: int):
+        self.address = (host, port)
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setblocking(False)
+
+    def export(self, span: Dict[str, Any]) -> None:
+        try:
+            self._socket.sendto(json.dumps(span, default=str).encode("utf-8"), self.address)
+        except OSError as e:
+            logger.debug(f"Could not export span: {e}")
+
+    def close(self) -> None:
+        self._socket.close()
+
+
+def create_exporter(target: Optional[str]) -> Optional[SpanExporter]:
+    """Creates the exporter for `target`: `udp://host:port` or the location of a JSONL file.
+    Returns None, so nothing is exported, when `target` is empty"""
+    if not target:
+        return None
+    if target.startswith("udp://"):
+        host, _, port = target[len("udp://"):].rpartition(":")
+        if not host or not port.isdigit():
+            raise ValueError(f"Invalid collector address: {target}, expected udp://host:port")
+        return UdpSpanExporter(host, int(port))
+    return FileSpanExporter(target)
@@ -0,0 +1,68 @@
+import argparse
+import json
+import os
+import sys
+
+# The eager model is unpickled from the weights file, which requires the YOLOv5 code base
+sys.path.append("yolov5")
+
+from frame_analyzer.detection.backends import TorchBackend, export, export_location
+from frame_analyzer.detection.evaluation import evaluate
+from frame_analyzer.detection.quantization import quantize_static, quantized_location
+from frame_analyzer.detection.yolov5_detector import YOLOv5Detector
+from frame_analyzer.detection.yolov5_utils import select_device
+
+
+parser = argparse.ArgumentParser(description="Quantize the detector to INT8 and compare its accuracy against fp32")
+subparsers = parser.add_subparsers(dest="command", required=True)
+
+calibrate_parser = subparsers.add_parser("calibrate", help="Statically quantize the ONNX model, calibrated on a folder of images")
+calibrate_parser.add_argument("-w", "--weights", dest="weights_location", type=str, default="weights/garb_weights.pt", help="Path to weights file")
+calibrate_parser.add_argument("-i", "--images", dest="images_dir", type=str, required=True, help="Folder of representative street images")
+calibrate_parser.add_argument("-n", "--num", dest="num_images", type=int, default=100, help="Maximum number of images to calibrate on")
+calibrate_parser.add_argument("--imgsize", dest="img_size", type=int, default=640, help="Input size of the model")
+
+evaluate_parser = subparsers.add_parser("evaluate", help="Report the accuracy delta of a backend and precision against fp32")
+evaluate_parser.add_argument("-w", "--weights", dest="weights_location", type=str, default="weights/garb_weights.pt", help="Path to weights file")
+evaluate_parser.add_argument("-i", "--images", dest="images_dir", type=str, required=True, help="Folder of labelled sample images")
+evaluate_parser.add_argument("-l", "--labels", dest="labels_dir", type=str, required=True, help="Folder of YOLO label files, one per image")
+evaluate_parser.add_argument("--backend", dest="backend", type=str, choices=["torch", "torchscript", "onnx"], default="onnx", help="Backend to evaluate")
+evaluate_parser.add_argument("--precision", dest="precision", type=str, choices=["fp32", "int8", "bf16"], default="int8", help="Precision to evaluate")
+evaluate_parser.add_argument("--imgsize", dest="img_size", type=int, default=640, help="Input size of the model")
+evaluate_parser.add_argument("--iou", dest="iou_thres", type=float, default=0.5, help="Minimum IoU of a detection with a label to count as a match")
+
+args = parser.parse_args()
+
+
+if __name__ == "__main__":
+    if args.command == "calibrate":
+        onnx_location = export_location(args.weights_location, "onnx", args.img_size)
+        if not os.path.exists(onnx_location):
+            backend = TorchBackend.from_weights(args.weights_location, select_device())
+            export(backend, "onnx", onnx_location, img_size=args.img_size)
+        quantize_static(
+            onnx_location, quantized_location(onnx_location), args.images_dir,
+            img_size=args.img_size, num_images=args.num_images,
+        )
+
+    else:
+        baseline = evaluate(
+            YOLOv5Detector(args.weights_location, backend="torch", precision="fp32", img_size=args.img_size),
+            args.images_dir, args.labels_dir, args.iou_thres,
+        )
+        candidate = evaluate(
+            YOLOv5Detector(
+                args.weights_location, backend=args.backend, precision=args.precision, img_size=args.img_size
+            ),
+            args.images_dir, args.labels_dir, args.iou_thres,
+        )
+        delta = {
+            key: candidate[key] - baseline[key]
+            for key in ("precision", "recall", "f1", "ms_per_image")
+        }
+        print(json.dumps({
+            "baseline": {"backend": "torch", "precision": "fp32", **baseline},
+            "candidate": {"backend": args.backend, "precision": args.precision, **candidate},
+            "delta": delta,
+            "speedup": baseline["ms_per_image"] / candidate["ms_per_image"] if candidate["ms_per_image"] else None,
+        }, indent=2))
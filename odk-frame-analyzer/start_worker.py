@@ -3,17 +3,54 @@ import asyncio
 import sys
 import aio_pika
 from frame_analyzer.rmq.worker import RabbitMQWorker
+from frame_analyzer.utils import metrics_util
 
 
 parser = argparse.ArgumentParser(description="Start a Frame Analyzer worker")
 # YOLOv5 arguments
 parser.add_argument("-w", "--weights", dest="weights_location", type=str, default="weights/garb_weights.pt", help="Path to weights file")
+parser.add_argument("--backend", dest="backend", type=str, choices=["torch", "torchscript", "onnx"], default="torch", help="Inference backend, torchscript and onnx export the weights once next to the weights file")
+parser.add_argument("--precision", dest="precision", type=str, choices=["fp32", "int8", "bf16"], default="fp32", help="Inference precision, int8 requires the onnx backend and bf16 the torch backend")
+parser.add_argument("--imgsize", dest="img_size", type=int, default=640, help="Size of the longest side of the model input, a multiple of 32")
+parser.add_argument("--rect", action="store_true", help="Pad frames only to the nearest multiple of 32 (rectangular inference) instead of to an imgsize square, torch backend only")
+parser.add_argument("--nowarmup", action="store_true", help="Skip running the model on dummy input before consuming")
+parser.add_argument("--cachesize", dest="cache_size", type=int, default=0, help="Number of detection results cached by image hash, 0 disables the cache")
+parser.add_argument("--cachettl", dest="cache_ttl", type=float, default=300.0, help="Seconds a cached detection result stays valid")
+# Near-duplicate arguments
+parser.add_argument("--dedup", dest="dedup", type=str, choices=["off", "drop", "link"], default="off", help="Drop near-duplicate frames of a stream, or publish them linked to the previous frame")
+parser.add_argument("--deduphamming", dest="dedup_hamming", type=int, default=5, help="Maximum number of differing bits of the 64 bit image hashes of near-duplicates")
+parser.add_argument("--dedupdistance", dest="dedup_distance", type=float, default=5.0, help="Maximum distance in meters between near-duplicates")
+parser.add_argument("--dedupinterval", dest="dedup_interval", type=float, default=60.0, help="Maximum seconds between near-duplicates")
+parser.add_argument("--writequeue", dest="write_queue_size", type=int, default=0, help="Write images in the background, with at most this many writes queued (0 writes them while processing)")
+parser.add_argument("--writeworkers", dest="write_workers", type=int, default=2, help="Number of threads writing images in the background")
+parser.add_argument("--syncevery", dest="sync_every", type=int, default=0, help="Flush background writes to disk after this many images (0 leaves it to the OS)")
+parser.add_argument("--storage", dest="storage", type=str, choices=["local", "s3"], default="local", help="Store images in the output folder, or in an S3-compatible bucket")
+parser.add_argument("--s3bucket", dest="s3_bucket", type=str, default=None, help="Bucket to store images in")
+parser.add_argument("--s3endpoint", dest="s3_endpoint", type=str, default=None, help="Endpoint of the S3-compatible storage, e.g. http://localhost:9000 for MinIO")
+parser.add_argument("--s3prefix", dest="s3_prefix", type=str, default="", help="Prefix of the keys of stored images")
+parser.add_argument("--s3pool", dest="s3_pool_size", type=int, default=32, help="Maximum number of connections to the S3-compatible storage")
 # Persistment rules
 parser.add_argument("--savewith", action="store_true", help="Save frames with detected objects (to disk)")
 parser.add_argument("--includepriv", action="store_true", help="Also accept frames with just privacy objects")
 parser.add_argument("--savewithout", action="store_true", help="Save frames without detected objects (to disk)")
 parser.add_argument("--blur", action="store_true", help="Blur privacy objects on original image")
 parser.add_argument("--bbox", action="store_true", help="Save a separate image with bounding boxes")
+parser.add_argument("--slim", action="store_true", help="Publish results without images, only detections, counts and meta data")
+# Batching arguments
+parser.add_argument("-bs", "--batchsize", dest="batch_size", type=int, default=1, help="Maximum number of frames detected in a single forward pass")
+parser.add_argument("-bt", "--batchtimeout", dest="batch_timeout", type=int, default=50, help="Milliseconds to wait for a batch to fill up")
+# Execution arguments
+parser.add_argument("--executor", dest="executor_type", type=str, choices=["thread", "process"], default="thread", help="Run detection and image processing in a thread or process pool")
+parser.add_argument("--workers", dest="executor_workers", type=int, default=None, help="Number of threads or processes in the pool, defaults to number of cores")
+parser.add_argument("--maxpending", dest="max_pending_jobs", type=int, default=None, help="Maximum number of jobs in flight in the pool, defaults to 2x the workers")
+# Flow control arguments
+parser.add_argument("--prefetch", dest="prefetch_count", type=int, default=None, help="Maximum number of unacknowledged messages the broker sends to this worker")
+parser.add_argument("--maxinflight", dest="max_in_flight", type=int, default=None, help="Maximum number of messages processed at the same time, should be at least the batch size")
+parser.add_argument("--ack", action="store_true", help="Acknowledge messages only after they have been processed successfully")
+# Monitoring arguments
+parser.add_argument("--metricsport", dest="metrics_port", type=int, default=0, help="Serve Prometheus metrics on http://0.0.0.0:<port>/metrics (0 disables the endpoint)")
+parser.add_argument("--traceexport", dest="trace_export", type=str, default=None, help="Export spans of sampled traces to a JSONL file, or to a collector on udp://host:port")
+parser.add_argument("--tracesample", dest="trace_sample_rate", type=float, default=0.0, help="Fraction of frames without a trace from the API that are sampled")
 # Incoming traffic arguments
 parser.add_argument("-ie", "--inexchange", dest="in_exchange_name", type=str, default="exchange_raw_frames",  help="RabbitMQ exchange where raw frames are posted")
 parser.add_argument("-iq", "--inqueue", dest="in_queue_name", type=str, default="incoming_frames", help="RabbitMQ queue that is bound to exchange")
@@ -44,6 +81,35 @@ if __name__ == "__main__":
         savewithout=args.savewithout,
         blur=args.blur,
         bbox=args.bbox,
+        slim_results=args.slim,
+        warmup=not args.nowarmup,
+        backend=args.backend,
+        precision=args.precision,
+        img_size=args.img_size,
+        rect=args.rect,
+        cache_size=args.cache_size,
+        cache_ttl=args.cache_ttl,
+        dedup=args.dedup,
+        dedup_hamming=args.dedup_hamming,
+        dedup_distance=args.dedup_distance,
+        dedup_interval=args.dedup_interval,
+        write_queue_size=args.write_queue_size,
+        write_workers=args.write_workers,
+        sync_every=args.sync_every,
+        storage=args.storage,
+        s3_bucket=args.s3_bucket,
+        s3_endpoint=args.s3_endpoint,
+        s3_prefix=args.s3_prefix,
+        s3_pool_size=args.s3_pool_size,
+        trace_sample_rate=args.trace_sample_rate,
+        trace_export=args.trace_export,
+        batch_size=args.batch_size,
+        batch_timeout=args.batch_timeout,
+        executor_type=args.executor_type,
+        executor_workers=args.executor_workers,
+        max_pending_jobs=args.max_pending_jobs,
+        prefetch_count=args.prefetch_count,
+        max_in_flight=args.max_in_flight,
         in_exchange_name=args.in_exchange_name,
         in_queue_name=args.in_queue_name,
         in_routing_key=args.in_routing_key,
@@ -52,5 +118,11 @@ if __name__ == "__main__":
     )
     w.connect(args.host, args.username, args.password, args.port)
 
-    loop.create_task(w.start_consuming())
+    if args.metrics_port:
+        try:
+            loop.run_until_complete(metrics_util.serve(w.metrics, args.metrics_port))
+        except OSError as e:
+            logger.error(f"Could not serve metrics on port {args.metrics_port}: {e}")
+
+    loop.create_task(w.start_consuming(no_ack=not args.ack))
     loop.run_forever()
@@ -2,6 +2,7 @@ import asyncio
 import os
 
 from frame_analyzer.rmq.worker import RabbitMQWorker
+from frame_analyzer.utils import metrics_util
 
 if __name__ == "__main__":
     from loguru import logger
@@ -13,11 +14,43 @@ if __name__ == "__main__":
     port = os.environ.get("PORT", 5672)
 
     weights_location = os.environ.get("WEIGHTS_LOCATION", "weights/garb_weights_l.pt")
+    backend = os.environ.get("BACKEND", "torch")
+    precision = os.environ.get("PRECISION", "fp32")
+    img_size = int(os.environ.get("IMG_SIZE", 640))
+    rect = os.environ.get("RECT", "") not in ("", "0", "false", "False")
+    cache_size = int(os.environ.get("CACHE_SIZE", 0))
+    cache_ttl = float(os.environ.get("CACHE_TTL", 300))
+    dedup = os.environ.get("DEDUP", "off")
+    dedup_hamming = int(os.environ.get("DEDUP_HAMMING", 5))
+    dedup_distance = float(os.environ.get("DEDUP_DISTANCE", 5))
+    dedup_interval = float(os.environ.get("DEDUP_INTERVAL", 60))
+    write_queue_size = int(os.environ.get("WRITE_QUEUE_SIZE", 0))
+    write_workers = int(os.environ.get("WRITE_WORKERS", 2))
+    sync_every = int(os.environ.get("SYNC_EVERY", 0))
+    storage = os.environ.get("STORAGE", "local")
+    s3_bucket = os.environ.get("S3_BUCKET")
+    s3_endpoint = os.environ.get("S3_ENDPOINT")
+    s3_prefix = os.environ.get("S3_PREFIX", "")
+    s3_pool_size = int(os.environ.get("S3_POOL_SIZE", 32))
+    warmup = os.environ.get("WARMUP", "1") not in ("", "0", "false", "False")
     savewith = os.environ.get("SAVEWITH", True)
     includepriv = os.environ.get("INCLUDEPRIV", True)
     savewithout = os.environ.get("SAVEWITHOUT", True)
     blur = os.environ.get("BLUR", True)
     bbox = os.environ.get("BBOX", True)
+    slim_results = os.environ.get("SLIM_RESULTS", "") not in ("", "0", "false", "False")
+    batch_size = int(os.environ.get("BATCH_SIZE", 1))
+    batch_timeout = int(os.environ.get("BATCH_TIMEOUT", 50))
+    executor_type = os.environ.get("EXECUTOR", "thread")
+    executor_workers = int(os.environ.get("EXECUTOR_WORKERS", 0)) or None
+    max_pending_jobs = int(os.environ.get("MAX_PENDING_JOBS", 0)) or None
+    prefetch_count = int(os.environ.get("PREFETCH_COUNT", 0)) or None
+    max_in_flight = int(os.environ.get("MAX_IN_FLIGHT", 0)) or None
+    ack = os.environ.get("ACK", "") not in ("", "0", "false", "False")
+    # Port to serve metrics on, disabled (0) unless set, e.g. to the port the container publishes
+    metrics_port = int(os.environ.get("METRICS_PORT", 0))
+    trace_sample_rate = float(os.environ.get("TRACE_SAMPLE_RATE", 0))
+    trace_export = os.environ.get("TRACE_EXPORT")
     in_exchange_name = os.environ.get("IN_EXCHANGE", "exchange_raw_frames")
     in_queue_name = os.environ.get("IN_QUEUE", "queue_raw_frames")
     in_routing_key = os.environ.get("IN_ROUTING_KEY", "frame")
@@ -32,6 +65,35 @@ if __name__ == "__main__":
         savewithout=savewithout,
         blur=blur,
         bbox=bbox,
+        slim_results=slim_results,
+        warmup=warmup,
+        backend=backend,
+        precision=precision,
+        img_size=img_size,
+        rect=rect,
+        cache_size=cache_size,
+        cache_ttl=cache_ttl,
+        dedup=dedup,
+        dedup_hamming=dedup_hamming,
+        dedup_distance=dedup_distance,
+        dedup_interval=dedup_interval,
+        write_queue_size=write_queue_size,
+        write_workers=write_workers,
+        sync_every=sync_every,
+        storage=storage,
+        s3_bucket=s3_bucket,
+        s3_endpoint=s3_endpoint,
+        s3_prefix=s3_prefix,
+        s3_pool_size=s3_pool_size,
+        trace_sample_rate=trace_sample_rate,
+        trace_export=trace_export,
+        batch_size=batch_size,
+        batch_timeout=batch_timeout,
+        executor_type=executor_type,
+        executor_workers=executor_workers,
+        max_pending_jobs=max_pending_jobs,
+        prefetch_count=prefetch_count,
+        max_in_flight=max_in_flight,
         in_exchange_name=in_exchange_name,
         in_queue_name=in_queue_name,
         in_routing_key=in_routing_key,
@@ -40,5 +102,11 @@ if __name__ == "__main__":
     )
     w.connect(host, username, password, port)
 
-    loop.create_task(w.start_consuming())
+    if metrics_port:
+        try:
+            loop.run_until_complete(metrics_util.serve(w.metrics, metrics_port))
+        except OSError as e:
+            logger.error(f"Could not serve metrics on port {metrics_port}: {e}")
+
+    loop.create_task(w.start_consuming(no_ack=not ack))
     loop.run_forever()
@@ -0,0 +1,103 @@
+import os
+from unittest import mock
+
+import cv2
+import numpy as np
+import pytest
+import torch
+
+from frame_analyzer.detection import backends, quantization
+from frame_analyzer.detection.backends import TorchBackend, load_backend
+
+
+class DummyYOLOv5(torch.nn.Module):
+    """Stands in for the YOLOv5 model: returns (predictions, feature maps) like its Detect layer"""
+
+    names = ["person", "license_plate", "garbage"]
+
+    def __init__(self):
+        super().__init__()
+        self.conv = torch.nn.Conv2d(3, 5 + len(self.names), kernel_size=8, stride=8)
+        self.bn = torch.nn.BatchNorm2d(5 + len(self.names))
+
+    def forward(self, img: torch.Tensor, augment: bool = False):
+        x = self.bn(self.conv(img)).sigmoid()
+        return x.flatten(2).transpose(1, 2), [x]
+
+
+@pytest.fixture
+def weights_location(tmp_path, monkeypatch) -> str:
+    model = DummyYOLOv5().eval()
+    monkeypatch.setattr(
+        TorchBackend, "from_weights", classmethod(lambda cls, weights_location, device: cls(model))
+    )
+    return str(tmp_path / "weights.pt")
+
+
+@pytest.mark.parametrize("backend", ["torchscript", "onnx"])
+def test_backend_matches_eager_model(weights_location, backend) -> None:
+    if backend == "onnx":
+        pytest.importorskip("onnx")
+        pytest.importorskip("onnxruntime")
+
+    eager = load_backend(weights_location, "torch", img_size=64)
+    exported = load_backend(weights_location, backend, img_size=64)
+
+    img = torch.rand((2, 3, 64, 64))
+    with torch.no_grad():
+        expected = eager(img)
+        actual = exported(img)
+
+    assert exported.names == eager.names
+    assert actual.shape == expected.shape
+    torch.testing.assert_close(actual, expected, rtol=1e-4, atol=1e-4)
+
+
+def test_exports_next_to_weights_once(weights_location, monkeypatch) -> None:
+    load_backend(weights_location, "torchscript", img_size=64)
+
+    export = mock.Mock()
+    monkeypatch.setattr(backends, "export", export)
+    load_backend(weights_location, "torchscript", img_size=64)
+
+    export.assert_not_called()
+    assert os.path.exists(os.path.join(os.path.dirname(weights_location), "weights_64.torchscript"))
+
+
+def test_raises_on_unknown_backend(weights_location) -> None:
+    with pytest.raises(ValueError):
+        load_backend(weights_location, "tensorrt")
+
+
+@pytest.mark.parametrize("calibrate", [False, True])
+def test_int8_backend_is_close_to_eager_model(weights_location, tmp_path, calibrate) -> None:
+    pytest.importorskip("onnx")
+    pytest.importorskip("onnxruntime")
+
+    if calibrate:
+        images_dir = tmp_path / "calibration"
+        images_dir.mkdir()
+        for i in range(4):
+            cv2.imwrite(str(images_dir / f"{i}.jpg"), np.random.randint(0, 255, (48, 64, 3), dtype=np.uint8))
+
+        onnx_location = backends.export_location(weights_location, "onnx", img_size=64)
+        backends.export(TorchBackend.from_weights(weights_location, None), "onnx", onnx_location, img_size=64)
+        quantization.quantize_static(
+            onnx_location, quantization.quantized_location(onnx_location), str(images_dir), img_size=64
+        )
+
+    eager = load_backend(weights_location, "torch", img_size=64)
+    quantized = load_backend(weights_location, "onnx", img_size=64, precision="int8")
+
+    img = torch.rand((1, 3, 64, 64))
+    with torch.no_grad():
+        expected = eager(img)
+        actual = quantized(img)
+
+    assert quantized.names == eager.names
+    torch.testing.assert_close(actual, expected, rtol=0, atol=0.1)
+
+
+def test_raises_on_unsupported_precision(weights_location) -> None:
+    with pytest.raises(ValueError):
+        load_backend(weights_location, "torch", precision="int8")
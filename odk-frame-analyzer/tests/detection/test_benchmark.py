@@ -0,0 +1,66 @@
+from unittest import mock
+
+import pytest
+import torch
+
+from frame_analyzer.detection import benchmark
+from frame_analyzer.detection.backends import InferenceBackend
+from frame_analyzer.detection.yolov5_detector import YOLOv5Detector
+
+
+class DummyBackend(InferenceBackend):
+    names = ["person", "face_privacy_filter", "garbage"]
+
+    def __call__(self, img: torch.Tensor) -> torch.Tensor:
+        pred = torch.zeros((img.shape[0], 10, 5 + len(self.names)))
+        pred[:, 0, :4] = torch.tensor([100.0, 100.0, 50.0, 50.0])
+        pred[:, 0, 4] = 0.9
+        pred[:, 0, 7] = 0.9
+        return pred
+
+
+@pytest.fixture
+def detector():
+    with mock.patch(
+        "frame_analyzer.detection.yolov5_detector.load_backend", side_effect=lambda *args: DummyBackend()
+    ):
+        yield YOLOv5Detector("weights.pt", warmup_batch_sizes=[])
+
+
+def test_time_calls_counts_only_repeats() -> None:
+    func = mock.Mock()
+
+    timings = benchmark.time_calls(func, repeats=5, warmup=2)
+
+    assert func.call_count == 7
+    assert timings['repeats'] == 5
+    assert timings['min_ms'] <= timings['median_ms'] <= timings['p95_ms']
+
+
+def test_run_reports_every_stage_size_and_batch_size(detector) -> None:
+    report = benchmark.run(detector, image_sizes=[(320, 240), (160, 160)], batch_sizes=[1, 2], repeats=2)
+
+    keys = {(r['name'], r['image_size'], r['batch_size']) for r in report['results']}
+    for size in ("320x240", "160x160"):
+        for name in benchmark.DETECT_STAGES + benchmark.IMAGE_UTIL_BENCHMARKS:
+            assert (name, size, 1) in keys
+        assert ("detect_batch", size, 2) in keys
+    assert report['meta']['backend'] == "torch"
+
+
+def results(**medians):
+    return {'results': [
+        {'name': name, 'image_size': "640x480", 'batch_size': 1, 'median_ms': median}
+        for name, median in medians.items()
+    ]}
+
+
+def test_compare_flags_regressions_above_threshold() -> None:
+    comparison = benchmark.compare(
+        results(forward=12.0, nms=1.05, detect=20.0),
+        results(forward=10.0, nms=1.0, letterbox=2.0),
+        threshold=0.1,
+    )
+
+    assert [(row['name'], row['regressed']) for row in comparison] == [("forward", True), ("nms", False)]
+    assert comparison[0]['ratio'] == pytest.approx(1.2)
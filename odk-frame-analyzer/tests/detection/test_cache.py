@@ -0,0 +1,61 @@
+from unittest import mock
+
+from frame_analyzer.detection.cache import DetectionCache, model_fingerprint
+from frame_analyzer.schemas.frame import AnalyzedFrame
+
+
+def analyzed_frame(count: int) -> AnalyzedFrame:
+    return AnalyzedFrame(
+        taken_at="2021-01-31 12:34:56",
+        lat_lng={"lat": "52.367527", "lng": "4.901257"},
+        stream_id="1",
+        object_count={"garbage": count, "total": count},
+    )
+
+
+def test_returns_cached_fields() -> None:
+    cache = DetectionCache("model")
+    key = cache.key(b"jpeg")
+    cache.put(key, analyzed_frame(2))
+
+    assert cache.get(key)["object_count"] == {"garbage": 2, "total": 2}
+    assert cache.get(cache.key(b"other jpeg")) is None
+    assert cache.stats() == {'size': 1, 'hits': 1, 'misses': 1, 'evictions': 0}
+
+
+def test_returns_copies() -> None:
+    cache = DetectionCache("model")
+    key = cache.key(b"jpeg")
+    cache.put(key, analyzed_frame(2))
+
+    cache.get(key)["object_count"]["garbage"] = 3
+
+    assert cache.get(key)["object_count"]["garbage"] == 2
+
+
+def test_evicts_least_recently_used() -> None:
+    cache = DetectionCache("model", max_size=2)
+    keys = [cache.key(bytes([i])) for i in range(3)]
+    cache.put(keys[0], analyzed_frame(0))
+    cache.put(keys[1], analyzed_frame(1))
+    cache.get(keys[0])
+    cache.put(keys[2], analyzed_frame(2))
+
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_expires_after_ttl() -> None:
+    cache = DetectionCache("model", ttl=10)
+    key = cache.key(b"jpeg")
+
+    with mock.patch("frame_analyzer.detection.cache.time.monotonic", side_effect=[100, 105, 111]):
+        cache.put(key, analyzed_frame(1))
+        assert cache.get(key) is not None
+        assert cache.get(key) is None
+
+
+def test_key_depends_on_model() -> None:
+    assert DetectionCache("model").key(b"jpeg") != DetectionCache("other model").key(b"jpeg")
+    assert model_fingerprint("w.pt", conf_thres=0.3) != model_fingerprint("w.pt", conf_thres=0.4)
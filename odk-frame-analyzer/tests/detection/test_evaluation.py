@@ -0,0 +1,25 @@
+from frame_analyzer.detection.evaluation import load_labels, match
+
+
+def detection(cls, c1, c2, confidence=90):
+    return {'detected_object_type': cls, 'confidence': confidence, 'bbox': {'coordinate1': c1, 'coordinate2': c2}}
+
+
+def test_loads_yolo_labels_in_pixels(tmp_path) -> None:
+    label_path = tmp_path / "frame.txt"
+    label_path.write_text("1 0.5 0.5 0.2 0.4\n")
+
+    labels = load_labels(str(label_path), width=100, height=50, names=["person", "garbage"])
+
+    assert labels == [("garbage", (40.0, 15.0, 60.0, 35.0))]
+
+
+def test_matches_each_label_once() -> None:
+    labels = [("garbage", (0, 0, 10, 10)), ("person", (50, 50, 60, 60))]
+    detections = [
+        detection("garbage", (0, 0), (10, 10), confidence=90),
+        detection("garbage", (1, 1), (10, 10), confidence=80),  # duplicate of the first
+        detection("garbage", (50, 50), (60, 60)),  # wrong class
+    ]
+
+    assert match(detections, labels) == (1, 2, 1)
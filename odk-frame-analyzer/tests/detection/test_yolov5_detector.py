@@ -0,0 +1,105 @@
+from unittest import mock
+
+import numpy as np
+import pytest
+import torch
+
+from frame_analyzer.detection.backends import InferenceBackend
+from frame_analyzer.detection.yolov5_detector import YOLOv5Detector
+from frame_analyzer.schemas.frame import ImgFrame
+from frame_analyzer.schemas.frame_context import FrameContext
+
+
+class DummyBackend(InferenceBackend):
+    """Returns the same predictions for every image (by default nothing),
+    remembers the shapes it was called with"""
+
+    names = ["person", "license_plate", "garbage"]
+
+    def __init__(self, pred: torch.Tensor = None):
+        self.pred = pred if pred is not None else torch.zeros((10, 5 + len(self.names)))
+        self.shapes = []
+
+    def __call__(self, img: torch.Tensor) -> torch.Tensor:
+        self.shapes.append(tuple(img.shape))
+        return self.pred.repeat(img.shape[0], 1, 1)
+
+
+def frame_context(height: int, width: int) -> FrameContext:
+    return FrameContext(image=np.zeros((height, width, 3), dtype=np.uint8))
+
+
+@pytest.fixture
+def load_backend():
+    with mock.patch(
+        "frame_analyzer.detection.yolov5_detector.load_backend", side_effect=lambda *args: DummyBackend()
+    ) as load_backend:
+        yield load_backend
+
+
+def test_pads_to_nearest_stride_multiple(load_backend) -> None:
+    detector = YOLOv5Detector("weights.pt", warmup_batch_sizes=[], img_size=512, rect=True)
+
+    detector.detect(raw_frame=ImgFrame(), frame_context=frame_context(720, 1280))
+
+    assert detector.backend.shapes == [(1, 3, 288, 512)]
+
+
+def test_pads_to_square_by_default(load_backend) -> None:
+    detector = YOLOv5Detector("weights.pt", warmup_batch_sizes=[], img_size=512)
+
+    detector.detect(raw_frame=ImgFrame(), frame_context=frame_context(720, 1280))
+
+    assert detector.backend.shapes == [(1, 3, 512, 512)]
+
+
+def test_warms_up_square_and_landscape_shape_with_rect(load_backend) -> None:
+    detector = YOLOv5Detector("weights.pt", warmup_batch_sizes=[1, 4], rect=True)
+
+    assert detector.backend.shapes == [(1, 3, 640, 640), (1, 3, 384, 640), (4, 3, 640, 640), (4, 3, 384, 640)]
+
+
+def test_warms_up_square_only_without_rect(load_backend) -> None:
+    detector = YOLOv5Detector("weights.pt", warmup_batch_sizes=[1])
+
+    assert detector.backend.shapes == [(1, 3, 640, 640)]
+
+
+def test_batches_frames_by_padded_shape(load_backend) -> None:
+    detector = YOLOv5Detector("weights.pt", warmup_batch_sizes=[], rect=True)
+    contexts = [frame_context(720, 1280), frame_context(1280, 720), frame_context(1080, 1920)]
+
+    results = detector.detect_batch([ImgFrame() for _ in contexts], contexts)
+
+    assert detector.backend.shapes == [(2, 3, 384, 640), (1, 3, 640, 384)]
+    assert [result.analyser_meta['ml_batch_size'] for result in results] == [2, 1, 2]
+
+
+def test_converts_detections(load_backend) -> None:
+    # Boxes as (x center, y center, width, height, objectness, *class scores) on the 640x384 input
+    load_backend.side_effect = lambda *args: DummyBackend(torch.tensor([
+        [320.0, 192.0, 100.0, 50.0, 0.9, 0.0, 0.0, 0.95],
+        [100.0, 100.0, 20.0, 40.0, 1.0, 0.75, 0.0, 0.0],
+    ]))
+    detector = YOLOv5Detector("weights.pt", warmup_batch_sizes=[], rect=True)
+
+    result = detector.detect(raw_frame=ImgFrame(), frame_context=frame_context(720, 1280))
+
+    assert result.detected_objects == [
+        {
+            'detected_object_type': "garbage",
+            'confidence': 85,
+            'bbox': {'coordinate1': (540, 310), 'coordinate2': (740, 410)},
+        },
+        {
+            'detected_object_type': "person",
+            'confidence': 75,
+            'bbox': {'coordinate1': (180, 136), 'coordinate2': (220, 216)},
+        },
+    ]
+    assert result.object_count == {"person": 1, "license_plate": 0, "garbage": 1, "total": 2}
+
+
+def test_raises_on_img_size_not_multiple_of_stride(load_backend) -> None:
+    with pytest.raises(ValueError):
+        YOLOv5Detector("weights.pt", img_size=500)
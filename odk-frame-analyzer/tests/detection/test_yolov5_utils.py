@@ -0,0 +1,37 @@
+import pytest
+import torch
+
+from frame_analyzer.detection.yolov5_utils import batched_non_max_suppression, non_max_suppression
+
+
+def random_prediction(batch_size: int, num_boxes: int, num_classes: int) -> torch.Tensor:
+    """Raw YOLOv5 output: (x center, y center, width, height, objectness, *class scores) per box"""
+    xy = torch.rand((batch_size, num_boxes, 2)) * 640
+    wh = torch.rand((batch_size, num_boxes, 2)) * 120 + 4
+    scores = torch.rand((batch_size, num_boxes, 1 + num_classes))
+    return torch.cat((xy, wh, scores), 2)
+
+
+@pytest.mark.parametrize("num_classes", [1, 5])
+@pytest.mark.parametrize("agnostic", [False, True])
+@pytest.mark.parametrize("classes", [None, [0, 2]])
+def test_batched_nms_matches_nms(num_classes, agnostic, classes) -> None:
+    torch.manual_seed(0)
+    prediction = random_prediction(4, 2000, num_classes)
+    prediction[2, :, 4] = 0  # an image without candidates
+
+    expected = non_max_suppression(prediction.clone(), 0.3, 0.5, classes=classes, agnostic=agnostic)
+    actual = batched_non_max_suppression(prediction.clone(), 0.3, 0.5, classes=classes, agnostic=agnostic)
+
+    assert len(actual) == len(expected)
+    for image_actual, image_expected in zip(actual, expected):
+        assert torch.equal(image_actual, image_expected)
+
+
+def test_batched_nms_without_candidates() -> None:
+    prediction = random_prediction(2, 100, 5)
+    prediction[..., 4] = 0
+
+    output = batched_non_max_suppression(prediction, 0.3, 0.5)
+
+    assert [o.shape for o in output] == [(0, 6), (0, 6)]
@@ -1,12 +1,24 @@
+import asyncio
+import base64
 import json
 import typing
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from unittest import mock
 
 import aio_pika
+import numpy as np
 import pytest
 
+from frame_analyzer.rmq import worker as worker_module
 from frame_analyzer.rmq.worker import AbstractRabbitMQWorker, RabbitMQWorker
-from frame_analyzer.schemas.frame import RawFrame
+from frame_analyzer.schemas.frame import AnalyzedFrame, RawFrame, RawFrameMeta
+from frame_analyzer.schemas.frame_context import FrameContext
+from frame_analyzer.utils import image_util, persist_util, trace_util
+
+
+# Unpatched, `TestRabbitMQWorker` patches `push_result` on the class
+_push_result = RabbitMQWorker.push_result
 
 
 class DummyRabbitMQWorker(AbstractRabbitMQWorker):
@@ -49,14 +61,34 @@ class TestAbstractRabbitMQWorker:
 
         worker.channel.declare_queue.assert_called_once_with(worker.in_queue_name)
 
+    @pytest.mark.asyncio
+    async def test_sets_prefetch_count(self, _) -> None:
+        worker = DummyRabbitMQWorker("test", prefetch_count=10)
+        worker.connect("test", "user", "password")
+        await worker.start_consuming()
+
+        worker.channel.set_qos.assert_called_once_with(prefetch_count=10)
 
+    @pytest.mark.asyncio
+    async def test_acks_after_on_message(self, _) -> None:
+        worker = DummyRabbitMQWorker("test")
+        message = mock.MagicMock()
+
+        await worker._consume_message(message, no_ack=False)
+
+        message.process.assert_called_once_with(ignore_processed=True)
+        message.process.return_value.__aexit__.assert_called_once()
+
+
+@mock.patch("frame_analyzer.rmq.worker.image_util.decode_image")
+@mock.patch("frame_analyzer.rmq.worker.image_util.encode_image", return_value=b"encoded")
 @mock.patch("frame_analyzer.rmq.worker.RabbitMQWorker.send_message")
 @mock.patch("frame_analyzer.rmq.worker.aio_pika.connect_robust")
 @mock.patch("frame_analyzer.rmq.worker.YOLOv5Detector")
-@mock.patch("frame_analyzer.rmq.worker.image_util.blur_privacy_objects")
-@mock.patch("frame_analyzer.rmq.worker.image_util.draw_bounding_boxes")
+@mock.patch("frame_analyzer.rmq.worker.image_util.blur_privacy_objects_on_array")
+@mock.patch("frame_analyzer.rmq.worker.image_util.draw_bounding_boxes_on_array")
 @mock.patch("frame_analyzer.rmq.worker.persist_util.create_file_name")
-@mock.patch("frame_analyzer.rmq.worker.persist_util.save_to_disk")
+@mock.patch("frame_analyzer.rmq.worker.persist_util.write_to_sink")
 @mock.patch("frame_analyzer.rmq.worker.RabbitMQWorker.push_result")
 class TestRabbitMQWorker:
     # TODO: Write tests for the different parameter options
@@ -75,7 +107,7 @@ class TestRabbitMQWorker:
     worker = None
 
     @pytest.mark.asyncio
-    async def base_test(self):
+    async def base_test(self, **kwargs):
         self.worker = RabbitMQWorker(
             weights_location="/path/to/weights",
             savewith=True,
@@ -85,7 +117,8 @@ class TestRabbitMQWorker:
             bbox=True,
             in_exchange_name="in_ex",
             in_queue_name="in_q",
-            in_routing_key="in_rk"
+            in_routing_key="in_rk",
+            **kwargs
         )
         self.worker.connect("test", "user", "password")
         await self.worker.start_consuming()
@@ -94,7 +127,110 @@ class TestRabbitMQWorker:
     async def test_calls_detect(self, *args) -> None:
         await self.base_test()
         await self.worker.on_message(self.message)
-        self.worker.yolov5_detector.detect.assert_called_once_with(raw_frame=self.frame)
+        self.worker.yolov5_detector.detect.assert_called_once_with(
+            raw_frame=self.frame, frame_context=mock.ANY
+        )
+
+    @pytest.mark.asyncio
+    async def test_warms_up_detector_for_batch_size(self, _, __, ___, ____, _____, detector, *args) -> None:
+        await self.base_test(batch_size=8)
+        detector.assert_called_once_with(
+            "/path/to/weights", warmup_batch_sizes=[1, 8], backend="torch", precision="fp32",
+            img_size=640, rect=False,
+        )
+
+    @pytest.mark.asyncio
+    async def test_skips_warmup(self, _, __, ___, ____, _____, detector, *args) -> None:
+        await self.base_test(warmup=False)
+        detector.assert_called_once_with(
+            "/path/to/weights", warmup_batch_sizes=[], backend="torch", precision="fp32",
+            img_size=640, rect=False,
+        )
+
+    @pytest.mark.asyncio
+    async def test_skips_detect_for_cached_image(self, *args) -> None:
+        await self.base_test(cache_size=10)
+        detect = self.worker.yolov5_detector.detect
+        detect.return_value = AnalyzedFrame(**self.frame.dict())
+
+        first = await self.worker.detect_cached(self.frame, FrameContext(raw_bytes=b"jpeg"))
+        second = await self.worker.detect_cached(self.frame, FrameContext(raw_bytes=b"jpeg"))
+
+        detect.assert_called_once()
+        assert first.analyser_meta["ml_cache_hit"] is False
+        assert second.analyser_meta["ml_cache_hit"] is True
+
+    @pytest.mark.asyncio
+    async def test_drops_near_duplicate_frames(self, push_result, *args) -> None:
+        await self.base_test(dedup="drop")
+        detect = self.worker.yolov5_detector.detect
+        detect.return_value = AnalyzedFrame(**self.frame.dict())
+
+        with mock.patch("frame_analyzer.rmq.worker.dedup_util.dhash", return_value=0):
+            await self.worker.on_message(self.message)
+            await self.worker.on_message(self.message)
+
+        detect.assert_called_once()
+        push_result.assert_called_once()
+        assert self.worker.duplicate_filter.stats()["skipped"] == 1
+
+    def test_raises_on_unknown_executor_type(self, *args) -> None:
+        with pytest.raises(ValueError):
+            RabbitMQWorker(
+                weights_location="/path/to/weights",
+                savewith=True,
+                includepriv=True,
+                savewithout=True,
+                blur=True,
+                bbox=True,
+                in_exchange_name="in_ex",
+                in_queue_name="in_q",
+                in_routing_key="in_rk",
+                executor_type="gpu",
+            )
+
+    @pytest.mark.asyncio
+    async def test_calls_detect_with_binary_message(self, *args) -> None:
+        frame_meta = {k: v for k, v in self.message_body.items() if k != "img"}
+        message = mock.Mock(
+            body=b"\xff\xd8\xff",
+            content_type="image/jpeg",
+            headers={"frame_meta": json.dumps(frame_meta)},
+        )
+
+        await self.base_test()
+        await self.worker.on_message(message)
+
+        self.worker.yolov5_detector.detect.assert_called_once_with(
+            raw_frame=RawFrameMeta(**frame_meta), frame_context=mock.ANY
+        )
+        frame_context = self.worker.yolov5_detector.detect.call_args.kwargs["frame_context"]
+        assert frame_context.raw_bytes == message.body
+
+    @pytest.mark.asyncio
+    async def test_calls_detect_batch_when_batch_is_full(self, *args) -> None:
+        await self.base_test(batch_size=2, batch_timeout=10000)
+        detect_batch = self.worker.yolov5_detector.detect_batch
+        detect_batch.return_value = [mock.Mock(), mock.Mock()]
+
+        results = await asyncio.gather(
+            self.worker.detect(self.frame),
+            self.worker.detect(self.frame),
+        )
+
+        detect_batch.assert_called_once_with([self.frame, self.frame], [None, None])
+        assert results == detect_batch.return_value
+
+    @pytest.mark.asyncio
+    async def test_calls_detect_batch_after_batch_timeout(self, *args) -> None:
+        await self.base_test(batch_size=4, batch_timeout=1)
+        detect_batch = self.worker.yolov5_detector.detect_batch
+        detect_batch.return_value = [mock.Mock()]
+
+        result = await self.worker.detect(self.frame)
+
+        detect_batch.assert_called_once_with([self.frame], [None])
+        assert result == detect_batch.return_value[0]
 
     @pytest.mark.asyncio
     async def test_calls_blur_privacy_objects(
@@ -103,7 +239,7 @@ class TestRabbitMQWorker:
         await self.base_test()
         await self.worker.on_message(self.message)
         blur_privacy_objects.assert_called_once_with(
-            self.worker.yolov5_detector.detect.return_value.img,
+            image_util.decode_image.return_value,
             self.worker.yolov5_detector.detect.return_value.detected_objects,
         )
 
@@ -129,19 +265,143 @@ class TestRabbitMQWorker:
         )
 
     @pytest.mark.asyncio
-    async def test_calls_save_to_disk(self, _, save_to_disk, create_file_name, draw, blur, *args) -> None:
+    async def test_calls_write_to_sink(self, _, write_to_sink, create_file_name, *args) -> None:
         await self.base_test()
         await self.worker.on_message(self.message)
-        save_to_disk.assert_called_once_with(
-            org_img=blur.return_value,
-            edit_img=draw.return_value,
+        write_to_sink.assert_called_once_with(
+            self.worker.storage,
+            org_img=image_util.encode_image.return_value,
+            edit_img=image_util.encode_image.return_value,
             file_name=create_file_name.return_value,
             bbox=self.worker.bbox,
             blur=self.worker.blur,
-            o_location=self.worker.output_location,
-            stream_id=self.worker.yolov5_detector.detect.return_value.stream_id,
+            sub_location=mock.ANY,
         )
 
+    @pytest.mark.asyncio
+    async def test_adds_object_key_to_slim_result(self, push_result, write_to_sink, *args) -> None:
+        write_to_sink.return_value = "2021-01-31/1/frame_blur.jpg"
+        await self.base_test(output_location="output", slim_results=True)
+        await self.worker.on_message(self.message)
+        img_meta = push_result.call_args[0][0].img_meta
+        assert img_meta["object_key"] == "2021-01-31/1/frame_blur.jpg"
+        assert img_meta["file_location"] == "output/2021-01-31/1/frame_blur.jpg"
+
+    @pytest.mark.asyncio
+    async def test_publishes_full_result_before_saving(self, push_result, write_to_sink, *args) -> None:
+        await self.base_test(output_location="output")
+        manager = mock.Mock()
+        manager.attach_mock(push_result, "push_result")
+        manager.attach_mock(write_to_sink, "write_to_sink")
+
+        await self.worker.on_message(self.message)
+
+        assert [call[0] for call in manager.mock_calls] == ["push_result", "write_to_sink"]
+        assert "object_key" not in push_result.call_args[0][0].img_meta
+
+    @pytest.mark.asyncio
+    async def test_publishes_slim_result_with_file_location(self, push_result, write_to_sink, *args) -> None:
+        write_to_sink.return_value = "2021-01-31/1/frame_blur.jpg"
+        await self.base_test(output_location="output", slim_results=True)
+        self.worker.yolov5_detector.detect.return_value = AnalyzedFrame(**self.frame.dict(), blurred_image="blurred==")
+        image_util.decode_image.return_value = np.zeros((48, 64, 3), dtype=np.uint8)
+        await self.worker.on_message(self.message)
+
+        await _push_result(self.worker, push_result.call_args[0][0])
+
+        body = json.loads(RabbitMQWorker.send_message.call_args[0][0].body)
+        assert "img" not in body
+        assert "blurred_image" not in body
+        assert body["img_meta"]["file_location"] == "output/2021-01-31/1/frame_blur.jpg"
+
+    @pytest.mark.asyncio
+    async def test_stores_in_background(self, _, write_to_sink, create_file_name, *args) -> None:
+        await self.base_test(write_queue_size=4)
+        await self.worker.on_message(self.message)
+        await self.worker.background_writer.join()
+        write_to_sink.assert_called_once_with(
+            self.worker.storage,
+            org_img=image_util.encode_image.return_value,
+            edit_img=image_util.encode_image.return_value,
+            file_name=create_file_name.return_value,
+            bbox=self.worker.bbox,
+            blur=self.worker.blur,
+            sub_location=mock.ANY,
+        )
+
+    @pytest.mark.asyncio
+    async def test_records_stage_metrics(self, *args) -> None:
+        await self.base_test()
+        analyzed_frame = AnalyzedFrame(**self.frame.dict())
+        analyzed_frame.analyser_meta = {
+            'ml_batch_size': 2, 'ml_stage_seconds': {'preprocess': 0.2, 'inference': 1.0, 'nms': 0.1}
+        }
+        self.worker.yolov5_detector.detect.return_value = analyzed_frame
+
+        await self.worker.on_message(self.message, delivered_at=0.0)
+
+        stage_seconds = self.worker.stage_seconds
+        for stage in ("consume_wait", "parse", "decode", "detect", "inference", "write", "total"):
+            assert stage_seconds.count(stage=stage) == 1
+        assert stage_seconds._sums[("inference",)] == 0.5
+        assert self.worker.frames_total.value(outcome="analysed") == 1
+        assert self.worker.frame_age_seconds.count() == 1
+
+    @pytest.mark.asyncio
+    async def test_counts_invalid_and_failed_frames(self, *args) -> None:
+        await self.base_test()
+        self.worker.yolov5_detector.detect.side_effect = RuntimeError()
+
+        await self.worker.on_message(mock.Mock(body=b"not json"))
+        with pytest.raises(RuntimeError):
+            await self.worker.on_message(self.message)
+
+        assert self.worker.frames_total.value(outcome="invalid") == 1
+        assert self.worker.frames_total.value(outcome="failed") == 1
+        assert self.worker._processing == 0
+
+    @pytest.mark.asyncio
+    async def test_continues_trace_from_header(self, push_result, *args) -> None:
+        trace = trace_util.TraceContext("abc", sampled=True, hops={"api_queued_at": 1.0})
+        message = mock.Mock(
+            body=self.message.body, headers={trace_util.TRACE_HEADER: trace.to_header()}
+        )
+
+        await self.base_test()
+        await self.worker.on_message(message)
+
+        result_trace = push_result.call_args[0][1]
+        assert result_trace.trace_id == "abc"
+        assert result_trace.sampled is True
+        assert set(result_trace.hops) == {"api_queued_at", "worker_received_at"}
+
+    @pytest.mark.asyncio
+    async def test_publishes_and_exports_trace(self, *args) -> None:
+        await self.base_test()
+        self.worker.span_exporter = mock.Mock()
+        send_message = RabbitMQWorker.send_message
+        frame = AnalyzedFrame(**self.frame.dict())
+        # Meta as set by `YOLOv5Detector.detect`
+        frame.analyser_meta = {
+            "ml_start_at": datetime(2021, 1, 31, 12, 0, 0),
+            "ml_done_at": datetime(2021, 1, 31, 12, 0, 0, 50000),
+            "ml_batch_size": 1,
+            "ml_backend": "torch",
+        }
+        trace = trace_util.TraceContext("abc", sampled=True, hops={"api_queued_at": 1.0, "worker_received_at": 2.0})
+
+        await _push_result(self.worker, frame, trace)
+
+        result_message = send_message.call_args[0][0]
+        published = json.loads(result_message.headers[trace_util.TRACE_HEADER])
+        assert published["trace_id"] == "abc"
+        assert "worker_published_at" in published["hops"]
+        assert json.loads(result_message.body)["analyser_meta"]["trace"] == published
+        exported = {call[0][0]["name"]: call[0][0] for call in self.worker.span_exporter.export.call_args_list}
+        assert list(exported) == ["raw_frame_queue", "analyse", "detect"]
+        assert exported["detect"]["duration_ms"] == pytest.approx(50.0)
+        assert exported["detect"]["attributes"]["backend"] == "torch"
+
     # TODO: Decide whether a use case remains for the test below
     # @pytest.mark.asyncio
     # async def test_calls_detect_blur_draw_file_save_in_order(
@@ -185,3 +445,106 @@ class TestRabbitMQWorker:
     #             manager.detect.return_value
     #         )
     #     ]
+
+
+@pytest.mark.asyncio
+async def test_process_executor_runs_frame_stages_in_one_submission(tmp_path) -> None:
+    img = np.full((48, 64, 3), 127, dtype=np.uint8)
+    body = {
+        **TestRabbitMQWorker.message_body,
+        "img": base64.b64encode(image_util.encode_image(img)).decode("utf-8"),
+    }
+    detector = mock.Mock()
+    detector.detect.return_value = AnalyzedFrame(
+        **RawFrame(**body).dict(),
+        detected_objects=[{
+            "detected_object_type": "garbage", "confidence": 50,
+            "bbox": {"coordinate1": [8, 8], "coordinate2": [32, 32]},
+        }],
+        object_count={"garbage": 1, "total": 1},
+    )
+
+    with mock.patch("frame_analyzer.rmq.worker.YOLOv5Detector"), \
+            mock.patch("frame_analyzer.rmq.worker.RabbitMQWorker.push_result") as push_result, \
+            mock.patch("frame_analyzer.rmq.worker._process_detector", detector):
+        worker = RabbitMQWorker(
+            weights_location="/path/to/weights", savewith=True, includepriv=True, savewithout=True,
+            blur=True, bbox=True, in_exchange_name="in_ex", in_queue_name="in_q", in_routing_key="in_rk",
+            executor_type="process", output_location=str(tmp_path),
+        )
+        # Same code path without forking, the stages still run in `_process_analyse`
+        worker.executor = ThreadPoolExecutor(max_workers=1)
+
+        with mock.patch.object(worker, "run_blocking", wraps=worker.run_blocking) as run_blocking:
+            await worker.on_message(mock.Mock(body=json.dumps(body).encode("utf-8")))
+
+    assert [call[0][0] for call in run_blocking.call_args_list] == [
+        worker_module._process_analyse, persist_util.write_to_sink
+    ]
+    result = push_result.call_args[0][0]
+    assert (result.img_meta["width"], result.img_meta["height"]) == (64, 48)
+    assert image_util.decode_image(base64.b64decode(result.blurred_image)).shape == img.shape
+    assert (tmp_path / "2021-01-31" / "1").is_dir()
+
+
+@pytest.mark.asyncio
+async def test_process_executor_renders_batch_in_detecting_process(tmp_path) -> None:
+    img = np.full((48, 64, 3), 127, dtype=np.uint8)
+    body = {
+        **TestRabbitMQWorker.message_body,
+        "img": base64.b64encode(image_util.encode_image(img)).decode("utf-8"),
+    }
+    detected = AnalyzedFrame(
+        **RawFrame(**body).dict(),
+        detected_objects=[{
+            "detected_object_type": "garbage", "confidence": 50,
+            "bbox": {"coordinate1": [8, 8], "coordinate2": [32, 32]},
+        }],
+        object_count={"garbage": 1, "total": 1},
+    )
+    detector = mock.Mock()
+    detector.detect_batch.side_effect = lambda frames, contexts: [detected.copy(deep=True) for _ in frames]
+
+    with mock.patch("frame_analyzer.rmq.worker.YOLOv5Detector"), \
+            mock.patch("frame_analyzer.rmq.worker.RabbitMQWorker.push_result") as push_result, \
+            mock.patch("frame_analyzer.rmq.worker._process_detector", detector), \
+            mock.patch("frame_analyzer.rmq.worker.image_util.decode_image", wraps=image_util.decode_image) as decode:
+        worker = RabbitMQWorker(
+            weights_location="/path/to/weights", savewith=True, includepriv=True, savewithout=True,
+            blur=True, bbox=True, in_exchange_name="in_ex", in_queue_name="in_q", in_routing_key="in_rk",
+            executor_type="process", output_location=str(tmp_path), batch_size=2,
+        )
+        worker.executor = ThreadPoolExecutor(max_workers=1)
+
+        with mock.patch.object(worker, "run_blocking", wraps=worker.run_blocking) as run_blocking:
+            await asyncio.gather(*[
+                worker.on_message(mock.Mock(body=json.dumps(body).encode("utf-8"))) for _ in range(2)
+            ])
+
+    submitted = [call[0][0] for call in run_blocking.call_args_list]
+    assert submitted.count(worker_module._process_detect_batch) == 1
+    assert worker_module._process_analyse not in submitted
+    # Every frame is decoded once, in the process that detected and rendered it
+    assert decode.call_count == 2
+    for call in push_result.call_args_list:
+        result = call[0][0]
+        assert (result.img_meta["width"], result.img_meta["height"]) == (64, 48)
+        assert image_util.decode_image(base64.b64decode(result.blurred_image)).shape == img.shape
+
+
+def test_process_executor_exports_model_once_before_starting_processes() -> None:
+    with mock.patch("frame_analyzer.rmq.worker.YOLOv5Detector"), \
+            mock.patch("frame_analyzer.rmq.worker.ProcessPoolExecutor") as process_pool, \
+            mock.patch(
+                "frame_analyzer.rmq.worker.backends.prepare_model", return_value="/path/to/weights.onnx"
+            ) as prepare_model:
+        RabbitMQWorker(
+            weights_location="/path/to/weights.pt", savewith=False, includepriv=False, savewithout=False,
+            blur=False, bbox=False, in_exchange_name="in_ex", in_queue_name="in_q", in_routing_key="in_rk",
+            executor_type="process", executor_workers=4, backend="onnx",
+        )
+
+    prepare_model.assert_called_once_with("/path/to/weights.pt", "onnx", img_size=640, precision="fp32")
+    weights_location, _, detector_options = process_pool.call_args[1]["initargs"]
+    assert weights_location == "/path/to/weights.onnx"
+    assert detector_options["backend"] == "onnx"
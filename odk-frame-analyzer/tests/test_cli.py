@@ -0,0 +1,115 @@
+import csv
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import cv2
+import numpy as np
+import pytest
+
+import cli
+from frame_analyzer.schemas.frame import AnalyzedFrame, ImgFrame
+
+
+def write_images(folder, names):
+    for name in names:
+        cv2.imwrite(str(folder / name), np.zeros((32, 48, 3), dtype=np.uint8))
+
+
+def weights_file(folder) -> str:
+    weights = folder / "weights.pt"
+    weights.write_bytes(b"")
+    return str(weights)
+
+
+def analyzed(*args, **kwargs) -> AnalyzedFrame:
+    return AnalyzedFrame(**ImgFrame().dict(), detected_objects=[], object_count={"total": 0})
+
+
+def test_find_images_walks_folders_in_order(tmp_path) -> None:
+    (tmp_path / "b").mkdir()
+    write_images(tmp_path, ["2.jpg", "1.png"])
+    write_images(tmp_path / "b", ["3.jpg"])
+    (tmp_path / "notes.txt").write_text("not an image")
+
+    assert list(cli._find_images(str(tmp_path))) == [
+        str(tmp_path / "1.png"), str(tmp_path / "2.jpg"), str(tmp_path / "b" / "3.jpg")
+    ]
+
+
+def test_prefetch_keeps_order_and_reads_ahead() -> None:
+    submitted = []
+
+    def read(item):
+        submitted.append(item)
+        time.sleep(0.01 * (5 - item))  # Later items finish first
+        return item * 10
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        prefetched = cli._prefetch(executor, read, range(5), ahead=3)
+        first_item, first = next(prefetched)
+        assert len(submitted) == 3
+        results = [(first_item, first.result())] + [(item, future.result()) for item, future in prefetched]
+
+    assert results == [(i, i * 10) for i in range(5)]
+
+
+@mock.patch("cli.YOLOv5Detector")
+@pytest.mark.parametrize("results_name", ["results.csv", "results.jsonl"])
+def test_batch_input_streams_results(detector, tmp_path, results_name) -> None:
+    write_images(tmp_path, [f"{i}.jpg" for i in range(5)])
+    (tmp_path / "broken.jpg").write_bytes(b"not a jpeg")
+    detect_batch = detector.return_value.detect_batch
+    detect_batch.side_effect = lambda frames, contexts: [analyzed() for _ in frames]
+    results_file = str(tmp_path / results_name)
+
+    count = cli._handle_batch_input(
+        str(tmp_path), weights_file(tmp_path), False, False, False, results_file=results_file, batch_size=2, workers=2
+    )
+
+    assert count == 5
+    assert [len(call.args[1]) for call in detect_batch.call_args_list] == [2, 2, 1]
+    with open(results_file) as f:
+        if results_name.endswith(".jsonl"):
+            rows = [json.loads(line) for line in f]
+        else:
+            rows = list(csv.DictReader(f))
+    assert [row["filename"] for row in rows] == [f"{i}.jpg" for i in range(5)]
+
+
+@mock.patch("cli.YOLOv5Detector")
+@pytest.mark.parametrize("results_name", ["results.csv", "results.jsonl"])
+def test_input_writes_results_by_extension(detector, tmp_path, results_name) -> None:
+    images = tmp_path / "images"
+    images.mkdir()
+    write_images(images, ["0.jpg", "1.jpg"])
+    detector.return_value.detect.side_effect = analyzed
+    results_file = str(tmp_path / results_name)
+
+    results = cli._handle_input(str(images), weights_file(tmp_path), False, False, False)
+    cli._create_results_output(results, results_file)
+
+    with open(results_file) as f:
+        if results_name.endswith(".jsonl"):
+            rows = [json.loads(line) for line in f]
+            assert rows[0]["object_count"] == {"total": 0}
+        else:
+            rows = list(csv.DictReader(f))
+    assert sorted(row["filename"] for row in rows) == ["0.jpg", "1.jpg"]
+
+
+@mock.patch("cli.write_to_disk")
+@mock.patch("cli.YOLOv5Detector")
+def test_batch_input_saves_images(detector, write_to_disk, tmp_path) -> None:
+    write_images(tmp_path, ["0.jpg", "1.jpg"])
+    detector.return_value.detect_batch.side_effect = lambda frames, contexts: [analyzed() for _ in frames]
+
+    cli._handle_batch_input(
+        str(tmp_path / "0.jpg"), weights_file(tmp_path), True, True, True,
+        results_file=str(tmp_path / "results.csv"), batch_size=2,
+    )
+
+    write_to_disk.assert_called_once_with(
+        org_img=mock.ANY, edit_img=mock.ANY, file_name="0", bbox=True, blur=True
+    )
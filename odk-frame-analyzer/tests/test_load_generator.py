@@ -0,0 +1,91 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+import load_generator
+from frame_analyzer.schemas.frame import RawFrame
+from frame_analyzer.utils.dedup_util import distance_m
+
+
+class FakeSender(load_generator.Sender):
+    def __init__(self, fail_stream: str = None):
+        self.frames = []
+        self.fail_stream = fail_stream
+
+    async def send(self, frame: RawFrame) -> None:
+        if frame.stream_id == self.fail_stream:
+            raise ConnectionError("connection lost")
+        self.frames.append(frame)
+
+
+class FakeConnection:
+    def __init__(self):
+        self.rows = []
+
+    async def fetch(self, query, stream_ids, since):
+        return [row for row in self.rows if row['stream_id'] in stream_ids and row['taken_at'] >= since]
+
+
+def frame(stream_id: str, taken_at: datetime) -> RawFrame:
+    return RawFrame(img="", taken_at=taken_at, lat_lng={'lat': 52.0, 'lng': 4.9}, stream_id=stream_id)
+
+
+def test_gps_track_drives_at_speed() -> None:
+    track = load_generator.GpsTrack(random.Random(0), speed=10.0)
+
+    start = track.position()
+    end = track.advance(2.0)
+
+    assert distance_m(start, end) == pytest.approx(20.0, rel=0.01)
+    assert distance_m(start, {'lat': load_generator.CENTER[0], 'lng': load_generator.CENTER[1]}) <= 3000
+
+
+def test_percentiles() -> None:
+    result = load_generator.percentiles(list(range(1, 101)))
+
+    assert result == {'p50': 50, 'p90': 90, 'p95': 95, 'p99': 99, 'max': 100}
+    assert load_generator.percentiles([])['p50'] is None
+
+
+@pytest.mark.asyncio
+async def test_sends_at_target_rate_from_every_stream() -> None:
+    sender = FakeSender()
+    generator = load_generator.LoadGenerator(sender, ["img"], streams=4, rate=40.0, duration=0.5, seed=1)
+
+    report = await generator.run()
+
+    assert report['sent'] == len(sender.frames) == 20
+    assert {frame.stream_id for frame in sender.frames} == set(generator.stream_ids)
+    assert report['failed'] == 0
+
+
+@pytest.mark.asyncio
+async def test_counts_failed_sends() -> None:
+    generator = load_generator.LoadGenerator(FakeSender(), ["img"], streams=2, rate=20.0, duration=0.2, seed=1)
+    generator.sender.fail_stream = generator.stream_ids[0]
+
+    report = await generator.run()
+
+    assert report['failed'] == 2
+    assert report['sent'] == 2
+
+
+@pytest.mark.asyncio
+async def test_latency_tracker_finds_rows_of_sent_frames() -> None:
+    tracker = load_generator.LatencyTracker("postgresql://", poll_interval=0.01)
+    tracker.stream_ids = ["a", "b"]
+    tracker._conn = connection = FakeConnection()
+    taken_at = datetime.now() - timedelta(seconds=2)
+    tracker.add(frame("a", taken_at))
+    tracker.add(frame("b", taken_at))
+
+    connection.rows = [
+        {'stream_id': "a", 'taken_at': taken_at},
+        {'stream_id': "c", 'taken_at': taken_at},
+    ]
+    await tracker.poll_once()
+
+    assert tracker.pending == {("b", taken_at)}
+    assert len(tracker.latencies) == 1
+    assert tracker.latencies[0] >= 2
@@ -0,0 +1,82 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from frame_analyzer.schemas.frame import AnalyzedFrame, RawFrame
+from frame_analyzer.utils import dedup_util
+
+
+def street_image(seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 255, (72, 128, 3), dtype=np.uint8)
+
+
+def frame(seconds: float = 0, lat: str = "52.367527") -> RawFrame:
+    return RawFrame(
+        img="",
+        taken_at=datetime(2021, 1, 31, 12, 34, 56) + timedelta(seconds=seconds),
+        lat_lng={"lat": lat, "lng": "4.901257"},
+        stream_id="1",
+    )
+
+
+def analyzed(raw_frame: RawFrame) -> AnalyzedFrame:
+    return AnalyzedFrame(
+        **raw_frame.dict(),
+        object_count={"garbage": 1, "total": 1},
+        img_meta={"file_location": "output/frame.jpg"},
+    )
+
+
+def test_dhash_is_robust_to_noise() -> None:
+    img = street_image()
+    noisy = np.clip(img.astype(int) + np.random.default_rng(1).integers(-3, 4, img.shape), 0, 255).astype(np.uint8)
+
+    assert dedup_util.hamming_distance(dedup_util.dhash(img), dedup_util.dhash(noisy)) <= 5
+    assert dedup_util.hamming_distance(dedup_util.dhash(img), dedup_util.dhash(street_image(2))) > 5
+
+
+def test_distance_m() -> None:
+    amsterdam = {"lat": "52.367527", "lng": "4.901257"}
+
+    assert dedup_util.distance_m(amsterdam, {"lat": "52.367527", "lng": "4.901257"}) == 0
+    assert dedup_util.distance_m(amsterdam, {"lat": "52.368527", "lng": "4.901257"}) == pytest.approx(111, rel=0.01)
+    assert dedup_util.distance_m(amsterdam, {}) is None
+
+
+@pytest.mark.parametrize("duplicate, expected", [
+    (frame(seconds=10), True),
+    (frame(seconds=10, lat="52.368527"), False),  # moved ~111m
+    (frame(seconds=120), False),  # too long after
+])
+def test_matches_near_duplicates(duplicate, expected) -> None:
+    dedup = dedup_util.NearDuplicateFilter(max_hamming=5, max_distance=5.0, max_interval=60.0)
+    img_hash = dedup_util.dhash(street_image())
+    dedup.update(analyzed(frame()), img_hash)
+
+    assert (dedup.match(duplicate, img_hash) is not None) == expected
+    assert dedup.stats()["skipped"] == int(expected)
+
+
+def test_does_not_match_different_image() -> None:
+    dedup = dedup_util.NearDuplicateFilter()
+    dedup.update(analyzed(frame()), dedup_util.dhash(street_image()))
+
+    assert dedup.match(frame(seconds=10), dedup_util.dhash(street_image(2))) is None
+
+
+def test_links_to_previous_frame() -> None:
+    dedup = dedup_util.NearDuplicateFilter()
+    img_hash = dedup_util.dhash(street_image())
+    dedup.update(analyzed(frame()), img_hash)
+    duplicate = frame(seconds=10)
+
+    linked = dedup.link(duplicate, dedup.match(duplicate, img_hash))
+
+    assert linked.taken_at == duplicate.taken_at
+    assert linked.object_count == {"garbage": 1, "total": 1}
+    assert linked.analyser_meta["duplicate_of"] == {
+        "taken_at": "2021-01-31T12:34:56",
+        "file_location": "output/frame.jpg",
+    }
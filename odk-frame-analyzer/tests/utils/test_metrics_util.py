@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+
+from frame_analyzer.utils import metrics_util
+
+
+def test_renders_counter_per_label() -> None:
+    registry = metrics_util.Registry()
+    frames = registry.counter("frames_total", "Frames", ("outcome",))
+
+    frames.inc(outcome="analysed")
+    frames.inc(2, outcome="duplicate")
+
+    assert frames.value(outcome="duplicate") == 2
+    assert registry.render() == (
+        "# HELP frames_total Frames\n"
+        "# TYPE frames_total counter\n"
+        'frames_total{outcome="analysed"} 1.0\n'
+        'frames_total{outcome="duplicate"} 2.0\n'
+    )
+
+
+def test_rejects_wrong_labels() -> None:
+    frames = metrics_util.Registry().counter("frames_total", "Frames", ("outcome",))
+
+    with pytest.raises(ValueError):
+        frames.inc(stage="decode")
+
+
+def test_rejects_duplicate_metric() -> None:
+    registry = metrics_util.Registry()
+    registry.gauge("queue_size", "Queue size")
+
+    with pytest.raises(ValueError):
+        registry.counter("queue_size", "Queue size")
+
+
+def test_histogram_renders_cumulative_buckets() -> None:
+    histogram = metrics_util.Histogram("stage_seconds", "Stages", ("stage",), buckets=(0.1, 1.0))
+
+    histogram.observe(0.05, stage="decode")
+    histogram.observe(0.5, stage="decode")
+    histogram.observe(5, stage="decode")
+
+    assert histogram.count(stage="decode") == 3
+    assert histogram.samples() == [
+        'stage_seconds_bucket{stage="decode",le="0.1"} 1',
+        'stage_seconds_bucket{stage="decode",le="1.0"} 2',
+        'stage_seconds_bucket{stage="decode",le="+Inf"} 3',
+        'stage_seconds_sum{stage="decode"} 5.55',
+        'stage_seconds_count{stage="decode"} 3',
+    ]
+
+
+def test_histogram_times_block() -> None:
+    histogram = metrics_util.Histogram("stage_seconds", "Stages", ("stage",))
+
+    with pytest.raises(RuntimeError):
+        with histogram.time(stage="detect"):
+            raise RuntimeError()
+
+    assert histogram.count(stage="detect") == 1
+
+
+def test_gauge_reads_function_on_render() -> None:
+    queue = [1, 2]
+    gauge = metrics_util.Gauge("queue_size", "Queue size")
+    gauge.set_function(lambda: len(queue))
+
+    queue.append(3)
+
+    assert gauge.value() == 3
+    assert gauge.samples() == ["queue_size 3.0"]
+
+
+@pytest.mark.asyncio
+async def test_serves_metrics() -> None:
+    registry = metrics_util.Registry()
+    registry.counter("frames_total", "Frames").inc()
+    server = await metrics_util.serve(registry, port=0, host="127.0.0.1")
+    port = server.sockets[0].getsockname()[1]
+
+    async def get(path):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+        response = await reader.read()
+        writer.close()
+        return response.decode()
+
+    try:
+        metrics = await get("/metrics")
+        not_found = await get("/")
+    finally:
+        server.close()
+        await server.wait_closed()
+
+    assert metrics.startswith("HTTP/1.1 200 OK")
+    assert "frames_total 1.0\n" in metrics
+    assert not_found.startswith("HTTP/1.1 404")
@@ -0,0 +1,118 @@
+import asyncio
+import os
+from unittest import mock
+
+import pytest
+
+from frame_analyzer.utils import persist_util, storage_util
+
+
+def test_write_to_disk_returns_location(tmp_path) -> None:
+    location = persist_util.write_to_disk(
+        org_img=b"org", edit_img=b"edit", file_name="frame", blur=True, bbox=True,
+        o_location=str(tmp_path), sub_location="2021-01-31/1",
+    )
+
+    assert location == f"{tmp_path}/2021-01-31/1/frame_blur.jpg"
+    with open(location, "rb") as f:
+        assert f.read() == b"org"
+    with open(f"{tmp_path}/2021-01-31/1/frame_blur_bbox.jpg", "rb") as f:
+        assert f.read() == b"edit"
+
+
+def test_write_to_sink_returns_key() -> None:
+    sink = mock.Mock(put=mock.Mock(side_effect=lambda key, data: key))
+
+    key = persist_util.write_to_sink(
+        sink, org_img=b"org", edit_img=b"edit", file_name="frame", blur=True, bbox=True, sub_location="2021-01-31/1",
+    )
+
+    assert key == "2021-01-31/1/frame_blur.jpg"
+    sink.put.assert_has_calls([
+        mock.call("2021-01-31/1/frame_blur.jpg", b"org"),
+        mock.call("2021-01-31/1/frame_blur_bbox.jpg", b"edit"),
+    ])
+
+
+@pytest.mark.asyncio
+async def test_background_writer_writes_in_background(tmp_path) -> None:
+    sink = storage_util.LocalSink(str(tmp_path))
+    writer = persist_util.BackgroundWriter(sink, max_queue_size=4, workers=2)
+
+    keys = [
+        await writer.write(org_img=str(i).encode(), file_name=f"frame{i}", blur=True, sub_location="1")
+        for i in range(10)
+    ]
+    await writer.join()
+
+    assert keys == [f"1/frame{i}_blur.jpg" for i in range(10)]
+    assert all(os.path.exists(sink.location(key)) for key in keys)
+    assert writer.written == 10
+    assert writer.queue_size == 0
+
+
+@pytest.mark.asyncio
+async def test_background_writer_applies_back_pressure(tmp_path) -> None:
+    writer = persist_util.BackgroundWriter(storage_util.LocalSink(str(tmp_path)), max_queue_size=1, workers=1)
+    release = asyncio.Event()
+    loop = asyncio.get_running_loop()
+
+    def blocked_write(sink, **kwargs):
+        asyncio.run_coroutine_threadsafe(release.wait(), loop).result()
+
+    with mock.patch("frame_analyzer.utils.persist_util.write_to_sink", side_effect=blocked_write):
+        await writer.write(org_img=b"1", file_name="frame1")
+        await asyncio.sleep(0.05)  # taken from the queue, being written
+        await writer.write(org_img=b"2", file_name="frame2")
+
+        # The queue is full, so the next write waits
+        third = asyncio.ensure_future(writer.write(org_img=b"3", file_name="frame3"))
+        await asyncio.sleep(0.05)
+        assert not third.done()
+
+        release.set()
+        await third
+        await writer.join()
+
+    assert writer.written == 3
+
+
+@pytest.mark.asyncio
+async def test_background_writer_syncs_in_batches(tmp_path) -> None:
+    writer = persist_util.BackgroundWriter(storage_util.LocalSink(str(tmp_path)), max_queue_size=4, workers=1, sync_every=2)
+
+    with mock.patch("frame_analyzer.utils.persist_util.os.sync") as sync:
+        for i in range(5):
+            await writer.write(org_img=b"img", file_name=f"frame{i}")
+        await writer.join()
+
+    # After the 2nd and 4th image, and the remaining one when joining
+    assert sync.call_count == 3
+
+
+@pytest.mark.asyncio
+async def test_background_writer_counts_failed_writes(tmp_path) -> None:
+    writer = persist_util.BackgroundWriter(storage_util.LocalSink(str(tmp_path)), max_queue_size=4, workers=1)
+
+    with mock.patch("frame_analyzer.utils.persist_util.write_to_sink", side_effect=OSError("disk full")):
+        await writer.write(org_img=b"img", file_name="frame")
+        await writer.join()
+
+    assert writer.failed == 1
+    assert writer.written == 0
+
+
+@pytest.mark.asyncio
+async def test_background_writer_reports_failed_key(tmp_path) -> None:
+    on_failure = mock.Mock()
+    writer = persist_util.BackgroundWriter(
+        storage_util.LocalSink(str(tmp_path)), max_queue_size=4, workers=1, on_failure=on_failure
+    )
+    error = OSError("disk full")
+
+    with mock.patch("frame_analyzer.utils.persist_util.write_to_sink", side_effect=error):
+        key = await writer.write(org_img=b"img", file_name="frame", blur=True, sub_location="2021-01-31/1")
+        await writer.join()
+
+    on_failure.assert_called_once_with(key, error)
+    assert key == "2021-01-31/1/frame_blur.jpg"
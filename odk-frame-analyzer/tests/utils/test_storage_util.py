@@ -0,0 +1,91 @@
+import os
+import pickle
+from unittest import mock
+
+import pytest
+
+from frame_analyzer.utils import storage_util
+
+
+def test_local_sink_writes_file_and_returns_key(tmp_path) -> None:
+    sink = storage_util.LocalSink(str(tmp_path))
+
+    key = sink.put("2021-01-31/1/frame.jpg", b"img")
+
+    assert key == "2021-01-31/1/frame.jpg"
+    assert sink.location(key) == f"{tmp_path}/2021-01-31/1/frame.jpg"
+    with open(sink.location(key), "rb") as f:
+        assert f.read() == b"img"
+
+
+def test_local_sink_creates_folder_once(tmp_path) -> None:
+    sink = storage_util.LocalSink(str(tmp_path))
+
+    with mock.patch("frame_analyzer.utils.storage_util.os.makedirs", wraps=os.makedirs) as makedirs:
+        sink.put("a/frame1.jpg", b"1")
+        sink.put("a/frame2.jpg", b"2")
+
+    makedirs.assert_called_once_with(f"{tmp_path}/a", exist_ok=True)
+
+
+def test_local_sink_recreates_removed_folder(tmp_path) -> None:
+    sink = storage_util.LocalSink(str(tmp_path))
+    sink.put("b/frame1.jpg", b"1")
+    os.remove(sink.location("b/frame1.jpg"))
+    os.rmdir(f"{tmp_path}/b")
+
+    sink.put("b/frame2.jpg", b"2")
+
+    assert os.path.exists(sink.location("b/frame2.jpg"))
+
+
+def test_storage_sink_is_abstract() -> None:
+    with pytest.raises(TypeError):
+        storage_util.StorageSink()
+
+
+@mock.patch("frame_analyzer.utils.storage_util.S3Sink._create_transfer_config")
+@mock.patch("frame_analyzer.utils.storage_util.S3Sink._create_client")
+class TestS3Sink:
+    def test_uploads_under_prefixed_key(self, create_client, create_transfer_config) -> None:
+        sink = storage_util.S3Sink("frames", prefix="odk/")
+
+        key = sink.put("2021-01-31/1/frame.jpg", b"img")
+
+        assert key == "2021-01-31/1/frame.jpg"
+        assert sink.location(key) == "s3://frames/odk/2021-01-31/1/frame.jpg"
+        upload = create_client.return_value.upload_fileobj
+        upload.assert_called_once_with(
+            mock.ANY, "frames", "odk/2021-01-31/1/frame.jpg",
+            ExtraArgs={"ContentType": "image/jpeg"},
+            Config=create_transfer_config.return_value,
+        )
+        assert upload.call_args[0][0].read() == b"img"
+
+    def test_shares_one_client(self, create_client, _) -> None:
+        sink = storage_util.S3Sink("frames")
+
+        sink.put("frame1.jpg", b"1")
+        sink.put("frame2.jpg", b"2")
+
+        create_client.assert_called_once()
+
+    def test_pickles_without_client(self, create_client, _) -> None:
+        sink = storage_util.S3Sink("frames", endpoint_url="http://localhost:9000")
+        sink.put("frame.jpg", b"img")
+
+        copy = pickle.loads(pickle.dumps(sink))
+
+        assert copy._client is None
+        assert copy.endpoint_url == "http://localhost:9000"
+
+
+def test_create_sink() -> None:
+    assert isinstance(storage_util.create_sink("local", "output"), storage_util.LocalSink)
+    assert isinstance(storage_util.create_sink("s3", s3_bucket="frames"), storage_util.S3Sink)
+
+
+@pytest.mark.parametrize("storage, options", [("s3", {}), ("gcs", {"s3_bucket": "frames"})])
+def test_create_sink_raises_on_invalid_storage(storage, options) -> None:
+    with pytest.raises(ValueError):
+        storage_util.create_sink(storage, **options)
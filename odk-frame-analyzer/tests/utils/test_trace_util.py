@@ -0,0 +1,70 @@
+import json
+import socket
+
+import pytest
+
+from frame_analyzer.utils import trace_util
+
+
+def test_continues_trace_from_headers() -> None:
+    headers = {trace_util.TRACE_HEADER: json.dumps({"trace_id": "abc", "sampled": True, "hops": {"api_queued_at": 1.0}})}
+
+    trace = trace_util.TraceContext.from_headers(headers)
+
+    assert trace.trace_id == "abc"
+    assert trace.sampled is True
+    assert trace.hops == {"api_queued_at": 1.0}
+
+
+@pytest.mark.parametrize("headers", [None, {}, {trace_util.TRACE_HEADER: "not json"}, {trace_util.TRACE_HEADER: "{}"}])
+def test_starts_trace_without_valid_header(headers) -> None:
+    trace = trace_util.TraceContext.from_headers(headers, sample_rate=1.0)
+
+    assert len(trace.trace_id) == 32
+    assert trace.sampled is True
+    assert trace.hops == {}
+
+
+def test_creates_span_between_hops() -> None:
+    trace = trace_util.TraceContext("abc", hops={"api_queued_at": 1.0})
+    trace.stamp("worker_received_at", 1.25)
+
+    span = trace.span("raw_frame_queue", "api_queued_at", "worker_received_at", stream_id="1", batch_size=2)
+
+    assert span["trace_id"] == "abc"
+    assert span["stream_id"] == "1"
+    assert span["duration_ms"] == 250.0
+    assert span["attributes"] == {"batch_size": 2}
+    assert trace.span("analyse", "worker_received_at", "worker_published_at") is None
+
+
+def test_file_exporter_appends_json_lines(tmp_path) -> None:
+    location = str(tmp_path / "spans.jsonl")
+    exporter = trace_util.create_exporter(location)
+
+    exporter.export(trace_util.create_span("abc", "analyse", 1.0, 2.0))
+    exporter.export(trace_util.create_span("def", "analyse", 1.0, 2.0))
+    exporter.close()
+
+    with open(location) as f:
+        assert [json.loads(line)["trace_id"] for line in f] == ["abc", "def"]
+
+
+def test_udp_exporter_sends_datagram() -> None:
+    collector = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    collector.bind(("127.0.0.1", 0))
+    collector.settimeout(5)
+    port = collector.getsockname()[1]
+
+    exporter = trace_util.create_exporter(f"udp://127.0.0.1:{port}")
+    exporter.export(trace_util.create_span("abc", "analyse", 1.0, 2.0))
+
+    assert json.loads(collector.recv(65536))["trace_id"] == "abc"
+    exporter.close()
+    collector.close()
+
+
+def test_rejects_invalid_collector_address() -> None:
+    assert trace_util.create_exporter("") is None
+    with pytest.raises(ValueError):
+        trace_util.create_exporter("udp://localhost")